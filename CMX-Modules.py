@@ -31,9 +31,11 @@ SOFTWARE.
 # This file contains a series of routines to locate clients with IOCs (by MAC address), and create a file based on that MAC
 #   address, showing the location of that client.  Development was done primarily on CMX with v2 API calls.  Later I started
 #   adding and modifying for v3 API calls, but I didn't have a v3 server that consistently provided me with data.  So you will
-#   see tests in many routines like [if CMXversions.Loc_api_version == "v2":], but as a whole, this program does not support
-#   v3 API's.  Primarily because much of the client/map data is included in the v2, "{}/api/location/v2/clients?macAddress={}"
-#   call, but it requires additional API calls to get to the same point.   This is left to the reader.
+#   see tests in many routines like [if CMXversions.Loc_api_version == "v2":].  v3 clients (CMX 10.4+) are now parsed into
+#   CMX_ClientLocation_v3, which also answers to the v2 field names, so the lists, maps and updates work the same on either.
+#   Much of the client/map data is included in the v2, "{}/api/location/v2/clients?macAddress={}" call, but a v3 client only
+#   carries its floorRefId.  Its floor image comes from the floor table [CMX_Floors], and until that floor is known the
+#   client is drawn on the default map.
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 # There is no "main()" program per-se for these routines.  You simply need to call the CMX_lookup() routine to get your client
 # added to the InfectMacList and to generate an image of their location.  The three external-facing routines you maybe interested
@@ -54,8 +56,11 @@ except:
 	pass
 import json
 import datetime, csv, base64, random, copy
-from PIL import Image                                   # Image manipulation tools, From:  "pip install Pillow"
+import os, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageDraw                        # Image manipulation tools, From:  "pip install Pillow"
 from pathlib import Path
+from urllib.parse import quote
 #
 # I create API "classes" for each call that I use.  I offload them to an external file for readability, and import only the ones I use.
 # The API "class" may contain information specific to this routine and NOT part of the API response itself.  Those are identified with 
@@ -65,6 +70,22 @@ from pathlib import Path
 #from cmx_classes import CMX_ClientLocation             # Include CMX Client Location Class
 #from cmx_classes import CMX_MapsCount
 from cmx_classes import *
+from cmx_session import CMX_Session, CMX_LocalTransport # Pooled keep-alive HTTP session used for every CMX API call
+from cmx_cache import CMX_RenderCache, CMX_render_key, CMX_composite_key   # Skips re-rendering maps of clients that haven't moved
+from cmx_cache import CMX_ImageCache                    # Keeps decoded floor plans & icons in memory
+from cmx_cache import CMX_LocationCache                 # Recent single-MAC answers from CMX, with a TTL
+from cmx_parser import CMX_Parser, CMX_ParseReport, CMX_v2ClientSchema, CMX_v3ClientSchema, CMXjsonLoads  # Compiled client parsers  (orjson when installed)
+from cmx_floors import CMX_FloorResolver                # floorRefId --> floor image & dimensions for v3 clients
+from cmx_transform import CMX_TransformCache            # Floor units --> pixels on the floor image, per floor
+from cmx_registry import CMX_ClientRegistry, CMX_client_mac, CMX_client_floor, normalize_CMX_mac  # MAC-indexed registry behind InfectMacList & QuarantineMacList
+from cmx_store import CMX_ClientStore                   # Append-only on-disk copy of the tracked clients
+from cmx_poller import CMX_Poller                       # Re-polls the tracked clients and reports the ones that moved
+from cmx_history import CMX_LocationHistory             # Trail of where each tracked client has been
+from cmx_spatial import CMX_SpatialIndex                # Per-floor grid of client positions, for proximity queries
+from cmx_render import CMX_RenderQueue, CMX_render_map, CMX_paste_icon, CMX_save_map   # Draws client maps on a worker pool
+from cmx_render import CMX_RenderProfile, CMX_RenderProfiles, CMX_draw_map           # Format, quality, size and crop of the client maps
+from cmx_tiles import CMX_TileCache                     # Floor plan tile pyramids with per-client overlay tiles
+from concurrent.futures import Future
 
 #
 # I keep a number of things into what I call "Environment Variable" file.  Generally this file contains sensitive information like credentials and tokens.
@@ -88,12 +109,24 @@ RunNumb = 0
 #domains_db     = TinyDBs+"domains_db.json"
 #threats_db     = TinyDBs+"threats_db.json"
 #clients_db     = TinyDBs+"clients_db.json"		        # CMX Clients Database - Not going to build, but will use internal structures instead.
+clients_db      = TinyLoc+"clients_db.jsonl"            # Journal of the tracked clients, reloaded at startup  [See:  load_CMX_store()]
 
 MapLocation		= "CMX/FloorPlans/"		                # Location for all static CMX Map files & Icons  [For now all maps are placed there manually - See get_CMX_maps()]
 DefaultMap		= MapLocation+"blankfloor.jpg"	        # Default map to return in case of failure.
 IconLocation    = "CMX/Icons/"                          # Location of map Icons
 MacMaps         = "CMX/MACmaps/"                        # Default location for Client IOC location Maps
 ThreatIcon      = IconLocation+"poiYellow.jpg"          # Choose a map icon to indicate a client with an IOC.
+MapFormat       = "PNG"                                 # Image format of the composite and path maps
+MapProfile      = "full"                                # Render profile of the client maps in "MacMaps":  a name in CMX_RenderProfiles or a CMX_RenderProfile
+FloorMaps       = "CMX/FloorMaps/"                      # Location for the composite maps of all tracked clients on a floor  [See:  Map_CMXfloors()]
+StatusIcons     = {"IoC":         ThreatIcon,           # Icon used for each client status on the composite floor maps
+                   "Quarantined": IconLocation+Dots["Red"],
+                   "OffNet":      IconLocation+Dots["Gray"]}
+CMXclientMaps   = True                                  # Draw one map per client in "MacMaps" on each lookup
+CMXfloorMaps    = False                                 # Also re-draw the composite map of the client's floor on each lookup
+FloorTiles      = "CMX/FloorTiles/"                     # Location for the tile pyramids of the floor plans  [See:  Map_CMXtiles()]
+CMXtileMaps     = False                                 # Also re-draw the client's overlay tiles in "FloorTiles" on each lookup
+CMXtileSize     = 256                                   # Width and height of a floor tile in pixels
 
 Debug          	= False									# Generic Debug toggle.  Turn this on to get all Debug diagnostics.
 CMX_Init	  	= False 								# Initialization flag - Indicates if the CMX system has been initialized or not.
@@ -105,9 +138,58 @@ DebugREQ       	= 0										# Get detailed response information from each "requ
 CMXclientCount 	= ""                                    # Global Placeholder for CMX Client Count       [Class: CMX_ClientCount]
 CMXversions    	= ""                                    # Global Placeholder for CMX Code Version       [Class: CMX_version]
 MapsCounts      = ""                                    # Global Placeholder for CMX Campus information [Class: CMX_MapCounts]
+MapsCountsTime  = 0.0                                   # When "MapsCounts" was fetched  (time.monotonic())
+CMXmapsMaxAge   = 3600                                  # Seconds the campus hierarchy is reused before it is fetched again
 CMXclientList  	= []                                    # Master List of ALL CMX Clients seen on CMX.  (Used for Sandbox Testing not for production.)
-InfectMacList  	= []                                    # List of Infected MAC addresses (from "threats_db.json")
-QuarantineMacList = []									# List of Quarantined MAC addresses.
+CMXregistry     = CMX_ClientRegistry(lambda newData, oldData: update_CMXclient(newData, oldData))  # Every tracked client, keyed by MAC [Class: CMX_ClientRegistry]
+InfectMacList  	= CMXregistry.view("IoC","OffNet")      # List of Infected MAC addresses (from "threats_db.json")  [A view of CMXregistry]
+QuarantineMacList = CMXregistry.view("Quarantined")		# List of Quarantined MAC addresses.  [A view of CMXregistry]
+CMX_Persist     = True                                  # Keep the tracked clients on disk in "clients_db", so a restart doesn't lose them
+CMXstore        = ""                                    # Global Placeholder for the client store  [Class: CMX_ClientStore]  (See load_CMX_store())
+CMXstoreCompact = 1000                                  # Journal lines allowed beyond one per client before it is compacted
+
+CMXsession      = ""                                    # Global Placeholder for the shared CMX HTTP session [Class: CMX_Session]  (See get_CMX_session())
+CMXpoolSize     = 10                                    # Keep-alive connections held open to the CMX host
+CMXtimeout      = (3.05, 15)                            # Default (connect, read) timeout in seconds for each CMX API call
+CMXretries      = 1                                     # Connection retries before a CMX API call gives up
+CMXpageSize     = 1000                                  # Clients per request when streaming the client list  [See:  iter_CMX_clients()]
+CMXscheme       = "https"                               # URL scheme of the CMX API.  ("http" for the stand-in server in cmx_mockserver.py)
+CMXtransport    = None                                  # What carries the CMX API calls.  None is HTTP.  [See:  cmx_session.py & set_CMX_transport()]
+CMXstreamCount  = 0                                     # Clients delivered by the last iter_CMX_clients() walk
+CMXstreamComplete = False                               # True if the last iter_CMX_clients() walk reached the end of the list
+CMXbulkThreshold = 50                                   # CMX_lookup_many() pulls the full client list once, at or above this many MACs
+CMXv2Parser     = CMX_Parser(CMX_v2ClientSchema, CMX_ClientLocation_v2)  # Compiled parser for v2 client records  [See:  parse_CMX_v2_clients()]
+CMXv3Parser     = CMX_Parser(CMX_v3ClientSchema, CMX_ClientLocation_v3)  # Compiled parser for v3 client records  [See:  parse_CMX_v3_clients()]
+CMXparseReport  = CMX_ParseReport()                     # Report from the last client parse:  records, parsed, bad (and why)
+CMXfloorMaxAge  = 3600                                  # Seconds before the v3 floor list is refreshed (in the background)
+CMXfloorResolver = CMX_FloorResolver(lambda: get_CMX_floor_maps(CMX["host"]),  # Finds the floor of a v3 client  [Class: CMX_FloorResolver]
+                                     lambda campus, building, floor: get_CMX_floor_info(CMX["host"], campus, building, floor),
+                                     maxAge=CMXfloorMaxAge)
+CMXworkers      = 10                                    # Most CMX lookups in flight at once in concurrent mode.  (Keep it <= CMXpoolSize)
+CMXexecutor     = ""                                    # Global Placeholder for the lookup thread pool  (See get_CMX_executor())
+CMXimageCache   = CMX_ImageCache(256*1024*1024)         # Decoded floor plans & icons, LRU within a 256MB budget  [Class: CMX_ImageCache]
+CMXpreloadImages = True                                 # Decode every floor plan & icon during CMX_init()  [See:  preload_CMX_images()]
+CMXtiles        = CMX_TileCache(FloorTiles, CMXtileSize, loader=CMXimageCache.get)   # Tile pyramid of each floor image  [Class: CMX_TilePyramid]
+CMXrenderCache  = CMX_RenderCache(1024)                # Remembers which map files already hold each rendered map  [Class: CMX_RenderCache]
+CMXrenderAsync  = True                                  # Lookups queue their client maps and return at once  [See:  Map_CMXclients_async()]
+CMXrenderWorkers = 2                                    # Client maps drawn at once
+CMXrenderProcesses = (os.cpu_count() or 1) > 1          # Draw them in worker processes, on the other cores
+CMXrenderQueue  = ""                                    # Global Placeholder for the render queue  [Class: CMX_RenderQueue]  (See get_CMX_render_queue())
+CMXtransforms   = CMX_TransformCache()                  # Floor transforms, worked out once per floor  [Class: CMX_FloorTransform]
+CMXlocationTTL  = 30                                    # Seconds a looked up client location is reused before CMX is asked again
+CMXnegativeTTL  = 300                                   # Seconds a MAC that CMX doesn't know is remembered as unknown
+CMXlocationCache = CMX_LocationCache(lambda mac, timeout: fetch_CMX_client(mac, timeout),  # Answers of fetch_CMX_client()  [Class: CMX_LocationCache]
+                                     CMXlocationTTL, CMXnegativeTTL, keyOf=normalize_CMX_mac)
+CMXhistory      = CMX_LocationHistory(10000, 7*24*3600) # Up to 10,000 points per MAC, kept 7 days  [Class: CMX_LocationHistory]
+CMXpathColor    = (255, 0, 0)                           # Color of the trail drawn by Map_CMXpath()
+CMXgridCell     = 25.0                                  # Grid cell width (floor units) of the spatial index
+CMXspatial      = CMX_SpatialIndex(CMXgridCell)         # Every client CMX sees, filed by floor & grid cell  [See:  refresh_CMX_spatial()]
+CMXpollInterval = 30                                    # Seconds between polls of the tracked clients  [See:  start_CMX_poller()]
+CMXpollThreshold = 1.0                                  # Floor units (FEET on the sandboxes) a client must move before its maps are re-drawn
+CMXpoller       = CMX_Poller(lambda: CMXregistry.clients(),  # Background poller of the tracked clients  [Class: CMX_Poller]
+                             lambda macs: fetch_CMX_clients(macs, cached=False),
+                             CMXpollInterval, CMXpollThreshold)
+CMXlock         = threading.RLock()                     # Guards the startup sequence and shared globals across threads.  (CMXregistry has its own lock.)
 
 CMXheaders = {											# Basic CMX API headers.  ["Authorization" filled in by CMX_get_auth()]
 	'Authorization': "",
@@ -117,6 +199,50 @@ CMXheaders = {											# Basic CMX API headers.  ["Authorization" filled in by
 
 
 
+# -------------------------------------------------------------------
+# get_CMX_session() - Returns the shared HTTP session that all CMX API calls go through.  The session is created on first
+#   use, and keeps a pool of keep-alive connections to the CMX host, so we only pay for the TCP+TLS handshake once instead
+#   of on every lookup.  The pool size and default timeouts come from the "CMXpoolSize" and "CMXtimeout" globals.
+#   Each API call can still pass its own timeout.  [See:  cmx_session.py]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMX_session():
+    global CMXsession
+
+    if CMXsession == "":
+        CMXsession = CMX_Session(CMXpoolSize, CMXtimeout, CMXretries, transport=CMXtransport)
+        if Debug:
+            print("<<>> get_CMX_session() - ",CMXsession)
+    return(CMXsession)
+
+
+# -------------------------------------------------------------------
+# set_CMX_transport() - Points every CMX API call at another transport, host or scheme.  [See:  cmx_session.py]
+#   transport   - CMX_LocalTransport(handler) answers the calls in this process.  None goes back to HTTP.
+#   host        - New CMX["host"], e.g. "127.0.0.1:8080" for a CMX_MockServer.  (Default:  unchanged.)
+#   scheme      - New "CMXscheme", "http" or "https".  (Default:  unchanged.)
+#   The next call opens a new session and runs CMX_init() again, since the new server may run another CMX version.
+#   Answers remembered from the old server [CMXlocationCache] are dropped.
+#   Example:    set_CMX_transport(CMX_LocalTransport(CMX_MockCMX(5000).handle))
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def set_CMX_transport(transport,host=None,scheme=None):
+    global CMXsession, CMXtransport, CMXscheme, CMX_Init
+
+    with CMXlock:
+        if CMXsession != "":
+            CMXsession.close()
+        CMXsession   = ""
+        CMXtransport = transport
+        if host is not None:
+            CMX["host"] = host
+        if scheme is not None:
+            CMXscheme = scheme
+        CMX_Init = False
+    CMXlocationCache.clear()
+    return()
+
+
 # -------------------------------------------------------------------
 # get_CMX_version() - This routine identifies the version of code running on CMX.  I used this call as
 #       a result of testing multiple sandboxes of different versions.  This is the only API call I know
@@ -127,14 +253,14 @@ CMXheaders = {											# Basic CMX API headers.  ["Authorization" filled in by
 #   If it's 10.4 I use v3 API calls.  Other than that, I haven't planed for that use case.
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #	
-def get_CMX_version(host_ip):
+def get_CMX_version(host_ip,timeout=None):
     
-    url = "https://{}/api/config/v1/version/image".format(host_ip)
+    url = "{}://{}/api/config/v1/version/image".format(CMXscheme, host_ip)
     if Debug:
         print("<<>> get_CMX_version() - URL: ",url)
 
     try:
-        response = requests.get(url, headers=CMXheaders, verify=False)
+        response = get_CMX_session().get(url, headers=CMXheaders, timeout=timeout)
         if DebugREQ == 1 or DebugREQ == 99:
             print("<>> get_CMX_version() - URL: ",url)
             print("<>> get_CMX_version() - Headers:")
@@ -160,6 +286,11 @@ def get_CMX_version(host_ip):
             CMXver = CMX_version("none","none","none","none")   # Create a null structure with lowest common demoninator
             CMXver.Loc_api_version = "v2"
         return(CMXver)
+    except requests.exceptions.RequestException as err:   # Timeouts and connection failures never produce a "response"
+        print("\n<<!>> get_CMX_version() -Fatal:  Network Error:\t[",err,"]\n")
+        CMXver = CMX_version("none","none","none","none")       # Create a null structure with lowest common demoninator
+        CMXver.Loc_api_version = "v2"
+        return(CMXver)
     except:
         print("\n<<!>> get_CMX_version() -Fatal:  Error Executing Request:\tStatus: [",response.status_code,"]\tReason: [",response.reason,"]\n")
         CMXver = CMX_version("none","none","none","none")       # Create a null structure with lowest common demoninator
@@ -201,15 +332,19 @@ def get_CMX_auth(user,passwd,b64):
 # -------------------------------------------------------------------
 # get_CMX_MapsCount() - This routine pulls out all the building and floor information for your campus.  As I look at
 #   this routine, I don't see a lot of pratical use for this particular application, but you may find it useful in other ways.
+#   The hierarchy is kept in "MapsCounts", both as the original tree and indexed by name.  [See:  CMX_MapsCount.index()]
+#   A hierarchy fetched less than "maxAge" seconds ago is reused.  (Default:  always fetch.)  Returns "MapsCounts".
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #	
-def get_CMX_MapsCounts(host_ip):
-    global MapsCounts
+def get_CMX_MapsCounts(host_ip,timeout=None,maxAge=None):
+    global MapsCounts, MapsCountsTime
     
-    url = "https://{}/api/config/v1/maps/count".format(CMX["host"])
+    if maxAge is not None and MapsCounts != "" and time.monotonic() - MapsCountsTime < maxAge:
+        return(MapsCounts)
+    url = "{}://{}/api/config/v1/maps/count".format(CMXscheme, host_ip)
 
     try:
-        response = requests.get(url, headers=CMXheaders, verify=False)
+        response = get_CMX_session().get(url, headers=CMXheaders, timeout=timeout)
         if DebugREQ == 3 or DebugREQ == 99:
             print("<>> get_CMX_MapsCounts() - URL: ",url)
             print("<>> get_CMX_CampusCounts() - Headers:")
@@ -217,35 +352,92 @@ def get_CMX_MapsCounts(host_ip):
             print("<>> get_CMX_MapsCounts() - requests_response:\t[",response,"]")
             print(json.dumps(response.json(), indent=4, sort_keys=True))
         if response.status_code == 200:
-            Md = response.json()
+            Md = CMXjsonLoads(response.content)
             MC = CMX_MapsCount(Md["totalCampuses"],Md["totalBuildings"],Md["totalFloors"],Md["totalAps"])
-            Cmp = Md['campusCounts']
-            for Cc in range(MC.totalCampuses):              # Parse "Campus" Data
-                Camp = CampusCounts(Cmp[Cc]['campusName'],Cmp[Cc]['totalBuildings'])
-                Bld = Cmp[Cc]['buildingCounts']
-                for Bc in range(Camp.totalBuildings):       # Parse "Buildings" belonging to each "Campus"
-                    Bldg = BuildingCounts(Bld[Bc]['buildingName'],Bld[Bc]['totalFloors'])
-                    Flr = Bld[Bc]['floorCounts']
-                    for Fc in range(Bldg.totalFloors):
-                        Floor = FloorCounts(Flr[Fc]['floorName'], Flr[Fc]['apCount'])
-                        Bldg.floorCounts.append(copy.deepcopy(Floor))
-                    Camp.buildingCounts.append(copy.deepcopy(Bldg))
-                MC.campusCounts.append(copy.deepcopy(Camp))
+            for Cmp in Md.get('campusCounts', []):          # Parse "Campus" Data.  (Each node is new, so it is appended as is.)
+                Camp = CampusCounts(Cmp['campusName'],Cmp['totalBuildings'])
+                for Bld in Cmp.get('buildingCounts', []):   # Parse "Buildings" belonging to each "Campus"
+                    Bldg = BuildingCounts(Bld['buildingName'],Bld['totalFloors'])
+                    for Flr in Bld.get('floorCounts', []):
+                        Bldg.floorCounts.append(FloorCounts(Flr['floorName'], Flr['apCount']))
+                    Camp.buildingCounts.append(Bldg)
+                MC.campusCounts.append(Camp)
+            MC.index()
 
             if DebugREQ == 3 or DebugREQ == 99:
                 print("<<>> get_CMX_MapsCounts() - Campus Hierarchy")
-                for i in range(MC.totalCampuses):
-                    print (MC.campusCounts[i])
-                    for j in range(MC.campusCounts[i].totalBuildings):
-                        print(MC.campusCounts[i].buildingCounts[j])
-                        for k in range(MC.campusCounts[i].buildingCounts[j].totalFloors):
-                            print(MC.campusCounts[i].buildingCounts[j].floorCounts[k])
-            MapsCounts = MC
+                for Camp in MC.campusCounts:
+                    print (Camp)
+                    for Bldg in Camp.buildingCounts:
+                        print(Bldg)
+                        for Floor in Bldg.floorCounts:
+                            print(Floor)
+            MapsCounts     = MC
+            MapsCountsTime = time.monotonic()
         else:
             if Debug:
                 print("<<>> get_CMX_MapsCounts() - Network:\tResponse: [",response,"]")
+    except requests.exceptions.RequestException as err:
+        print("\n<<!>> get_CMX_MapsCounts() -Fatal:  Network Error:\t[",err,"]\n")
     except:
         print("\n<<!>> get_CMX_MapsCounts() -Fatal:  Error Executing Request:\tStatus: [",response.status_code,"]\tReason: [",response.reason,"]\n")
+    return(MapsCounts)
+
+
+# -------------------------------------------------------------------
+# get_CMXclient_floornode() - Returns the floor of the campus hierarchy [FloorCounts] a client is on, from its "mapHierarchy",
+#   or None if the hierarchy doesn't have it.  The hierarchy is fetched once and then reused for "CMXmapsMaxAge" seconds.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMXclient_floornode(cmxClient):
+    Maps = get_CMX_MapsCounts(CMX["host"],maxAge=CMXmapsMaxAge)
+    if Maps == "":
+        return(None)
+    return(Maps.find(cmxClient.mapHierarchy))
+
+
+# -------------------------------------------------------------------
+# get_CMX_floor_maps() - Pulls every campus, building and floor (with its image and dimensions) from "/api/config/v1/maps".
+#   Returns the decoded JSON, or None if the call failed.  Used by the floor resolver [CMXfloorResolver] for v3 clients.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMX_floor_maps(host_ip,timeout=None):
+
+    url = "{}://{}/api/config/v1/maps".format(CMXscheme, host_ip)
+    return(get_CMX_json(url,"get_CMX_floor_maps",timeout))
+
+
+# -------------------------------------------------------------------
+# get_CMX_floor_info() - Pulls one floor from "/api/config/v1/maps/info/:campusName/:buildingName/:floorName".
+#   Returns the decoded JSON, or None if the call failed.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMX_floor_info(host_ip,campus,building,floor,timeout=None):
+
+    url = "{}://{}/api/config/v1/maps/info/{}/{}/{}".format(CMXscheme, host_ip, quote(campus, safe=""), quote(building, safe=""), quote(floor, safe=""))
+    return(get_CMX_json(url,"get_CMX_floor_info",timeout))
+
+
+# -------------------------------------------------------------------
+# get_CMX_json() - Makes one CMX API call and returns the decoded JSON, or None if the call failed.  (DebugREQ 9)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMX_json(url,caller,timeout=None):
+
+    try:
+        response = get_CMX_session().get(url, headers=CMXheaders, timeout=timeout)
+        if DebugREQ == 9 or DebugREQ == 99:
+            print("<>> "+caller+"() - URL: ",url)
+            print("<>> "+caller+"() - requests_response:\t[",response,"]")
+        if response.status_code in range(200,300):
+            return(CMXjsonLoads(response.content))
+        if Debug:
+            print("<<%>> "+caller+"() - Bad API Response: [",response,"]")
+    except requests.exceptions.RequestException as err:
+        print("\n<<!>> "+caller+"() -Fatal:  Network Error:\t[",err,"]\n")
+    except ValueError:
+        print("\n<<!>> "+caller+"() -Fatal:  Response is not valid JSON.\n")
+    return(None)
 
         
          
@@ -259,19 +451,19 @@ def get_CMX_MapsCounts(host_ip):
 #       one that will be used in this environment right now.)  
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #
-def get_CMX_clientCount(host_ip):
+def get_CMX_clientCount(host_ip,timeout=None):
 
     CMXccount = ""                                              # Empty class to start.
     
     if CMXversions.Loc_api_version == "v3":
-        url = "https://{}/api/location/v3/clients/count".format(host_ip)
+        url = "{}://{}/api/location/v3/clients/count".format(CMXscheme, host_ip)
     else:
-        url = "https://{}/api/location/v2/clients/count".format(host_ip)
+        url = "{}://{}/api/location/v2/clients/count".format(CMXscheme, host_ip)
     if Debug:
         print("<<>> get_CMX_clientCount() - URL: ",url)
 
     try:
-        response = requests.get(url, headers=CMXheaders, verify=False)
+        response = get_CMX_session().get(url, headers=CMXheaders, timeout=timeout)
         if  DebugREQ == 6 or DebugREQ == 99:
             print("<>> get_CMX_clientCount() - URL: ",url)
             print("<>> get_CMX_clientCount() - Headers:")
@@ -301,6 +493,11 @@ def get_CMX_clientCount(host_ip):
             CMXccount.Loc_time = get_TimeStamp()                # Add the timestamp to the data
             return(CMXccount)
 
+    except requests.exceptions.RequestException as err:
+        print("\n<<!>> get_CMX_clientCount() -Fatal:  Network Error:\t[",err,"]\n")
+        CMXccount = CMX_ClientCount(0,0,0)                      # Create an empty class
+        CMXccount.Loc_time = get_TimeStamp()                    # Add the timestamp to the data
+        return(CMXccount)
     except:
         print("\n<<!>> get_CMX_clientCount() -Fatal:  Error Executing Request:\tStatus: [",response.status_code,"]\tReason: [",response.reason,"]\n")
         CMXccount = CMX_ClientCount(0,0,0)                      # Create an empty class
@@ -316,7 +513,7 @@ def get_CMX_clientCount(host_ip):
 #	systems on the same network.  This is only needed to tie the sandboxes together.
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #
-def get_all_CMX_clients(host_ip):
+def get_all_CMX_clients(host_ip,timeout=None):
 
     CMXcList = []                                           # Local CMX Client List
     
@@ -324,26 +521,28 @@ def get_all_CMX_clients(host_ip):
         CMX_init()                                      
 
     if CMXversions.Loc_api_version == "v3":
-        url = "https://{}/api/location/v3/clients".format(host_ip)
+        url = "{}://{}/api/location/v3/clients".format(CMXscheme, host_ip)
     else:
-        url = "https://{}/api/location/v2/clients".format(host_ip)
+        url = "{}://{}/api/location/v2/clients".format(CMXscheme, host_ip)
     if Debug:
         print("<<>> get_all_CMX_clients() - URL: ",url)
 
     try:
-        response = requests.get(url, headers=CMXheaders, verify=False)
+        response = get_CMX_session().get(url, headers=CMXheaders, timeout=timeout)
         if DebugREQ == 5 or DebugREQ == 99:
             print("<>> get_all_CMX_clients() - URL: ",url)
             print("<>> get_all_CMX_clients() - Headers:")
             print(json.dumps(CMXheaders, indent=4, sort_keys=True))
             print("<>> get_all_CMX_clients() - requests_response:\t[",response,"]")
-            print(json.dumps(response.json(), indent=4, sort_keys=True))
-            print()
         if response.status_code in range(200,300):
+            jsonR = CMXjsonLoads(response.content)                          # Decode the (large) response only once
+            if DebugREQ == 5 or DebugREQ == 99:
+                print(json.dumps(jsonR, indent=4, sort_keys=True))
+                print()
             if CMXversions.Loc_api_version == "v3":
-                CMXcList = parse_CMX_v3_clients(response.json())           # Convert (v3 API) JSON to list of class "CMX_ClientLocation" data
+                CMXcList = parse_CMX_v3_clients(jsonR)                      # Convert (v3 API) JSON to list of class "CMX_ClientLocation" data
             else:
-                CMXcList = parse_CMX_v2_clients(response.json())           # Convert (v2 API) JSON to list of class "CMX_ClientLocation" data
+                CMXcList = parse_CMX_v2_clients(jsonR)                      # Convert (v2 API) JSON to list of class "CMX_ClientLocation" data
             if len(CMXcList) == 0:
                 if Debug:
                     print("<<%>> get_all_CMX_clients() - Good API response, but no Client Data received.")
@@ -354,70 +553,272 @@ def get_all_CMX_clients(host_ip):
             CMXcList = []
         return(CMXcList)
 
+    except requests.exceptions.RequestException as err:
+        print("\n<<!>> get_all_CMX_clients() -Fatal:  Network Error:\t[",err,"]\n")
+        return([])
     except:
         print("\n<<!>> get_all_CMX_clients() -Fatal:  Error Executing Request:\tStatus: [",response.status_code,"]\tReason: [",response.reason,"]\n")
         CMXcList = []
         return(CMXcList)
 
 
+# -------------------------------------------------------------------
+# refresh_CMX_spatial() - Pulls the full client list from CMX [get_all_CMX_clients()] and brings the spatial index
+#   [CMXspatial] up to date with it.  Only the clients that changed grid cell, appeared or left are re-filed.
+#   Returns the counts of "added", "moved", "updated" and "removed" clients.  Nothing changes if the list came back empty.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def refresh_CMX_spatial(host_ip,timeout=None):
+
+    CMXcList = get_all_CMX_clients(host_ip,timeout)
+    if len(CMXcList) == 0:
+        return({"added": 0, "moved": 0, "updated": 0, "removed": 0})
+    Changes = CMXspatial.refresh(CMXcList)
+    if Debug:
+        print("<<>> refresh_CMX_spatial() - ",Changes,"\t",CMXspatial)
+    return(Changes)
+
+
+# -------------------------------------------------------------------
+# CMX_near() - "Who was near the infected device?"  Returns [(distance, client), ...] for every client on the same floor
+#   within "radius" floor units (FEET on the sandboxes) of this MAC, nearest first.  The MAC itself is left out.
+# CMX_nearest() - The "k" clients nearest this MAC on its floor, optionally no further than "radius".
+#   Both search the spatial index [CMXspatial], so call refresh_CMX_spatial() first.  The MAC's own position comes from the
+#   index, or from the InfectMacList if the index doesn't have it.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_near(mac,radius):
+    found = get_CMXclient_position(mac)
+    if found is None:
+        return([])
+    Near = CMXspatial.near(found[0], found[1], found[2], radius)
+    return([f for f in Near if normalize_CMX_mac(get_CMXclient_mac(f[1])) != normalize_CMX_mac(mac)])
+
+def CMX_nearest(mac,k,radius=None):
+    found = get_CMXclient_position(mac)
+    if found is None:
+        return([])
+    Near = CMXspatial.nearest(found[0], found[1], found[2], k + 1, radius)
+    return([f for f in Near if normalize_CMX_mac(get_CMXclient_mac(f[1])) != normalize_CMX_mac(mac)][:k])
+
+def get_CMXclient_position(mac):                                # (floorRefId, x, y) of a MAC, or None
+    found = CMXspatial.position(mac)
+    if found is None:
+        tracked = CMXregistry.get(mac)
+        if tracked is not None:
+            found = (get_CMXclient_floor(tracked), tracked.map_xcord, tracked.map_ycord)
+    return(found)
+
+
+# -------------------------------------------------------------------
+# iter_CMX_clients() - Streaming version of get_all_CMX_clients().  Instead of pulling every client in one response, the
+#   client list is requested one page at a time ("?page=N&pageSize=M") and the clients are handed back one by one as they
+#   are parsed.  Only one page is ever held in memory, so a campus with tens of thousands of clients can be walked with a
+#   fixed memory footprint:   for client in iter_CMX_clients(CMX["host"]): ...
+#   - pageSize  - Clients per request.  (Default "CMXpageSize")
+#   - Paging stops at the first short or empty page.  If the server ignores the paging parameters (it returns more than
+#     a page, or the same page again) we stop after that response, so we never loop over the same data.
+#   - If a page request fails, the generator simply ends.  The count of clients delivered is in "CMXstreamCount", and
+#     "CMXstreamComplete" is only True when the walk reached the end of the list.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def iter_CMX_clients(host_ip,pageSize=None,timeout=None):
+    global CMXstreamCount, CMXstreamComplete
+
+    if not CMX_Init:
+        CMX_init()
+    if pageSize is None:
+        pageSize = CMXpageSize
+
+    if CMXversions.Loc_api_version == "v3":
+        url = "{}://{}/api/location/v3/clients".format(CMXscheme, host_ip)
+    else:
+        url = "{}://{}/api/location/v2/clients".format(CMXscheme, host_ip)
+    CMXstreamCount = 0
+    CMXstreamComplete = False
+    page = 1
+    lastFirst = None                                        # First MAC of the previous page  (repeated page check)
+    while True:
+        pageUrl = "{}?page={}&pageSize={}".format(url, page, pageSize)
+        if DebugREQ == 8 or DebugREQ == 99:
+            print("<>> iter_CMX_clients() - URL: ",pageUrl)
+        try:
+            response = get_CMX_session().get(pageUrl, headers=CMXheaders, timeout=timeout)
+            if response.status_code not in range(200,300):
+                if Debug:
+                    print("<<%>> iter_CMX_clients() - Bad API Response: [",response,"]\tPage: [",page,"]")
+                return
+            jsonR = CMXjsonLoads(response.content)
+            del response                                    # Let the raw page go as soon as it's decoded
+        except requests.exceptions.RequestException as err:
+            print("\n<<!>> iter_CMX_clients() -Fatal:  Network Error:\t[",err,"]\tPage: [",page,"]\n")
+            return
+        except ValueError:
+            print("\n<<!>> iter_CMX_clients() -Fatal:  Page [",page,"] is not valid JSON.\n")
+            return
+        if not isinstance(jsonR, list):
+            return
+        if len(jsonR) == 0:
+            CMXstreamComplete = True
+            return
+        first = jsonR[0].get("macAddress", jsonR[0].get("deviceId")) if isinstance(jsonR[0], dict) else None
+        if page > 1 and first == lastFirst:                 # Same page again: the server doesn't page
+            if Debug:
+                print("<<%>> iter_CMX_clients() - Page [",page,"] repeats page [",page-1,"].  Server ignores paging.")
+            CMXstreamComplete = True
+            return
+        lastFirst = first
+        if CMXversions.Loc_api_version == "v3":
+            Clist = parse_CMX_v3_clients(jsonR)
+        else:
+            Clist = parse_CMX_v2_clients(jsonR)
+        lastPage = len(jsonR) < pageSize or len(jsonR) > pageSize  # Short page, or the whole list at once
+        del jsonR
+        for client in (Clist or []):
+            CMXstreamCount += 1
+            yield client
+        if lastPage:
+            CMXstreamComplete = True
+            return
+        page += 1
+
+
 # -------------------------------------------------------------------
 # parse_CMX_v3_clients() - Parses the JSON response to the "/api/location/v3/clients" API call.
 #   and places individual entries into a global master list of clients seen on CMX.
-# NOTE:  This routine remains untested. 
+#   Works just like parse_CMX_v2_clients().  [See:  CMXv3Parser in cmx_parser.py]
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #
-def parse_CMX_v3_clients(jsonR):
-    Clist = []
-    
+def parse_CMX_v3_clients(jsonR,report=None):
+    global CMXparseReport
+
+    report = report if report is not None else CMX_ParseReport()
+    Clist  = CMXv3Parser.parse(jsonR, report, Loc_time=get_TimeStamp())   # Parsed list of CMX Clients
+    CMXparseReport = report
     if Debug:
-        print("<<!>> parse_CMX_v3_clients() - Processing CMX API v3 API Clients is not yet supported.")
-    return(False)
+        print("<<>> parse_CMX_v3_clients() - Entries Delivered: ",report.records,"\tParsed: ",report.parsed)
+    if report.bad > 0:
+        print("\n<<!>> parse_CMX_v3_clients() - Skipped [",report.bad,"] bad client records.  First:",report.errors[0],"\n")
+    return(Clist)
 
 
 # -------------------------------------------------------------------
 # parse_CMX_v2_clients() - Parses the JSON response to the "/api/location/v2/clients" API call.
 #   and places individual entries into a global master list of clients seen on CMX.
+#   jsonR can be the decoded JSON, or the raw response bytes.  [See:  CMXv2Parser in cmx_parser.py]
+#   A bad record is skipped (and counted in "CMXparseReport") instead of losing the whole batch.
+#   report      - CMX_ParseReport to count into.  (Default:  a new one.)  Pass your own to read it without racing other threads.
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #
-def parse_CMX_v2_clients(jsonR):
-    Clist = []                                      # Parsed list of CMX Clients
+def parse_CMX_v2_clients(jsonR,report=None):
+    global CMXparseReport
 
+    report = report if report is not None else CMX_ParseReport()
+    Clist  = CMXv2Parser.parse(jsonR, report, Loc_time=get_TimeStamp())   # Parsed list of CMX Clients
+    CMXparseReport = report
     if Debug:
-        print("<<>> parse_CMX_v2_clients() - Entries Delivered: ",len(jsonR))
-    
-    TimeStamp = get_TimeStamp()
-    try:
-        for cl in range(len(jsonR)):
-            a1 = jsonR[cl]["macAddress"]
-            a2 = jsonR[cl]["manufacturer"]
-            a3 = jsonR[cl]["mapCoordinate"]["unit"]
-            a4 = jsonR[cl]["mapCoordinate"]["x"]
-            a5 = jsonR[cl]["mapCoordinate"]["y"]
-            a6 = jsonR[cl]["mapInfo"]["floorDimension"]["height"]
-            a7 = jsonR[cl]["mapInfo"]["floorDimension"]["length"]
-            a8 = jsonR[cl]["mapInfo"]["floorDimension"]["offsetX"]
-            a9 = jsonR[cl]["mapInfo"]["floorDimension"]["offsetY"]
-            b1 = jsonR[cl]["mapInfo"]["floorDimension"]["unit"]
-            b2 = jsonR[cl]["mapInfo"]["floorDimension"]["width"]
-            b3 = jsonR[cl]["mapInfo"]["floorRefId"]
-            b4 = jsonR[cl]["mapInfo"]["image"]["height"]
-            b5 = jsonR[cl]["mapInfo"]["image"]["imageName"]
-            b6 = jsonR[cl]["mapInfo"]["image"]["maxResolution"]
-            b7 = jsonR[cl]["mapInfo"]["image"]["size"]
-            b8 = jsonR[cl]["mapInfo"]["image"]["width"]
-            b9 = jsonR[cl]["mapInfo"]["image"]["zoomLevel"]
-            c  = jsonR[cl]["mapInfo"]["mapHierarchyString"]
-            client = CMX_ClientLocation(a1,a2,a3,a4,a5,a6,a7,a8,a9,b1,b2,b3,b4,b5,b6,b7,b8,b9,c)
-            client.Loc_time = TimeStamp
-            Clist.append(client)
+        print("<<>> parse_CMX_v2_clients() - Entries Delivered: ",report.records,"\tParsed: ",report.parsed)
+    if report.bad > 0:
+        print("\n<<!>> parse_CMX_v2_clients() - Skipped [",report.bad,"] bad client records.  First:",report.errors[0],"\n")
+    return(Clist)
+
+
+
+# -------------------------------------------------------------------
+# get_CMXmap_info() - Works out where a client's map comes from and where it goes.  Returns the floor image to draw on
+#    (or the default map when we don't have that floor), the (x,y) pixel at the centre of the client, and the output file name.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMXmap_info(cmxClient):
+    return(get_CMXmap_infos([cmxClient])[0])
+
+
+# -------------------------------------------------------------------
+# get_CMXmap_infos() - Batch version of get_CMXmap_info().  Returns a list of (floor image, (x,y), output file name).
+#    The client coordinates are in floor units (map_unit), so they go through the transform of their floor
+#    [See:  CMX_FloorTransform in cmx_transform.py], worked out once per floor and cached in "CMXtransforms".  Clients
+#    are grouped by floor, and each group is transformed in one (NumPy) pass.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMXmap_infos(cmxClients):
+
+    Infos  = [None] * len(cmxClients)
+    ext    = get_CMXmap_profile().ext
+    Images = {}                                                 # Floor map name --> floor image to draw on
+    Groups = {}                                                 # (floor image, floor, unit) --> [client index, ...]
+    for i, cmxClient in enumerate(cmxClients):
+        floor = get_CMXclient_floorinfo(cmxClient)
+        floorImage = Images.get(floor)
+        if floorImage is None:
+            floorImage = Images[floor] = get_CMXfloor_image(floor)
+        Groups.setdefault((floorImage, floor, cmxClient.map_unit), []).append(i)
+
+    for (floorImage, floor, unit), Members in Groups.items():
+        transform = CMXtransforms.get(floor, CMXimageCache.size(floorImage))
+        Pixels = transform.apply_many([cmxClients[i].map_xcord for i in Members], [cmxClients[i].map_ycord for i in Members], unit)
+        for i, xy in zip(Members, Pixels):
+            mc = get_CMXclient_mac_name(get_CMXclient_mac(cmxClients[i]))
+            Infos[i] = (floorImage, xy, MacMaps + mc + ext)
+            if Debug:
+                print("<<>> get_CMXmap_infos() - Location (",cmxClients[i].map_xcord,",",cmxClients[i].map_ycord,") --> ",xy,"\t[",floorImage,"]")
+    return(Infos)
+
+
+# -------------------------------------------------------------------
+# get_CMXfloor_image() - Returns the floor image file of a floor [CMX_FloorInfo], or the default map when that image isn't
+#    in "MapLocation", or when the floor isn't known (None).
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMXfloor_image(floor):
+    if floor is not None:
+        floorMap = floor.imageName
+    else:                                                       # A v3 floor CMX hasn't told us about (yet)
+        floorMap = "unknownmap.jpg"
+    floorImage = MapLocation + floorMap
+    if not Path(floorImage).is_file():
         if Debug:
-            print("<<>> parse_CMX_v2_clients() - Entries Parsed: ",len(Clist))
+            print("<<%>> get_CMXfloor_image() - [",floorImage,"] does not exist.  Using default map ",DefaultMap)
+        floorImage = DefaultMap
+    return(floorImage)
 
-    except:
-        print("\n<<!>> parse_CMX_v2_clients() -Fatal:  Error while parsing Client JSON data.\n")
-        return([])
-    return(Clist)
 
+# -------------------------------------------------------------------
+# Map_CMXpath() - Draws the trail of a client from its location history [CMXhistory] onto its floor maps:  a line
+#    through every point, a dot on each point, and the threat icon on the last point.  One map is drawn for each floor
+#    the client was on, to "MacMaps/<mac>_path_<floorRefId>.png".
+#    start, end  - Only the points in this time range (seconds since the epoch).  Default is all of them.
+#    step        - At most one point per "step" seconds, to keep a long trail readable.
+#    Returns a dictionary of {floorRefId: path map file}.  (Empty if the MAC has no history.)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def Map_CMXpath(mac,start=None,end=None,step=None):
+
+    Points = CMXhistory.range(mac,start,end,step)
+    unit   = CMXhistory.unit(mac)
+    if Debug:
+        print("<<>> Map_CMXpath() - [",mac,"]\t[",len(Points),"] points")
+    Floors = {}                                                 # floorRefId --> [(x,y), ...] in time order
+    for t, floorRefId, x, y in Points:
+        Floors.setdefault(floorRefId, []).append((x, y))
+
+    Maps = {}
+    mc   = get_CMXclient_mac_name(normalize_CMX_mac(mac))
+    for floorRefId, Trail in Floors.items():
+        floor      = CMX_Floors.get(floorRefId)
+        floorImage = get_CMXfloor_image(floor)
+        transform  = CMXtransforms.get(floor, CMXimageCache.size(floorImage))
+        Pixels     = transform.apply_many([p[0] for p in Trail], [p[1] for p in Trail], unit)
+        pathImg    = CMXimageCache.get(floorImage).copy().convert("RGB")
+        draw       = ImageDraw.Draw(pathImg)
+        if len(Pixels) > 1:
+            draw.line(Pixels, fill=CMXpathColor, width=3)
+        for px, py in Pixels:
+            draw.ellipse((px - 3, py - 3, px + 3, py + 3), fill=CMXpathColor)
+        paste_CMXicon(pathImg, CMXimageCache.get(ThreatIcon), Pixels[-1])
+        ofname = MacMaps + mc + "_path_" + floorRefId + ".png"
+        save_CMXmap(pathImg, ofname)
+        Maps[floorRefId] = ofname
+    return(Maps)
 
 
 # -------------------------------------------------------------------
@@ -430,35 +831,282 @@ def Map_CMXclient(cmxClient):
     if Debug:
         print("<<>> Map_CMXclient() - Location",cmxClient)
     
-    if CMXversions.Loc_api_version == "v2":                     # Is this data from a v2 API call?
-        xcord = round(cmxClient.map_xcord)
-        ycord = round(cmxClient.map_ycord)
-        floorMap = cmxClient.floorimage_imageName
-        cmac  = cmxClient.macAddress
-    else:                                                       # Otherwise we're looking at a v3 API call.
-        xcord = round(cmxClient.locationCoordinateX)
-        ycord = round(cmxClient.locationCoordinateY)            #
-        floorMap = "tbd"                                        # This takes more work that needs to be done.
-        cmac  = cmxClient.deviceId
-    floorImage = MapLocation +  floorMap   
-    if Debug:
-        print("<<>> Map_CMXclient() - Location (",xcord,",",ycord,")\t[",floorMap,"]")
-    for c in cmac:
-        if c == ':':
-            mc = cmac.replace(c, '_')
-    ofname = MacMaps + mc + ".png"
-    mapfile = Path(floorImage)
-    if not mapfile.is_file():
+    profile = get_CMXmap_profile()
+    floorImage, (xcord,ycord), ofname = get_CMXmap_info(cmxClient)
+    renderKey = CMX_render_key(floorImage,(xcord,ycord),ThreatIcon,profile)
+    if CMXrenderCache.reuse(renderKey,ofname):                  # Client hasn't moved, or another client already has this exact map
         if Debug:
-            print("<<%>> Map_CMXclient() - [",floorImage,"] does not exist.  Using default map ",DefaultMap)
-        floorImage = DefaultMap
-    floorImg  = Image.open(floorImage)
-    clientIOC = Image.open(ThreatIcon)
-    floorImg.paste(clientIOC,(xcord,ycord))
-    floorImg.save(ofname)
+            print("<<>> Map_CMXclient() - Map reused from cache\t",CMXrenderCache)
+        return()
+    floorImg  = CMXimageCache.get(floorImage)                   # Decoded once, then served from memory
+    clientIOC = CMXimageCache.get(ThreatIcon)
+    CMX_save_map(CMX_draw_map(floorImg,clientIOC,(xcord,ycord),profile),ofname,profile.fmt,**profile.options())
+    CMXrenderCache.record(renderKey,ofname)
+    return()
+
+
+# -------------------------------------------------------------------
+# Map_CMXclients() - Batch version of Map_CMXclient().  Clients are grouped by floor image, so each floor image and the
+#    threat icon are decoded only once for the whole batch, instead of once per client.  Each client still gets its own
+#    map in the folder "MacMaps".
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def Map_CMXclients(cmxClients):
+
+    profile   = get_CMXmap_profile()
+    floorJobs = {}                                              # Floor image --> [(position, output file, render key), ...]
+    for floorImage, xy, ofname in get_CMXmap_infos(cmxClients):
+        renderKey = CMX_render_key(floorImage,xy,ThreatIcon,profile)
+        if not CMXrenderCache.reuse(renderKey,ofname):          # Only the clients that moved need a new map
+            floorJobs.setdefault(floorImage, []).append((xy, ofname, renderKey))
+    if Debug:
+        print("<<>> Map_CMXclients() - [",len(cmxClients),"] clients, [",len(floorJobs),"] floor images to render\t",CMXrenderCache)
+    if len(floorJobs) == 0:
+        return()
+
+    clientIOC = CMXimageCache.get(ThreatIcon)
+    Rendered = set()                                            # Render keys drawn earlier in this batch
+    for floorImage in floorJobs:
+        floorImg = CMXimageCache.get(floorImage)                # Decoded once for every client on it (and every later batch)
+        for xy, ofname, renderKey in floorJobs[floorImage]:
+            if renderKey in Rendered and CMXrenderCache.reuse(renderKey,ofname):  # An earlier client in this batch had the same map
+                continue
+            Rendered.add(renderKey)
+            CMX_save_map(CMX_draw_map(floorImg,clientIOC,xy,profile),ofname,profile.fmt,**profile.options())
+            CMXrenderCache.record(renderKey,ofname)
     return()
 
 
+# -------------------------------------------------------------------
+# save_CMXmap() - Writes a client map to disk.  The image is written to a temporary file first and then renamed over the
+#    old map, so two lookups of the same MAC running at the same time never leave a half written file behind.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def save_CMXmap(mapImg,ofname):
+    return(CMX_save_map(mapImg,ofname,MapFormat))
+
+
+# -------------------------------------------------------------------
+# get_CMXmap_profile() - Returns the render profile of the client maps [CMX_RenderProfile], from "MapProfile".
+#    The profiles trade fidelity for encode time and file size:
+#       "full"  - Whole floor, full color PNG.  (The default, as the maps have always been.)
+#       "png8"  - Whole floor, 64 color PNG.  Much smaller, still lossless for the icon.
+#       "jpeg" / "webp" - Whole floor, lossy.  The fastest and smallest for photographic floor plans.
+#       "half"  - Half size JPEG.
+#       "thumb" - A 320x240 JPEG "zoomed in" around the client.
+#    The file extension follows the format (<mac>.png, <mac>.jpg or <mac>.webp).  Run "python cmx_benchmarks.py" to
+#    compare the render time and size of each profile on your own floor plans.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMXmap_profile():
+    if isinstance(MapProfile, CMX_RenderProfile):
+        return(MapProfile)
+    return(CMX_RenderProfiles[MapProfile])
+
+
+# -------------------------------------------------------------------
+# get_CMX_render_queue() - Returns the queue that draws client maps in the background.  [See:  cmx_render.py]
+#    "CMXrenderWorkers" maps are drawn at once, in worker processes when "CMXrenderProcesses" is set.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMX_render_queue():
+    global CMXrenderQueue
+
+    with CMXlock:
+        if CMXrenderQueue == "":
+            CMXrenderQueue = CMX_RenderQueue(CMX_render_map, CMXrenderWorkers, CMXrenderProcesses,
+                                             done=lambda job, ofname: CMXrenderCache.record(job[5], ofname))
+    return(CMXrenderQueue)
+
+
+# -------------------------------------------------------------------
+# Map_CMXclients_async() - Background version of Map_CMXclients().  Each client map is queued on the render queue and a
+#    "Future" of its map file is returned right away, one per client.  A client queued again before its map was drawn
+#    gets one map, of its latest position.  A client that hasn't moved gets a Future that is already done.
+#    get_CMXmap_future(mac) returns the Future of the last map queued for a MAC.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def Map_CMXclients_async(cmxClients):
+
+    Futures = []
+    profile = get_CMXmap_profile()
+    Queue   = get_CMX_render_queue()
+    for floorImage, xy, ofname in get_CMXmap_infos(cmxClients):
+        renderKey = CMX_render_key(floorImage,xy,ThreatIcon,profile)
+        if not Queue.busy(ofname) and CMXrenderCache.reuse(renderKey,ofname):  # (A queued render would overwrite it.)
+            future = Future()
+            future.set_result(ofname)
+        else:
+            future = Queue.submit(ofname, (floorImage, xy, ThreatIcon, ofname, profile, renderKey))
+        Futures.append(future)
+    if Debug:
+        print("<<>> Map_CMXclients_async() - [",len(cmxClients),"] clients\t",Queue)
+    return(Futures)
+
+def get_CMXmap_future(mac):
+    tracked = CMXregistry.get(mac)
+    mac     = get_CMXclient_mac(tracked) if tracked is not None else normalize_CMX_mac(mac)
+    return(get_CMX_render_queue().future(MacMaps + get_CMXclient_mac_name(mac) + get_CMXmap_profile().ext))
+
+
+# -------------------------------------------------------------------
+# get_CMXclient_floor() - Returns the floor reference ID of a client.  (v2 clients call it "mapinfo_floorRefId", v3 clients "floorRefId".)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMXclient_floor(cmxClient):
+    return(CMX_client_floor(cmxClient))
+
+
+# -------------------------------------------------------------------
+# get_CMXclient_floorinfo() - Returns the floor metadata of a client [CMX_FloorInfo], or None if the floor isn't known.
+#    v2 clients carry their own.  v3 clients are looked up by floorRefId through the floor resolver [CMXfloorResolver],
+#    which only calls CMX for a floor it hasn't seen.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def get_CMXclient_floorinfo(cmxClient):
+    if CMXversions.Loc_api_version == "v3":
+        return(CMXfloorResolver.resolve(get_CMXclient_floor(cmxClient), cmxClient.mapHierarchy))
+    return(cmxClient.floor)
+
+
+# -------------------------------------------------------------------
+# paste_CMXicon() - Pastes an icon onto a map, centred on the client's pixel (xy).  Icons with transparency (the colored
+#    dots) are pasted through their own mask so only the dot is drawn, not its square background.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def paste_CMXicon(mapImg,icon,xy):
+    return(CMX_paste_icon(mapImg,icon,xy))
+
+
+# -------------------------------------------------------------------
+# Map_CMXfloors() - Draws every tracked client onto one composite map per floor, instead of one full floor image per client.
+#    Clients are grouped by floor [mapinfo_floorRefId], and each client is drawn with the icon for its status.
+#    [See:  "StatusIcons"]  Each floor image is decoded once and each composite is written once per call, to
+#    "FloorMaps/<floorRefId>.png".  A floor whose clients haven't changed isn't re-drawn at all.  [See:  CMXrenderCache]
+#    floorRefIds - Only re-draw these floors.  (Default is every floor with a tracked client.)
+#    Returns a dictionary of {floorRefId: composite map file}.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def Map_CMXfloors(floorRefIds=None):
+
+    if floorRefIds is None:
+        floorRefIds = CMXregistry.floors()
+    Floors = {}                                                 # floorRefId --> (floor image, [(position, icon), ...])
+    Tracked = [c for f in floorRefIds for c in CMXregistry.on_floor(f)]
+    for cmxClient, (floorImage, xy, ofname) in zip(Tracked, get_CMXmap_infos(Tracked)):
+        floorRefId = get_CMXclient_floor(cmxClient)
+        icon = StatusIcons.get(cmxClient.Loc_Status, ThreatIcon)
+        Floors.setdefault(floorRefId, (floorImage, []))[1].append((xy, icon))
+    if Debug:
+        print("<<>> Map_CMXfloors() - [",len(Floors),"] floors to map")
+
+    os.makedirs(FloorMaps, exist_ok=True)
+    FloorFiles = {}
+    for floorRefId in Floors:
+        floorImage, markers = Floors[floorRefId]
+        ofname = FloorMaps + floorRefId + ".png"
+        FloorFiles[floorRefId] = ofname
+        renderKey = CMX_composite_key(floorImage,markers,MapFormat)
+        if CMXrenderCache.reuse(renderKey,ofname):              # Nobody on this floor moved
+            continue
+        floorImg = CMXimageCache.get(floorImage).copy()         # One decode and one copy per floor
+        for xy, icon in markers:
+            paste_CMXicon(floorImg,CMXimageCache.get(icon),xy)
+        save_CMXmap(floorImg,ofname)
+        CMXrenderCache.record(renderKey,ofname)
+    return(FloorFiles)
+
+
+# -------------------------------------------------------------------
+# Map_CMXtiles() - Draws clients onto the tile pyramid of their floor [CMXtiles], instead of onto a full floor image.
+#    Only the tiles the threat icon covers are drawn, on each zoom level, and a tile whose part of the icon didn't change
+#    isn't drawn again, so a small move writes a few small tiles.  [See:  cmx_tiles.py]
+#    Each client gets "FloorTiles/<floor image name>/clients/<mac>.json", which lists its overlay tiles.  Every tile not
+#    listed there is the base tile in "FloorTiles/<floor image name>/manifest.json".  Tile names carry a hash of their
+#    content, so they can be served from disk and cached by a browser for good.
+#    Returns a dictionary of {mac: client tile manifest}.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def Map_CMXtiles(cmxClients):
+
+    Manifests = {}
+    for cmxClient, (floorImage, xy, ofname) in zip(cmxClients, get_CMXmap_infos(cmxClients)):
+        mac = get_CMXclient_mac(cmxClient)
+        Manifests[mac] = CMXtiles.place(get_CMXclient_mac_name(mac), floorImage, xy, ThreatIcon)
+    if Debug:
+        print("<<>> Map_CMXtiles() - [",len(Manifests),"] clients\t",CMXtiles)
+    return(Manifests)
+
+
+
+# -------------------------------------------------------------------
+# preload_CMX_images() - Loads every floor plan in "MapLocation", every icon in "IconLocation", and the icons named in the
+#    "ThreatIcons" and "DotIcons" tables of env_vars.py into the decoded image cache [CMXimageCache].  Icons in those tables
+#    that aren't on disk are skipped.  Returns the number of images loaded.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def preload_CMX_images():
+
+    ImageFiles = []
+    for folder in (MapLocation, IconLocation):
+        if os.path.isdir(folder):
+            ImageFiles += sorted(folder + f for f in os.listdir(folder) if f.lower().endswith((".jpg", ".jpeg", ".png")))
+    for color in Tics:
+        ImageFiles += [IconLocation + Tics[color][icon] for icon in Tics[color]]
+    ImageFiles += [IconLocation + Dots[color] for color in Dots]
+    ImageFiles = [f for f in dict.fromkeys(ImageFiles) if os.path.isfile(f)]
+    loaded = CMXimageCache.preload(ImageFiles)
+    if Debug:
+        print("<<>> preload_CMX_images() - [",loaded,"] images loaded\t",CMXimageCache)
+    return(loaded)
+
+
+# -------------------------------------------------------------------
+# build_CMX_tiles() - Cuts every floor plan in "MapLocation" into its tile pyramid in "FloorTiles".  A pyramid already on
+#    disk is only cut again when its floor plan changed.  Returns the number of floor plans.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def build_CMX_tiles():
+
+    FloorFiles = []
+    if os.path.isdir(MapLocation):
+        FloorFiles = sorted(MapLocation + f for f in os.listdir(MapLocation) if f.lower().endswith((".jpg", ".jpeg", ".png")))
+    built = CMXtiles.build_all(FloorFiles)
+    if Debug:
+        print("<<>> build_CMX_tiles() - [",built,"] floor plans\t",CMXtiles)
+    return(built)
+
+
+# -------------------------------------------------------------------
+# load_CMX_store() - Reloads the clients tracked before the last restart from "clients_db" into CMXregistry, and from then on
+#    writes every change to the registry to it.  [See:  cmx_store.py]  A reloaded client is not looked up on CMX again; the
+#    next CMX_lookup() of that MAC updates it as usual.  The journal is compacted here when it holds any stale lines.
+#    Only runs once, and does nothing when "CMX_Persist" is False.  Returns the number of clients reloaded.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def load_CMX_store():
+    global CMXstore
+
+    with CMXlock:
+        if not CMX_Persist or CMXstore != "":
+            return(0)
+        try:
+            store   = CMX_ClientStore(clients_db, CMXstoreCompact)
+            Clients = store.load()
+        except OSError as err:
+            print("\n<<!>> load_CMX_store()-Warning:  Client store [",clients_db,"] not available, clients will not persist. [",err,"]\n")
+            CMXstore = None
+            return(0)
+        for mac in Clients:
+            CMXregistry.restore(*Clients[mac])
+        if store.lines > len(Clients):
+            store.compact(Clients)
+        CMXregistry.listener = lambda event, mac, tracked: store.put(mac, tracked, tracked.Loc_Status) if event == "put" else store.delete(mac)
+        CMXstore = store
+        if Debug:
+            print("<<>> load_CMX_store() - [",len(Clients),"] clients reloaded\t",CMXstore)
+        return(len(Clients))
+
 
 # -------------------------------------------------------------------
 # get_TimeStamp() - Returns a string containing the current time.  "yy-mm-dd hh:mm:ss"
@@ -496,26 +1144,34 @@ def get_TimeStamp():
 def CMX_init():
     global CMXversions, CMX_Init, CMX_ClientLocation
     
-    if Debug or DebugREQ == 4:
-        print("<<>> CMX_init() - Startup")
+    with CMXlock:                                       # Only one thread runs the startup sequence
+        if Debug or DebugREQ == 4:
+            print("<<>> CMX_init() - Startup")
+        load_CMX_store()                                    # Bring back the clients tracked before a restart.  (No CMX calls needed.)
         
 # Step 1. Determine the running CMX Version
-    CMXversions = get_CMX_version(CMX["host"])          # Identify the CMX version we're working with.
-    if CMXversions.Loc_api_version == "v2":
-        from cmx_classes import CMX_ClientLocation_v2 as CMX_ClientLocation   # I think this changes with v3, which also messes up some of the logic of maps and things.
-    else:
-        from cmx_classes import CMX_ClientLocation_v3 as CMX_ClientLocation   # CAUTION:  This is not fully implemented and will fail.
-        print("\n<<!>> CMX_init()-Warning:  Attempt to access CMX API-v3 server.  This code is not set up for that now.\n")
-        return(False)
+        CMXversions = get_CMX_version(CMX["host"])          # Identify the CMX version we're working with.
+        if CMXversions.Loc_api_version == "v2":
+            from cmx_classes import CMX_ClientLocation_v2 as CMX_ClientLocation
+        else:
+            from cmx_classes import CMX_ClientLocation_v3 as CMX_ClientLocation   # Also answers to the v2 field names
         
 # Step 2. Using the username/password credentials in the env_vars file, create an authentication header for our calls.
 #   this "Authentication" - basically fills in the CMXheaders "Authentication" field.
-    if not get_CMX_auth(CMX["username"],CMX["password"],CMX["Base64"]):
-        print("\n<<!>> CMX_init()-Warning:  Failure to authenticate user.  Check CMX credentials and try again.\n")
-        return(False)
-    else:
-        CMX_Init = True					# Set the flag saying we've completed the process.
-    return(True)
+        if not get_CMX_auth(CMX["username"],CMX["password"],CMX["Base64"]):
+            print("\n<<!>> CMX_init()-Warning:  Failure to authenticate user.  Check CMX credentials and try again.\n")
+            return(False)
+        else:
+            CMX_Init = True					# Set the flag saying we've completed the process.
+
+# Step 3. Decode the floor plans and icons now, so the first lookups don't have to.
+        if CMXpreloadImages:
+            preload_CMX_images()
+        if CMXtileMaps:
+            build_CMX_tiles()
+        if CMXversions.Loc_api_version == "v3":            # v3 clients don't carry their floor.  Load the floors in the background.
+            CMXfloorResolver.refresh_async()
+        return(True)
 
 
 # -------------------------------------------------------------------
@@ -557,68 +1213,279 @@ def get_CMX_map(mapName):
 
 
 # -------------------------------------------------------------------
-# CMX_lookup() - This is the official entry point to the CMX routines.  Once an infected MAC is identified,
-#   this routine is called with its MAC address, which begins the task of populating the "InfectMacList".
-#   Each time this is done, a Map is created with the location of that client.  In addition, any time a call
-#   is made to change the status of the infected MAC, this routine is called to update the location of that
-#   device.
-#   NOTE:  While a distinction is made between v2 and v3, I have no way to test v3 on a live server.
+# fetch_CMX_client() - Queries CMX for a single MAC address and returns the parsed client.  If CMX answers, but without
+#   a client (an empty list, or "204 No Content"), a placeholder client is returned instead.  [See:  Empty_v2_Client()]
+#   Returns "None" when the call failed:  a network error, an error status (401, 5xx ...) or a body that can't be parsed,
+#   so the caller can tell "not found" from "not reachable" and never remembers an outage as an unknown MAC.
+#   This routine doesn't touch the InfectMacList or draw any maps.  (That is left to CMX_lookup() & CMX_lookup_many().)
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
-def CMX_lookup(mac):
+def fetch_CMX_client(mac,timeout=None):
     
     CMXclient = []                              # Parsing routine wants to return a list.  So for now I call it a list.
 
-    if not CMX_Init:                            # Make sure the CMX initialization sequence has occured first.
-        CMX_init()
+    if CMXversions.Loc_api_version == "v3":
+        url = "{}://{}/api/location/v3/clients?macAddress={}".format(CMXscheme,CMX["host"],mac)
     else:
-        if CMXversions.Loc_api_version == "v3":
-            url = "https://{}/api/location/v3/clients?macAddress={}".format(CMX["host"],mac)
-        else:
-            url = "https://{}/api/location/v2/clients?macAddress={}".format(CMX["host"],mac)
+        url = "{}://{}/api/location/v2/clients?macAddress={}".format(CMXscheme,CMX["host"],mac)
     if Debug:
-        print("<<>> CMX_lookup() - URL: ",url)
+        print("<<>> fetch_CMX_client() - URL: ",url)
 
     try:
-        response = requests.get(url, headers=CMXheaders, verify=False)
+        response = get_CMX_session().get(url, headers=CMXheaders, timeout=timeout)
         if DebugREQ == 7 or DebugREQ == 99:
-            print("<>> CMX_lookup() - URL: ",url)
-            print("<>> CMX_lookup() - Headers:")
+            print("<>> fetch_CMX_client() - URL: ",url)
+            print("<>> fetch_CMX_client() - Headers:")
             print(json.dumps(CMXheaders, indent=4, sort_keys=True))
-            print("<>> CMX_lookup() - requests_response:\t[",response,"]")
+            print("<>> fetch_CMX_client() - requests_response:\t[",response,"]")
             print()
-        if response.status_code == 200:
+        if response.status_code not in range(200,300):
+            print("\n<<!>> fetch_CMX_client() -Fatal:  Bad API Response:\tStatus: [",response.status_code,"]\tReason: [",response.reason,"]\n")
+            return(None)
+        if len(response.content.strip()) > 0:                           # (An empty body is CMX saying it has no such client.)
             if DebugREQ == 7 or DebugREQ == 99:
                 print(json.dumps(response.json(), indent=4, sort_keys=True))
+            report = CMX_ParseReport()
             if CMXversions.Loc_api_version == "v2":
-                CMXclient = parse_CMX_v2_clients(response.json())       # Convert JSON to list of class "CMX_ClientLocation" data
-                if len(CMXclient) == 0:
-                    if Debug:
-                        print("<<%>> CMX_lookup() - Good API v2 response, but no Client Data parsed.")
-                    CMXclient = []
+                CMXclient = parse_CMX_v2_clients(response.content, report)  # Convert JSON to list of class "CMX_ClientLocation" data
             elif CMXversions.Loc_api_version == "v3":
-                CMXclient = parse_CMX_v3_clients(response.json())       # Convert JSON to list of class "CMX_ClientLocation" data
-                if len(CMXclient) == 0:
-                    if Debug:
-                        print("<<%>> CMX_lookup() - Good API v3 response, but no Client Data parsed.")
-                    CMXclient = []
+                CMXclient = parse_CMX_v3_clients(response.content, report)  # Convert JSON to list of class "CMX_ClientLocation" data
+            if len(CMXclient) == 0 and report.bad > 0:
+                print("\n<<!>> fetch_CMX_client() -Fatal:  Response can't be parsed:\t[",report.errors[0],"]\n")
+                return(None)
         if len(CMXclient) == 0:
             if Debug: 
-                print("<>> CMX_lookup() - response code not 200 or Error parsing JSON:  ",response.status_code)
+                print("<>> fetch_CMX_client() - Good API response, but CMX doesn't know the client:  ",response.status_code)
             if CMXversions.Loc_api_version == "v2":
                 CMXclient.append(Empty_v2_Client(mac))                  # Put it in a list for consistency with parsing all clients
             elif CMXversions.Loc_api_version == "v3":
                 CMXclient.append(Empty_v3_Client(mac))                  # Put it in a list for consistency with parsing all clients
-        Add_CMXclient(CMXclient[0])                                     # Put the Client onto the InfectMacList
-        Map_CMXclient(CMXclient[0])
-        return(True)
+        return(CMXclient[0])
 
+    except requests.exceptions.RequestException as err:
+        print("\n<<!>> fetch_CMX_client() -Fatal:  Network Error:\t[",err,"]\n")
+        return(None)
     except:
-        print("\n<<!>> CMX_loockup() -Fatal:  Error Executing Request:\tStatus: [",response.status_code,"]\tReason: [",response.reason,"]\n")
-        CMXclient = []
+        print("\n<<!>> fetch_CMX_client() -Fatal:  Error Executing Request:\tStatus: [",response.status_code,"]\tReason: [",response.reason,"]\n")
+        return(None)
+
+
+
+# -------------------------------------------------------------------
+# CMX_lookup() - This is the official entry point to the CMX routines.  Once an infected MAC is identified,
+#   this routine is called with its MAC address, which begins the task of populating the "InfectMacList".
+#   Each time this is done, a Map is created with the location of that client.  In addition, any time a call
+#   is made to change the status of the infected MAC, this routine is called to update the location of that
+#   device.
+#   The answer from CMX is reused for "CMXlocationTTL" seconds (or "CMXnegativeTTL" seconds for a MAC CMX doesn't know),
+#   and lookups of the same MAC running at the same time share one API call.  [See:  CMXlocationCache]
+#   With "CMXrenderAsync", the map is queued and drawn in the background, so this returns as soon as the client is
+#   recorded.  get_CMXmap_future(mac) gives the Future of its map file.  [See:  Map_CMXclients_async()]
+#   NOTE:  While a distinction is made between v2 and v3, I have no way to test v3 on a live server.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def CMX_lookup(mac,timeout=None):
+
+    if not CMX_Init:                            # Make sure the CMX initialization sequence has occured first.
+        CMX_init()
+
+    CMXclient = CMXlocationCache.get(mac,timeout)
+    if CMXclient is None:
+        return(False)
+    try:
+        Add_CMXclient(CMXclient)                                        # Put the Client onto the InfectMacList
+        if CMXclientMaps and CMXrenderAsync:
+            Map_CMXclients_async([CMXclient])                           # Drawn in the background  [See:  get_CMXmap_future()]
+        elif CMXclientMaps:
+            Map_CMXclient(CMXclient)
+        if CMXfloorMaps:
+            Map_CMXfloors([get_CMXclient_floor(CMXclient)])
+        if CMXtileMaps:
+            Map_CMXtiles([CMXclient])
+        return(True)
+    except:
+        print("\n<<!>> CMX_lookup() -Fatal:  Error recording client [",mac,"]\n")
         return(False)
 
 
 
+# -------------------------------------------------------------------
+# CMX_lookup_many() - Batch version of CMX_lookup().  This is the entry point to use when an IOC feed flags a whole
+#   group of MACs at once.  Each MAC is looked up only once (duplicates are dropped), and then the whole batch is added
+#   to the "InfectMacList" in one pass and mapped in one pass.  [See:  Add_CMXclients() & Map_CMXclients()]
+#   The clients are fetched by fetch_CMX_clients().
+#   Returns a dictionary of {mac: client}.  The client is "None" for any MAC whose API call failed.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def CMX_lookup_many(macs,timeout=None):
+
+    if not CMX_Init:                            # Make sure the CMX initialization sequence has occured first.
+        CMX_init()
+
+    Results = fetch_CMX_clients(macs,timeout)
+    Located = [CMXclient for CMXclient in Results.values() if CMXclient is not None]
+    try:
+        Add_CMXclients(Located)                                         # Put the Clients onto the InfectMacList
+        if CMXclientMaps and CMXrenderAsync:
+            Map_CMXclients_async(Located)
+        elif CMXclientMaps:
+            Map_CMXclients(Located)
+        if CMXfloorMaps:
+            Map_CMXfloors(set(get_CMXclient_floor(CMXclient) for CMXclient in Located))
+        if CMXtileMaps:
+            Map_CMXtiles(Located)
+    except:
+        print("\n<<!>> CMX_lookup_many() -Fatal:  Error recording [",len(Located),"] clients\n")
+    return(Results)
+
+
+
+# -------------------------------------------------------------------
+# fetch_CMX_clients() - Batch version of fetch_CMX_client().  Each MAC is fetched only once (duplicates are dropped).
+#   - For a small batch each MAC is queried on its own, over the shared keep-alive session, with up to "CMXworkers"
+#     queries in flight.
+#   - Once the batch reaches "CMXbulkThreshold" MACs, it is cheaper to pull the full client list from CMX once and pick
+#     our MACs out of it.  If that bulk call comes back empty, we fall back to one query per MAC.  If it stops part way,
+#     the MACs we didn't reach count as failed (None), not as unknown to CMX.
+#   cached      - Reuse recent answers from "CMXlocationCache".  With False, every MAC is asked again, and the answers
+#                 refresh the cache.  [See:  poll_CMX_clients()]
+#   This routine doesn't touch the InfectMacList or draw any maps.
+#   Returns a dictionary of {mac: client}.  The client is "None" for any MAC whose API call failed.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def fetch_CMX_clients(macs,timeout=None,cached=True):
+
+    Results = {}
+
+    MacBatch = list({normalize_CMX_mac(mac): mac for mac in macs}.values())  # Drop duplicates, but keep the original order
+    if Debug:
+        print("<<>> fetch_CMX_clients() - [",len(MacBatch),"] unique MACs")
+
+    if len(MacBatch) >= CMXbulkThreshold:
+        Wanted  = {normalize_CMX_mac(mac) for mac in MacBatch}
+        Matched = {}
+        for CMXclient in iter_CMX_clients(CMX["host"],timeout=timeout):     # Only our MACs are kept, the rest are dropped as they stream by
+            mac = normalize_CMX_mac(get_CMXclient_mac(CMXclient))
+            if mac in Wanted and mac not in Matched:
+                Matched[mac] = CMXclient
+        if CMXstreamCount > 0:
+            for mac in MacBatch:
+                CMXclient = Matched.get(normalize_CMX_mac(mac))
+                if CMXclient is None and not CMXstreamComplete:         # Not reached before the walk failed.  We don't know.
+                    Results[mac] = None
+                    continue
+                if CMXclient is None:                                   # CMX doesn't see this MAC.  Use a placeholder like CMX_lookup() does.
+                    if CMXversions.Loc_api_version == "v2":
+                        CMXclient = Empty_v2_Client(mac)
+                    else:
+                        CMXclient = Empty_v3_Client(mac)
+                Results[mac] = CMXclient
+                CMXlocationCache.put(mac, CMXclient)                    # Just as fresh as a single lookup
+        elif Debug:
+            print("<<%>> fetch_CMX_clients() - Bulk client list was empty.  Looking up each MAC instead.")
+    if len(Results) == 0 and len(MacBatch) > 0:                         # One query per MAC, spread over the lookup thread pool
+        if cached:
+            Fetched = get_CMX_executor().map(lambda mac: CMXlocationCache.get(mac,timeout), MacBatch)
+        else:
+            Fetched = get_CMX_executor().map(lambda mac: fetch_CMX_client(mac,timeout), MacBatch)
+        Results = dict(zip(MacBatch, Fetched))
+        if not cached:
+            for mac in Results:
+                if Results[mac] is not None:
+                    CMXlocationCache.put(mac, Results[mac])
+    return(Results)
+
+
+
+# -------------------------------------------------------------------
+# start_CMX_poller() - Starts polling CMX for every tracked client (IoC, Quarantined and OffNet) every "CMXpollInterval"
+#   seconds, on a background thread.  [See:  cmx_poller.py]  Each poll is one fetch_CMX_clients() batch, so a large
+#   list costs one bulk call.  Only clients that changed floor or moved more than "CMXpollThreshold" floor units are
+#   updated and re-drawn.  [See:  apply_CMX_changes()]  More routines can be told about the changes with
+#   "CMXpoller.add_listener(routine)".  Returns False if the poller was already running.
+# stop_CMX_poller() - Stops it again.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def start_CMX_poller(interval=None):
+
+    if not CMX_Init:                            # Run the startup sequence before the poller thread needs it.
+        CMX_init()
+    if interval is not None:
+        CMXpoller.interval = interval
+    if apply_CMX_changes not in CMXpoller.listeners:
+        CMXpoller.add_listener(apply_CMX_changes)
+    if Debug:
+        print("<<>> start_CMX_poller() - Every [",CMXpoller.interval,"] seconds")
+    return(CMXpoller.start())
+
+def stop_CMX_poller():
+    CMXpoller.stop()
+    return()
+
+
+
+# -------------------------------------------------------------------
+# apply_CMX_changes() - Records the clients the poller found moved, and re-draws only their maps and floors.
+#    changes     - List of (tracked client, new client) pairs.  [See:  CMX_Poller]  The tracked clients are updated here.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def apply_CMX_changes(changes):
+
+    Moved  = [new for old, new in changes]
+    Floors = set(get_CMXclient_floor(c) for pair in changes for c in pair)   # The floors they left and the floors they are on now
+    if Debug:
+        print("<<>> apply_CMX_changes() - [",len(Moved),"] clients moved")
+    Add_CMXclients(Moved)                                               # Updates the tracked clients in place
+    if CMXclientMaps and CMXrenderAsync:
+        Map_CMXclients_async(Moved)
+    elif CMXclientMaps:
+        Map_CMXclients(Moved)
+    if CMXfloorMaps:
+        Map_CMXfloors(Floors)
+    if CMXtileMaps:
+        Map_CMXtiles(Moved)
+    return()
+
+
+
+# -------------------------------------------------------------------
+# get_CMX_executor() - Returns the thread pool used to run CMX lookups concurrently.  Lookups spend nearly all of their
+#   time waiting on CMX, so a thread pool lets many of them be in flight at once.  The pool never runs more than
+#   "CMXworkers" lookups at a time, and the HTTP session never opens more than "CMXpoolSize" connections.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def get_CMX_executor():
+    global CMXexecutor
+
+    with CMXlock:
+        if CMXexecutor == "":
+            CMXexecutor = ThreadPoolExecutor(max_workers=CMXworkers, thread_name_prefix="CMX_lookup")
+    return(CMXexecutor)
+
+
+
+# -------------------------------------------------------------------
+# CMX_lookup_async() - Concurrent version of CMX_lookup().  The lookup is queued on the lookup thread pool and a "Future"
+#   is returned right away.  "Future.result()" gives the same True/False that CMX_lookup() returns.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def CMX_lookup_async(mac,timeout=None):
+
+    if not CMX_Init:                            # Run the startup sequence before any thread needs it.
+        CMX_init()
+    return(get_CMX_executor().submit(CMX_lookup, mac, timeout))
+
+
+
+# -------------------------------------------------------------------
+# CMX_lookup_concurrent() - Runs CMX_lookup() for a list of MACs with up to "CMXworkers" lookups in flight at once, and
+#   waits for all of them to finish.  Each client is added and mapped exactly as CMX_lookup() does it, and the lists are
+#   protected by "CMXlock", so they stay consistent no matter how the lookups interleave.
+#   Returns a dictionary of {mac: True/False}.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def CMX_lookup_concurrent(macs,timeout=None):
+
+    Lookups = {}
+    for mac in dict.fromkeys(macs):             # Drop duplicates, but keep the original order
+        Lookups[mac] = CMX_lookup_async(mac,timeout)
+    if Debug:
+        print("<<>> CMX_lookup_concurrent() - [",len(Lookups),"] lookups queued")
+    return({mac: Lookups[mac].result() for mac in Lookups})
+
+
+
 # -------------------------------------------------------------------
 # Empty_v2_Client() - If a client MAC is not found by CMX, I still need a "placeholder" for it.
 #    This may not occur in real life, but in the sandboxes, you can sometimes get caught with no clients.
@@ -647,7 +1514,7 @@ def Empty_v2_Client(mac):
     c  = "OZone"                # mapHierarchy - 112 defined Zones in CMX sandbox
 
     CMXeClient = CMX_ClientLocation_v2(mac,a2,a3,a4,a5,a6,a7,a8,a9,b1,b2,b3,b4,b5,b6,b7,b8,b9,c)
-    CMXeClient.Loc_Status         = "IoC"
+    CMXeClient.Loc_Status         = "OffNet"                        # CMX doesn't see this client
     CMXeClient.currentServerTime  = "2019-02-25T04:17:16.311+0000"  # Current Server Time
     CMXeClient.firstLocateTime    = "2019-02-25T04:17:16.311+0000"  #
     CMXeClient.lastLocateTime     = "2019-02-25T04:17:16.311+0000"  #
@@ -662,7 +1529,29 @@ def Empty_v2_Client(mac):
 #    This may not occur in real life, but in the sandboxes, you can sometimes get caught with no clients.
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def Empty_v3_Client(mac):
-    return([])
+
+    if Debug:
+        print("<<>> Empty_v3_Client() - Mac [", mac,"]")
+    a1 = "OZone"                # locationMapHierarchy
+    a2 = 10.0                   # locationCoordinateX - Client X-coordinate
+    a3 = 10.0                   # locationCoordinateY - Client Y-coordinate
+    a4 = 0                      # locationCoordinateZ
+    a5 = "FEET"                 # locationUnit
+    a6 = -999                   # geoCoordLat - CMX uses -999 for "no geo coordinate"
+    a7 = -999                   # geoCoordLong
+    a8 = "DEGREES"              # geoCoordUnit
+    a9 = 0                      # confidenceFactor
+    b1 = '9876543210'           # floorRefId - Same placeholder floor as Empty_v2_Client()
+    b3 = "2019-02-25T04:17:16.311+0000"  # lastSeen
+    b4 = "Unknown"              # manufacturer
+    b5 = 0                      # timestamp
+    b6 = 0                      # notificationTime
+
+    CMXeClient = CMX_ClientLocation_v3(a1,a2,a3,a4,a5,a6,a7,a8,a9,b1,mac,b3,b4,b5,b6)
+    CMXeClient.Loc_Status         = "OffNet"                        # CMX doesn't see this client
+    if Debug:
+        print("<<>> Empty_v3_Client() - [", CMXeClient,"]")
+    return(CMXeClient)
 
 
 
@@ -670,44 +1559,63 @@ def Empty_v3_Client(mac):
 # Add_CMXclient() - This routine adds a CMX_Client to the InfectMacList and/or the QuarantineMacList.
 #    (If it's found on a list it updates an existing entry for this MAC already on the list.  The
 #    cmxClient structure comes from the CMX_lookup() routine.
+#    The lists are views of "CMXregistry", which is keyed by MAC, so this is a single dictionary lookup.  A placeholder client
+#    (one CMX doesn't see) is filed as "OffNet", everything else as "IoC".  A quarantined client stays quarantined.
+#    Every real location is also added to the client's location history.  [See:  CMXhistory]
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def Add_CMXclient(cmxClient):
-    global InfectMacList, QuarantineMacList
-    
-    foundClient = False
 
     if Debug:
-        print("<<>> Add_CMXclient() - Searching QuarantineMacList (",len(QuarantineMacList),") for [", cmxClient,"]")
-    for i in range(len(QuarantineMacList)):             # Check the Quarantine list first
-        if CMXversions.Loc_api_version == "v2":
-            if cmxClient.macAddress == QuarantineMacList[i].macAddress:
-                update_CMXclient(cmxClient,QuarantineMacList[i])
-                foundClient = True
-        elif CMXversions.Loc_api_version == "v3":
-            if cmxClient.deviceId == QuarantineMacList[i].deviceId:
-                update_CMXclient(cmxClient,QuarantineMacList[i])
-                foundClient = True
-        if foundClient:
-            return(True)
+        print("<<>> Add_CMXclient() - Adding [", cmxClient,"]\t",CMXregistry)
+    if cmxClient.Loc_Status == "OffNet":                # Placeholder for a MAC that CMX doesn't see
+        CMXregistry.add(cmxClient,"OffNet")
+    else:
+        CMXregistry.add(cmxClient,"IoC")                # Updates the client in place if we already track it
+        CMXhistory.record_client(get_CMXclient_mac(cmxClient), cmxClient, get_CMXclient_floor(cmxClient))
+    return(True)
+
+
+
+# -------------------------------------------------------------------
+# Add_CMXclients() - Batch version of Add_CMXclient().  The rules are the same as Add_CMXclient(): a client already on
+#    the QuarantineMacList or the InfectMacList is updated in place, otherwise it's added to the InfectMacList.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def Add_CMXclients(cmxClients):
+
     if Debug:
-        print("<<>> Add_CMXclient() - Searching InfectMacList (",len(QuarantineMacList),") for [", cmxClient,"]")
-    for i in range(len(InfectMacList)):                 # Client isn't quarantined, check the Infect list
-        if CMXversions.Loc_api_version == "v2":
-            if cmxClient.macAddress == InfectMacList[i].macAddress:
-                update_v2CMXclient(cmxClient,QuarantineMacList[i])
-                foundClient = True
-        elif CMXversions.Loc_api_version == "v3":
-            if cmxClient.deviceId == InfectMacList[i].deviceId:
-                update_v3CMXclient(cmxClient,QuarantineMacList[i])
-                foundClient = True
-    if not foundClient:
-        if Debug:
-            print("<<>> Add_CMXclient() - Adding [",cmxClient,"] to InfectMacList")
-        InfectMacList.append(copy.deepcopy(cmxClient))      # Add the Client to the InfectMacList
+        print("<<>> Add_CMXclients() - Adding [",len(cmxClients),"] clients\t",CMXregistry)
+    for cmxClient in cmxClients:
+        Add_CMXclient(cmxClient)
     return(True)
 
 
 
+# -------------------------------------------------------------------
+# get_CMXclient_mac() - Returns the MAC address of a client.  (v2 clients call it "macAddress", v3 clients "deviceId".)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def get_CMXclient_mac(cmxClient):
+    return(CMX_client_mac(cmxClient))
+
+
+
+# -------------------------------------------------------------------
+# get_CMXclient_mac_name() - Returns a MAC address the way it appears in map file names:  "00_20_00_19_89_e0".
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def get_CMXclient_mac_name(mac):
+    return(mac.replace(':', '_'))
+
+
+
+# -------------------------------------------------------------------
+# update_CMXclient() - Updates an existing client with new data, using the routine for the API version we are running.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+def update_CMXclient(newData,oldData):
+    if CMXversions.Loc_api_version == "v3":
+        return(update_v3CMXclient(newData,oldData))
+    return(update_v2CMXclient(newData,oldData))
+
+
+
 # -------------------------------------------------------------------
 # update_v2CMXclient() - Once a MAC address is found and then queried again, update the old data with the new.
 #    Not all data needs to be updated, but this will update most of the fields.  Then again, there maybe other
@@ -718,19 +1626,7 @@ def update_v2CMXclient(newData,oldData):
     oldData.map_xcord            = newData.map_xcord
     oldData.map_ycord            = newData.map_ycord
     oldData.map_zcord            = newData.map_zcord
-    oldData.mapinfo_height       = newData.mapinfo_height
-    oldData.mapinfo_length       = newData.mapinfo_length
-    oldData.mapinfo_offsetX      = newData.mapinfo_offsetX
-    oldData.mapinfo_offsetY      = newData.mapinfo_offsetY
-    oldData.mapinfo_unit         = newData.mapinfo_unit
-    oldData.mapinfo_width        = newData.mapinfo_width
-    oldData.mapinfo_floorRefId   = newData.mapinfo_floorRefId
-    oldData.floorimage_height    = newData.floorimage_height
-    oldData.floorimage_imageName = newData.floorimage_imageName
-    oldData.floorimage_maxRes    = newData.floorimage_maxRes
-    oldData.floorimage_size      = newData.floorimage_size
-    oldData.floorimage_width     = newData.floorimage_width
-    oldData.floorimage_zoom      = newData.floorimage_zoom
+    oldData.floor                = newData.floor                # All the mapinfo_* and floorimage_* fields  [See:  CMX_FloorInfo]
     oldData.mapHierarchy         = newData.mapHierarchy
     oldData.ipAddress            = newData.ipAddress
     oldData.networkStatus        = newData.networkStatus
@@ -749,9 +1645,9 @@ def update_v2CMXclient(newData,oldData):
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def update_v3CMXclient(newData,oldData):
     oldData.locationMapHierarchy = newData.locationMapHierarchy         # Location Map Hierarchy
-    oldData.locationCoordinateX  = newData.locationCoordinate-X         # client Location X-Coordinate
-    oldData.locationCoordinateY  = newData.locationCoordinate-Y         # client Location Y-Coordinate
-    oldData.locationCoordinateZ  = newData.locationCoordinate-Z         # client Location Z-Coordinate
+    oldData.locationCoordinateX  = newData.locationCoordinateX          # client Location X-Coordinate
+    oldData.locationCoordinateY  = newData.locationCoordinateY          # client Location Y-Coordinate
+    oldData.locationCoordinateZ  = newData.locationCoordinateZ          # client Location Z-Coordinate
     oldData.locationUnit         = newData.locationUnit                 # client Location Units
     oldData.geoCoordLat          = newData.geoCoordLat                  # Geocoordinate - Latitued
     oldData.geoCoordLong         = newData.geoCoordLong                 # Geocoordinate - Longitude
@@ -763,6 +1659,8 @@ def update_v3CMXclient(newData,oldData):
     oldData.lastSeen             = newData.lastSeen                     # Something like "2019-02-22T12:44:15.646+0000" 
     oldData.timestamp            = newData.timestamp                    # maybe current time?
     oldData.notificationTime     = newData.notificationTime             # Not sure what time this is.  Close to timestamp.
+    oldData.manufacturer         = newData.manufacturer
+    oldData.Loc_time             = newData.Loc_time
     return()
     
 
@@ -770,39 +1668,17 @@ def update_v3CMXclient(newData,oldData):
 # -------------------------------------------------------------------
 # Purge_CMXclient() - This routine removes a CMX_Client from the InfectMacList and/or the QuarantineMacList.
 #    (Which ever list the Mac Address is found on.)  The cmxClient structure comes from the CMX_lookup() routine.
+#    The MAC is matched in any common format.  [See:  normalize_CMX_mac()]
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def Purge_CMXclient(mac):
-    global InfectMacList, QuarantineMacList
-    DELmac = False
 
     if Debug:
-        print("<<>> Purge_CMXclient() - [",len(InfectMacList),"]\t[",mac,"]")
-    for i in range(len(InfectMacList)):
-        if CMXversions.Loc_api_version == "v2":
-            if InfectMacList[i].macAddress == mac:
-                del InfectMacList[i]
-                DELmac = True
-                break
-        elif CMXversions.Loc_api_version == "v3":
-            if InfectMacList[i].deviceId == mac:
-                del InfectMacList[i]
-                DELmac = True
-                break
-    if not DELmac:
-        for i in range(len(QuarantineMacList)):
-            if CMXversions.Loc_api_version == "v2":
-                if QuarantineMacList[i].macAddress == mac:
-                    del QuarantineMacList[i]
-                    DELmac = True
-                    break
-            elif CMXversions.Loc_api_version == "v3":
-                if QuarantineMacList[i].deviceId == mac:
-                    del QuarantineMacList[i]
-                    DELmac = True
-                    break
-    if not DELmac:
+        print("<<>> Purge_CMXclient() - [",len(CMXregistry),"]\t[",mac,"]")
+    if CMXregistry.purge(mac) is None:
         if Debug:
             print("<<>> Purge_CMXclient () - Infected MAC [",mac,"] not found in InfectMacList")
+    if CMXtileMaps:
+        CMXtiles.remove(get_CMXclient_mac_name(normalize_CMX_mac(mac)))
 
 
 # -------------------------------------------------------------------
@@ -813,30 +1689,14 @@ def Purge_CMXclient(mac):
 # NOTE:  I should clean up this routine.  The IOCmac tests are no longer needed after CMX_lookup() was added.
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 def Quarantine_CMXclient(mac):
-    global InfectMacList, QuarantineMacList
-    
-    IOCmac = False
 
     if Debug:
         print("<<>> Quarantine_CMXclient() - [",len(InfectMacList),"]\t[",mac,"]")
-    for i in range(len(InfectMacList)):
-        if CMXversions.Loc_api_version == "v2":
-            if InfectMacList[i].macAddress == mac:
-                QuarantineMacList.append(copy.deepcopy(InfectMacList[i]))
-                del InfectMacList[i]
-                IOCmac = True
-                break
-        elif CMXversions.Loc_api_version == "v3":
-            if InfectMacList[i].deviceId == mac:
-                QuarantineMacList.append(copy.deepcopy(InfectMacList[i]))
-                del InfectMacList[i]
-                IOCmac = True
-                break
-    if not IOCmac:                           # Legacy test.   This should not happen now that I call CMX_lookup() from the start.
+    if not CMXregistry.quarantine(mac):      # Legacy test.   This should not happen now that I call CMX_lookup() from the start.
         if Debug:
             print("<<>> Quarantine_CMXclient() - Infected MAC [",mac,"] not found in InfectMacList")
-        CMX_lookup(mac)
-        Quarantine_CMXclient(mac)
+        if CMX_lookup(mac):                  # The lookup runs outside the registry lock, so other threads aren't held up by the API call
+            CMXregistry.quarantine(mac)
     return()
 
 
@@ -878,18 +1738,19 @@ def Validate_Test():
     print("\t\tNumber of Clients found: [",len(CMXclientList),"]\n")
 #
     if len(CMXclientList) > 0:                                  # All the remaining tests require client Macs to work with.
+        Mac = lambda i: CMXclientList[min(i, len(CMXclientList)-1)].macAddress   # Client "i", or the last one on a small list
         print('Validate #6:  CMX_lookup(mac) - Using MACs from full CMXclientList')         # This call queries CMX for a specific MAC address
         print('              Selecting Mac Addresses to the "InfectMacList" for this test:')   # The "CMX_lookup(mac)" routine is the normal entry into the CMX routines
-        print("\t\tLooking up MAC's: [",CMXclientList[0].macAddress,",",CMXclientList[1].macAddress,",",CMXclientList[2].macAddress,",",CMXclientList[10].macAddress,",",
-              CMXclientList[int(len(CMXclientList)/2)].macAddress,",",CMXclientList[int(len(CMXclientList)/3)].macAddress,",",CMXclientList[int(len(CMXclientList)/4)].macAddress,",",CMXclientList[int(len(CMXclientList)/5)].macAddress,"]")
-        CMX_Client = CMX_lookup(CMXclientList[0].macAddress)
-        CMX_Client = CMX_lookup(CMXclientList[1].macAddress)
-        CMX_Client = CMX_lookup(CMXclientList[2].macAddress)
-        CMX_Client = CMX_lookup(CMXclientList[10].macAddress)
-        CMX_Client = CMX_lookup(CMXclientList[int(len(CMXclientList)/2)].macAddress) # I can't predict what the maximum clients is, so...
-        CMX_Client = CMX_lookup(CMXclientList[int(len(CMXclientList)/3)].macAddress) # I can't predict what the maximum clients is, so...
-        CMX_Client = CMX_lookup(CMXclientList[int(len(CMXclientList)/4)].macAddress) # I can't predict what the maximum clients is, so...
-        CMX_Client = CMX_lookup(CMXclientList[int(len(CMXclientList)/5)].macAddress) # I can't predict what the maximum clients is, so...
+        print("\t\tLooking up MAC's: [",Mac(0),",",Mac(1),",",Mac(2),",",Mac(10),",",
+              Mac(int(len(CMXclientList)/2)),",",Mac(int(len(CMXclientList)/3)),",",Mac(int(len(CMXclientList)/4)),",",Mac(int(len(CMXclientList)/5)),"]")
+        CMX_Client = CMX_lookup(Mac(0))
+        CMX_Client = CMX_lookup(Mac(1))
+        CMX_Client = CMX_lookup(Mac(2))
+        CMX_Client = CMX_lookup(Mac(10))
+        CMX_Client = CMX_lookup(Mac(int(len(CMXclientList)/2)))    # I can't predict what the maximum clients is, so...
+        CMX_Client = CMX_lookup(Mac(int(len(CMXclientList)/3)))    # I can't predict what the maximum clients is, so...
+        CMX_Client = CMX_lookup(Mac(int(len(CMXclientList)/4)))    # I can't predict what the maximum clients is, so...
+        CMX_Client = CMX_lookup(Mac(int(len(CMXclientList)/5)))    # I can't predict what the maximum clients is, so...
         if Verbose:
             for i in range(len(InfectMacList)):
                 print("IOCmac (",i,")\t",InfectMacList[i])
@@ -898,12 +1759,12 @@ def Validate_Test():
             print("\t\t[{}]\tMAC addresses currently on the InfectMacList\n".format(len(InfectMacList)))
 #
         print('Validate #7:  CMX_quarintine(mac) - Moving some MACs from the InfectMacList to the CMXclientList')  
-        print("\t\tMoving IOC MAC's: [",CMXclientList[0].macAddress,",",CMXclientList[1].macAddress,",",CMXclientList[2].macAddress,",",CMXclientList[15].macAddress,"]")
-        print("\t\t[{}] is not currently on the InfectMacList.".format(CMXclientList[15].macAddress))      
-        Quarantine_CMXclient(CMXclientList[0].macAddress)                     # Move a client previously inserted on the InfectMacList
-        Quarantine_CMXclient(CMXclientList[1].macAddress)                     # Move a client previously inserted on the InfectMacList
-        Quarantine_CMXclient(CMXclientList[2].macAddress)                     # Move a client previously inserted on the InfectMacList
-        Quarantine_CMXclient(CMXclientList[15].macAddress)                    # This client isn't in the InfectMacList
+        print("\t\tMoving IOC MAC's: [",Mac(0),",",Mac(1),",",Mac(2),",",Mac(15),"]")
+        print("\t\t[{}] is not currently on the InfectMacList.".format(Mac(15)))      
+        Quarantine_CMXclient(Mac(0))                                          # Move a client previously inserted on the InfectMacList
+        Quarantine_CMXclient(Mac(1))                                          # Move a client previously inserted on the InfectMacList
+        Quarantine_CMXclient(Mac(2))                                          # Move a client previously inserted on the InfectMacList
+        Quarantine_CMXclient(Mac(15))                                         # This client isn't in the InfectMacList  (On a list of 16+ clients)
         if Verbose:
             for i in range(len(InfectMacList)):
                 print("IOCmac (",i,")\t",InfectMacList[i])
@@ -914,13 +1775,13 @@ def Validate_Test():
             print("\t\t[{}]\tMAC addresses currently on the QuarantineMacList\n".format(len(QuarantineMacList)))
 #
         print('Validate #8:  CMX_purge(mac) - Removing MAC addresses from the InfectMacList and from the QuarantineMacList')
-        print("\t\tRemoving MAC's from InfectMacList: [",CMXclientList[0].macAddress,",",CMXclientList[1].macAddress,",",CMXclientList[10].macAddress,",",CMXclientList[int(len(CMXclientList)/4)].macAddress,"]")
-        print("\t\tRemoving MAC's from QuarantineMacList: [",CMXclientList[15].macAddress,", 00:01:02:03:aa:ff]")
-        Purge_CMXclient(CMXclientList[0].macAddress)
-        Purge_CMXclient(CMXclientList[1].macAddress)
-        Purge_CMXclient(CMXclientList[10].macAddress)
-        Purge_CMXclient(CMXclientList[int(len(CMXclientList)/4)].macAddress)
-        Purge_CMXclient(CMXclientList[15].macAddress)                           # This client is on the QuarantineMacList
+        print("\t\tRemoving MAC's from InfectMacList: [",Mac(0),",",Mac(1),",",Mac(10),",",Mac(int(len(CMXclientList)/4)),"]")
+        print("\t\tRemoving MAC's from QuarantineMacList: [",Mac(15),", 00:01:02:03:aa:ff]")
+        Purge_CMXclient(Mac(0))
+        Purge_CMXclient(Mac(1))
+        Purge_CMXclient(Mac(10))
+        Purge_CMXclient(Mac(int(len(CMXclientList)/4)))
+        Purge_CMXclient(Mac(15))                                                # This client is on the QuarantineMacList
         Purge_CMXclient("00:01:02:03:aa:ff]")                                   # This client doesn't exist on any list.
         if Verbose:
             for i in range(len(InfectMacList)):
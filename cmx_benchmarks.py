@@ -0,0 +1,732 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_benchmarks() - benchmarks for the CMX routines.  Run it directly:  "python cmx_benchmarks.py"
+#   - Every benchmark works on synthetic data [See:  cmx_synthetic.py], so no CMX server is needed.  The ones that run
+#     CMX-Modules.py itself talk to a stand-in CMX in this process.  [See:  cmx_mockserver.py & CMX_modules()]
+#   - Each bench_*() routine returns a dictionary of its results, and prints them when "verbose" is set.
+#   - "python cmx_benchmarks.py [names] [--quick] [--json FILE] [--compare FILE]" runs some or all of them.  --json keeps
+#     the results with what they were measured on, and --compare lists what got slower or faster since an earlier run,
+#     exiting with 1 if anything regressed by more than --threshold.
+
+import argparse, gc, importlib.util, json, math, os, platform, random, sys, tempfile, time, tracemalloc
+import PIL
+from cmx_classes import CMX_ClientTable, CMX_FloorFields, CMX_ClientLocation_v2, CMX_ClientLocation_v3
+from cmx_parser import CMX_Parser, CMX_v2ClientSchema, CMX_v3ClientSchema, CMXjsonLoads
+from cmx_synthetic import make_CMX_mac, make_CMX_v2_clients, make_CMX_v2_payload, make_CMX_v3_payload
+from cmx_mockserver import CMX_MockCMX, CMX_MockServer
+from cmx_session import CMX_LocalTransport
+from cmx_registry import CMX_ClientRegistry
+from cmx_render import CMX_RenderProfiles, CMX_draw_map, CMX_save_map
+from cmx_spatial import CMX_SpatialIndex
+from cmx_store import CMX_ClientStore
+from cmx_tiles import CMX_TileCache
+from cmx_transform import CMX_FloorTransform
+import cmx_transform
+from PIL import Image
+
+# -------------------------------------------------------------------
+# CMX_DictClient - The client record as it was before __slots__:  every field in a per-instance __dict__, and every string
+#   its own copy, the way json.loads() hands them back, and the floor metadata copied into every client.  Used as the baseline for bench_client_memory().
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_DictClient:
+    def __init__ (self,cmxClient):
+        fields = [f for f in type(cmxClient).__slots__ if f != "floor"] + [f[0] for f in CMX_FloorFields]
+        for field in fields:
+            value = getattr(cmxClient, field)
+            if type(value) is str:
+                value = "".join(list(value))            # A private copy, not the interned one
+            elif type(value) is int:
+                value = int(str(value))
+            setattr(self, field, value)
+
+def _measure(build):                                    # (result, bytes allocated by build())
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        used = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return(result, used)
+
+# -------------------------------------------------------------------
+# bench_client_memory() - Memory held by "n" clients, stored three ways:
+#   dict        - Plain objects with a __dict__ and private strings.  (The original layout.)
+#   slots       - CMX_ClientLocation_v2 objects, with __slots__ and shared values.
+#   table       - One CMX_ClientTable.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_client_memory(n=50000,verbose=True):
+    clients = make_CMX_v2_clients(n)
+    results = {"clients": n}
+    dictClients, results["dict"]  = _measure(lambda: [CMX_DictClient(c) for c in clients])
+    del dictClients
+    clients, results["slots"]     = _measure(lambda: make_CMX_v2_clients(n))
+    table, results["table"]       = _measure(lambda: CMX_ClientTable(clients))
+    for layout in ("dict", "slots", "table"):
+        results[layout+"PerClient"] = results[layout] / n
+    if verbose:
+        print("bench_client_memory() - Clients: [", n, "]")
+        for layout in ("dict", "slots", "table"):
+            print("    {:<6} {:>12,} bytes  {:>8.1f} bytes/client  {:>6.1%} of dict".format(layout, results[layout],
+                  results[layout+"PerClient"], results[layout] / results["dict"]))
+    return(results)
+
+def _best(run,repeat):                                  # Best wall time of "repeat" runs, in seconds
+    best = None
+    for r in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return(best)
+
+def _legacy_parse_v2(jsonR):                            # The original parse_CMX_v2_clients() loop.  (Baseline.)
+    Clist = []
+    for cl in range(len(jsonR)):
+        a1 = jsonR[cl]["macAddress"]
+        a2 = jsonR[cl]["manufacturer"]
+        a3 = jsonR[cl]["mapCoordinate"]["unit"]
+        a4 = jsonR[cl]["mapCoordinate"]["x"]
+        a5 = jsonR[cl]["mapCoordinate"]["y"]
+        a6 = jsonR[cl]["mapInfo"]["floorDimension"]["height"]
+        a7 = jsonR[cl]["mapInfo"]["floorDimension"]["length"]
+        a8 = jsonR[cl]["mapInfo"]["floorDimension"]["offsetX"]
+        a9 = jsonR[cl]["mapInfo"]["floorDimension"]["offsetY"]
+        b1 = jsonR[cl]["mapInfo"]["floorDimension"]["unit"]
+        b2 = jsonR[cl]["mapInfo"]["floorDimension"]["width"]
+        b3 = jsonR[cl]["mapInfo"]["floorRefId"]
+        b4 = jsonR[cl]["mapInfo"]["image"]["height"]
+        b5 = jsonR[cl]["mapInfo"]["image"]["imageName"]
+        b6 = jsonR[cl]["mapInfo"]["image"]["maxResolution"]
+        b7 = jsonR[cl]["mapInfo"]["image"]["size"]
+        b8 = jsonR[cl]["mapInfo"]["image"]["width"]
+        b9 = jsonR[cl]["mapInfo"]["image"]["zoomLevel"]
+        c  = jsonR[cl]["mapInfo"]["mapHierarchyString"]
+        client = CMX_ClientLocation_v2(a1,a2,a3,a4,a5,a6,a7,a8,a9,b1,b2,b3,b4,b5,b6,b7,b8,b9,c)
+        client.Loc_time = "NoTime"
+        Clist.append(client)
+    return(Clist)
+
+# -------------------------------------------------------------------
+# bench_parse() - Time to parse a synthetic "n" client v2 payload:
+#   legacy      - The original field-by-field loop, on decoded JSON.
+#   compiled    - CMX_Parser, on decoded JSON.
+#   decode      - Decoding the raw bytes with CMXjsonLoads.  ("decoder" says which one.)
+#   bytes       - CMX_Parser, from the raw bytes.  (Decode + parse.)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_parse(n=50000,repeat=3,verbose=True):
+    payload = make_CMX_v2_payload(n)
+    raw     = json.dumps(payload).encode()
+    parser  = CMX_Parser(CMX_v2ClientSchema, CMX_ClientLocation_v2)
+    results = {"clients": n, "decoder": CMXjsonLoads.__module__}
+    results["legacy"]   = _best(lambda: _legacy_parse_v2(payload), repeat)
+    results["compiled"] = _best(lambda: parser.parse(payload, Loc_time="NoTime"), repeat)
+    results["decode"]   = _best(lambda: CMXjsonLoads(raw), repeat)
+    results["bytes"]    = _best(lambda: parser.parse(raw, Loc_time="NoTime"), repeat)
+    results["speedup"]  = results["legacy"] / results["compiled"]
+    if verbose:
+        print("bench_parse() - Clients: [", n, "]\tDecoder: [", results["decoder"], "]")
+        for step in ("legacy", "compiled", "decode", "bytes"):
+            print("    {:<9} {:>8.1f} ms  {:>6.2f} us/client".format(step, results[step]*1000, results[step]*1e6/n))
+        print("    compiled parser is {:.2f}x the legacy loop".format(results["speedup"]))
+    return(results)
+
+# -------------------------------------------------------------------
+# bench_v3_vs_v2() - The v3 ingest path against the v2 one, on the same synthetic clients.
+#   throughput  - Clients per second parsed from the raw bytes of an "n" client response.  (get_all_CMX_clients())
+#   latency     - Median time to parse a one client response.  (fetch_CMX_client(), once per looked up MAC.)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_v3_vs_v2(n=50000,repeat=3,samples=2000,verbose=True):
+    results = {"clients": n}
+    for version, payload, schema, build in (("v2", make_CMX_v2_payload(n), CMX_v2ClientSchema, CMX_ClientLocation_v2),
+                                            ("v3", make_CMX_v3_payload(n), CMX_v3ClientSchema, CMX_ClientLocation_v3)):
+        parser = CMX_Parser(schema, build)
+        raw    = json.dumps(payload).encode()
+        singles = [json.dumps([record]).encode() for record in payload[:samples]]
+        results[version+"Throughput"] = n / _best(lambda: parser.parse(raw, Loc_time="NoTime"), repeat)
+        times = []
+        for single in singles:
+            start = time.perf_counter()
+            parser.parse(single, Loc_time="NoTime")
+            times.append(time.perf_counter() - start)
+        results[version+"Latency"] = sorted(times)[len(times)//2]
+    if verbose:
+        print("bench_v3_vs_v2() - Clients: [", n, "]")
+        for version in ("v2", "v3"):
+            print("    {}  {:>10,.0f} clients/s  {:>7.1f} us/lookup".format(version, results[version+"Throughput"],
+                  results[version+"Latency"]*1e6))
+    return(results)
+
+# -------------------------------------------------------------------
+# bench_transform() - Time to turn "n" client positions into floor image pixels:
+#   perClient   - CMX_FloorTransform.apply() once per client.
+#   loop        - apply_many() without NumPy.
+#   numpy       - apply_many() with NumPy.  (Skipped if NumPy isn't installed.)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_transform(n=50000,repeat=3,verbose=True):
+    clients   = make_CMX_v2_clients(n, floors=1)
+    transform = CMX_FloorTransform(clients[0].floor, (701, 480))
+    xs = [c.map_xcord for c in clients]
+    ys = [c.map_ycord for c in clients]
+    results = {"clients": n}
+    results["perClient"] = _best(lambda: [transform.apply(x, y, "FEET") for x, y in zip(xs, ys)], repeat)
+    numpy = cmx_transform.numpy
+    try:
+        cmx_transform.numpy = None
+        results["loop"] = _best(lambda: transform.apply_many(xs, ys, "FEET"), repeat)
+    finally:
+        cmx_transform.numpy = numpy
+    if numpy is not None:
+        results["numpy"] = _best(lambda: transform.apply_many(xs, ys, "FEET"), repeat)
+    if verbose:
+        print("bench_transform() - Clients: [", n, "]")
+        for step in ("perClient", "loop", "numpy"):
+            if step in results:
+                print("    {:<9} {:>8.1f} ms  {:>6.3f} us/client".format(step, results[step]*1000, results[step]*1e6/n))
+    return(results)
+
+
+# -------------------------------------------------------------------
+# bench_warm_restart() - Time to get "n" tracked clients back after a restart, from the client store or from CMX:
+#   write       - Writing them to a CMX_ClientStore journal, one append per client.
+#   rewrite     - Writing every client "rounds" more times to a journal that compacts every "compactEvery" stale lines
+#                 (default n/4), so the compactions run while the appends go on.  Includes waiting for the last one.
+#   appendMax   - The slowest single append of "rewrite".  (An append never waits for a compaction.)
+#   compact     - One compact() of a journal holding every client twice.
+#   warm        - load() of the journal into a new registry.
+#   requery     - CMX_lookup_many() of the "n" MACs from the stand-in CMX, answering after "rtt" seconds.  (One bulk walk of
+#                 the client list, as a batch this large is fetched.)  [See:  fetch_CMX_clients()]
+#   requeryEach - The same with one call per MAC, "workers" in flight.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_warm_restart(n=5000,rtt=0.020,workers=10,rounds=4,compactEvery=None,repeat=3,verbose=True):
+    payload = make_CMX_v2_payload(n)
+    parser  = CMX_Parser(CMX_v2ClientSchema, CMX_ClientLocation_v2)
+    clients = parser.parse(payload, Loc_time="NoTime")
+    compactEvery = compactEvery if compactEvery is not None else max(1, n // 4)
+    results = {"clients": n, "rtt": rtt, "workers": workers, "compactEvery": compactEvery}
+    for client in clients:
+        client.Loc_Status = "IoC"
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "clients_db.jsonl")
+        store = CMX_ClientStore(path, compactEvery=n * (rounds + 2))
+        start = time.perf_counter()
+        for client in clients:
+            store.put(client.macAddress, client, "IoC")
+        results["write"] = time.perf_counter() - start
+        results["bytes"] = os.path.getsize(path)
+        def warm():
+            registry = CMX_ClientRegistry()
+            for client, status in CMX_ClientStore(path).load().values():
+                registry.restore(client, status)
+        results["warm"] = _best(warm, repeat)
+        for client in clients:
+            store.put(client.macAddress, client, "IoC")
+        start = time.perf_counter()
+        store.compact()
+        results["compact"] = time.perf_counter() - start
+        store.close()
+        store = CMX_ClientStore(os.path.join(folder, "rewrite_db.jsonl"), compactEvery=compactEvery)
+        worst = 0.0
+        start = time.perf_counter()
+        for r in range(rounds + 1):
+            for client in clients:
+                t = time.perf_counter()
+                store.put(client.macAddress, client, "IoC")
+                worst = max(worst, time.perf_counter() - t)
+        store.wait()
+        results["rewrite"]     = time.perf_counter() - start
+        results["appendMax"]   = worst
+        results["compactions"] = store.compactions
+        store.close()
+        m, mock = CMX_modules(folder, clients=n, latency=rtt)
+        try:
+            m.CMXclientMaps = False
+            m.CMXworkers    = workers
+            macs = [record["macAddress"] for record in mock.records]
+            def requery():
+                m.CMXlocationCache.clear()
+                m.CMX_lookup_many(macs)
+            results["requery"] = _best(requery, repeat)
+            m.CMXbulkThreshold = n + 1
+            results["requeryEach"] = _best(requery, 1)
+        finally:
+            CMX_modules_close(m)
+    results["speedup"]     = results["requery"] / results["warm"]
+    results["eachSpeedup"] = results["requeryEach"] / results["warm"]
+    if verbose:
+        print("bench_warm_restart() - Clients: [", n, "]\tJournal: [", "{:,}".format(results["bytes"]), "bytes ]")
+        for step in ("write", "rewrite", "compact", "warm", "requery", "requeryEach"):
+            print("    {:<11} {:>8.1f} ms  {:>6.2f} us/client".format(step, results[step]*1000, results[step]*1e6/n))
+        print("    slowest append {:.2f} ms  ({} compactions during the rewrite)".format(results["appendMax"]*1000, results["compactions"]))
+        print("    warm restart is {:.1f}x a bulk re-query of CMX, {:.1f}x one call per MAC  (at {:.0f} ms per round trip, {} in flight)".format(
+              results["speedup"], results["eachSpeedup"], rtt*1000, workers))
+    return(results)
+
+# -------------------------------------------------------------------
+# bench_spatial() - Proximity queries over "n" clients, with a CMX_SpatialIndex against a scan of the client list:
+#   build       - First refresh() of the index.
+#   refresh     - refresh() after "moved" of the clients moved a little.  (The incremental case.)
+#   scanNear    - Clients within "radius" of a client, by scanning the list.  (Per query.)
+#   near        - The same query on the index.
+#   scanNearest - The "k" nearest clients, by scanning and sorting.  (Per query.)
+#   nearest     - The same query on the index.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_spatial(n=50000,queries=200,radius=30.0,k=10,moved=0.05,cellSize=25.0,verbose=True):
+    clients = make_CMX_v2_clients(n)
+    rng     = random.Random(0)
+    targets = [clients[rng.randrange(n)] for q in range(queries)]
+    index   = CMX_SpatialIndex(cellSize)
+    results = {"clients": n, "queries": queries, "radius": radius, "k": k}
+    start = time.perf_counter()
+    index.refresh(clients)
+    results["build"] = time.perf_counter() - start
+    for c in rng.sample(clients, int(n * moved)):
+        c.map_xcord = min(c.map_xcord + rng.uniform(-10, 10), 399.0)
+    start = time.perf_counter()
+    results["changes"] = index.refresh(clients)
+    results["refresh"] = time.perf_counter() - start
+
+    def scan(t):
+        return([(math.hypot(c.map_xcord - t.map_xcord, c.map_ycord - t.map_ycord), c) for c in clients
+                if c.mapinfo_floorRefId == t.mapinfo_floorRefId])
+    def timed(query):
+        start = time.perf_counter()
+        for t in targets:
+            query(t)
+        return((time.perf_counter() - start) / queries)
+    results["scanNear"]    = timed(lambda t: sorted([f for f in scan(t) if f[0] <= radius], key=lambda f: f[0]))
+    results["near"]        = timed(lambda t: index.near(t.mapinfo_floorRefId, t.map_xcord, t.map_ycord, radius))
+    results["scanNearest"] = timed(lambda t: sorted(scan(t), key=lambda f: f[0])[:k])
+    results["nearest"]     = timed(lambda t: index.nearest(t.mapinfo_floorRefId, t.map_xcord, t.map_ycord, k))
+    if verbose:
+        print("bench_spatial() - Clients: [", n, "]\tRadius: [", radius, "]\tk: [", k, "]\tCell: [", cellSize, "]")
+        print("    {:<11} {:>8.1f} ms".format("build", results["build"]*1000))
+        print("    {:<11} {:>8.1f} ms  {}".format("refresh", results["refresh"]*1000, results["changes"]))
+        for scanStep, step in (("scanNear", "near"), ("scanNearest", "nearest")):
+            print("    {:<11} {:>8.3f} ms/query".format(scanStep, results[scanStep]*1000))
+            print("    {:<11} {:>8.3f} ms/query  {:>6.1f}x faster".format(step, results[step]*1000, results[scanStep] / results[step]))
+    return(results)
+
+# -------------------------------------------------------------------
+# bench_render_profiles() - Draws and writes "renders" client maps with each render profile [See:  CMX_RenderProfiles in
+#   cmx_render.py], at random spots on a floor plan, and reports the time per map and the size of the files.
+#   floorImage / icon - Default to the sample floor plan and threat icon under CMX/ next to this file.
+#   The maps are written to a temporary folder, so the disk cache is part of the time, as it is for real lookups.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_render_profiles(floorImage=None,icon=None,renders=20,profiles=None,verbose=True):
+    here       = os.path.dirname(os.path.abspath(__file__))
+    floorImage = floorImage or os.path.join(here, "CMX", "FloorPlans", "simfloor.jpg")
+    icon       = icon or os.path.join(here, "CMX", "Icons", "poiYellow.jpg")
+    profiles   = profiles or list(CMX_RenderProfiles)
+    floorImg, iconImg = Image.open(floorImage), Image.open(icon)
+    floorImg.load()
+    iconImg.load()
+    rng     = random.Random(0)
+    spots   = [(rng.uniform(0, floorImg.width), rng.uniform(0, floorImg.height)) for r in range(renders)]
+    results = {"floorImage": floorImage, "size": floorImg.size, "renders": renders, "profiles": {}}
+    with tempfile.TemporaryDirectory() as folder:
+        for name in profiles:
+            profile = CMX_RenderProfiles[name]
+            ofname  = os.path.join(folder, name + profile.ext)
+            options = profile.options()
+            sizes   = []
+            start   = time.perf_counter()
+            for xy in spots:
+                CMX_save_map(CMX_draw_map(floorImg, iconImg, xy, profile), ofname, profile.fmt, **options)
+                sizes.append(os.path.getsize(ofname))
+            results["profiles"][name] = {"profile": profile._asdict(), "render": (time.perf_counter() - start) / renders,
+                                         "bytes": sum(sizes) // renders}
+    if verbose:
+        print("bench_render_profiles() - Floor: [", os.path.basename(floorImage), floorImg.size, "]\tRenders: [", renders, "]")
+        full = results["profiles"].get("full")
+        for name, r in results["profiles"].items():
+            line = "    {:<6} {:>8.1f} ms/render  {:>9,} bytes".format(name, r["render"]*1000, r["bytes"])
+            if full is not None and name != "full":
+                line += "  {:>5.1f}x faster  {:>5.1f}x smaller".format(full["render"] / r["render"], full["bytes"] / r["bytes"])
+            print(line)
+    return(results)
+
+# -------------------------------------------------------------------
+# bench_tiles() - A client moving on a large floor plan:  re-drawing its whole client map against re-drawing its overlay
+#   tiles.  [See:  cmx_tiles.py]  The sample floor plan is scaled up to "size" first.  (The CMX image size of simfloor.jpg.)
+#   cut         - Cutting the tile pyramid.  (Once per floor plan.)
+#   map         - One full client map with the "profile" render profile, per move.
+#   tiles       - The overlay tiles of one client, per move.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_tiles(size=(2801,1912),moves=20,step=15.0,tileSize=256,profile="full",verbose=True):
+    here    = os.path.dirname(os.path.abspath(__file__))
+    icon    = os.path.join(here, "CMX", "Icons", "poiYellow.jpg")
+    iconImg = Image.open(icon)
+    iconImg.load()
+    rng     = random.Random(0)
+    spots   = [(size[0] / 2, size[1] / 2)]
+    for m in range(moves):
+        spots.append((min(max(spots[-1][0] + rng.uniform(-step, step), 0), size[0] - 1),
+                      min(max(spots[-1][1] + rng.uniform(-step, step), 0), size[1] - 1)))
+    results = {"size": size, "moves": moves, "tileSize": tileSize, "profile": profile}
+    with tempfile.TemporaryDirectory() as folder:
+        floorImage = os.path.join(folder, "bigfloor.jpg")
+        floorImg   = Image.open(os.path.join(here, "CMX", "FloorPlans", "simfloor.jpg")).resize(size)
+        floorImg.save(floorImage, quality=90)
+        tiles = CMX_TileCache(os.path.join(folder, "tiles"), tileSize)
+        start = time.perf_counter()
+        tiles.pyramid(floorImage)
+        results["cut"] = time.perf_counter() - start
+        tiles.place("bench", floorImage, spots[0], icon)
+
+        mapProfile = CMX_RenderProfiles[profile]
+        ofname  = os.path.join(folder, "bench" + mapProfile.ext)
+        options = mapProfile.options()
+        start   = time.perf_counter()
+        for xy in spots[1:]:
+            CMX_save_map(CMX_draw_map(floorImg, iconImg, xy, mapProfile), ofname, mapProfile.fmt, **options)
+        results["map"]      = (time.perf_counter() - start) / moves
+        results["mapBytes"] = os.path.getsize(ofname)
+        drawn = tiles.stats()["drawn"]
+        start = time.perf_counter()
+        for xy in spots[1:]:
+            tiles.place("bench", floorImage, xy, icon)
+        results["tiles"]     = (time.perf_counter() - start) / moves
+        results["tilesDrawn"] = (tiles.stats()["drawn"] - drawn) / moves
+        tileFolder = os.path.join(folder, "tiles", "bigfloor", "clients", "bench")
+        results["tileBytes"] = sum(os.path.getsize(os.path.join(tileFolder, f)) for f in os.listdir(tileFolder))
+    if verbose:
+        print("bench_tiles() - Floor: [", size, "]\tMoves: [", moves, "]\tTile: [", tileSize, "]")
+        print("    {:<6} {:>8.1f} ms".format("cut", results["cut"]*1000))
+        print("    {:<6} {:>8.1f} ms/move  {:>9,} bytes  ({})".format("map", results["map"]*1000, results["mapBytes"], profile))
+        print("    {:<6} {:>8.1f} ms/move  {:>9,} bytes  ({:.1f} tiles)  {:>5.1f}x faster".format("tiles", results["tiles"]*1000,
+              results["tileBytes"], results["tilesDrawn"], results["map"] / results["tiles"]))
+    return(results)
+
+
+# -------------------------------------------------------------------
+# CMX_modules() - A fresh copy of CMX-Modules.py for a benchmark, talking to a stand-in CMX [CMX_MockCMX] in this process,
+#   so no sandbox or network is involved.  It reads the floor plans and icons under CMX/ next to this file, and writes its
+#   maps under "folder".  CMX_init() has run.  Returns (module, mock CMX).  Call CMX_modules_close(module) when done.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_modules(folder,clients=1000,api="v2",latency=0.0):
+    here = os.path.dirname(os.path.abspath(__file__))
+    spec = importlib.util.spec_from_file_location("CMX_Modules_bench", os.path.join(here, "CMX-Modules.py"))
+    m    = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(m)
+    m.CMX_Persist  = False
+    m.MapLocation  = os.path.join(here, "CMX", "FloorPlans") + "/"
+    m.DefaultMap   = m.MapLocation + "blankfloor.jpg"
+    m.IconLocation = os.path.join(here, "CMX", "Icons") + "/"
+    m.ThreatIcon   = m.IconLocation + os.path.basename(m.ThreatIcon)
+    m.StatusIcons  = {status: m.IconLocation + os.path.basename(icon) for status, icon in m.StatusIcons.items()}
+    for name in ("MacMaps", "FloorMaps", "FloorTiles"):
+        setattr(m, name, os.path.join(folder, name) + "/")
+        os.makedirs(getattr(m, name), exist_ok=True)
+    mock = CMX_MockCMX(clients, api, latency=latency)
+    m.set_CMX_transport(CMX_LocalTransport(mock.handle))
+    m.CMX_init()
+    return(m, mock)
+
+def CMX_modules_close(m):
+    if m.CMXrenderQueue != "":
+        m.CMXrenderQueue.shutdown()
+    if m.CMXsession != "":
+        m.CMXsession.close()
+    return()
+
+def _median(times):
+    return(sorted(times)[len(times)//2])
+
+def _p95(times):
+    return(sorted(times)[min(len(times) - 1, int(len(times) * 0.95))])
+
+# -------------------------------------------------------------------
+# bench_parse_clients() - Throughput of parse_CMX_v2_clients() and parse_CMX_v3_clients() in CMX-Modules.py, from the raw
+#   bytes of an "n" client response, as get_all_CMX_clients() calls them.  In clients per second.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_parse_clients(n=50000,repeat=3,verbose=True):
+    results = {"clients": n}
+    with tempfile.TemporaryDirectory() as folder:
+        m, mock = CMX_modules(folder, clients=1)
+        for version, payload, parse in (("v2", make_CMX_v2_payload(n), m.parse_CMX_v2_clients),
+                                        ("v3", make_CMX_v3_payload(n), m.parse_CMX_v3_clients)):
+            raw = json.dumps(payload).encode()
+            results[version+"PerSecond"] = n / _best(lambda: parse(raw), repeat)
+        CMX_modules_close(m)
+    if verbose:
+        print("bench_parse_clients() - Clients: [", n, "]")
+        for version in ("v2", "v3"):
+            print("    parse_CMX_{}_clients()  {:>10,.0f} clients/s".format(version, results[version+"PerSecond"]))
+    return(results)
+
+# -------------------------------------------------------------------
+# bench_registry() - Time per call of Add_CMXclient(), Quarantine_CMXclient() and Purge_CMXclient() with "size" clients
+#   already tracked, for each size.  Flat times across the sizes mean the calls don't scan the lists.
+#   add         - Add_CMXclient() of a new client.
+#   update      - Add_CMXclient() of a tracked client at a new position.
+#   quarantine  - Quarantine_CMXclient() of a tracked client.
+#   purge       - Purge_CMXclient() of a tracked client.
+#   listScan    - Finding one MAC by scanning a list of "size" clients, as the lists were searched before CMXregistry.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_registry(sizes=(1000,10000,50000),ops=1000,verbose=True):
+    results = {"sizes": list(sizes), "ops": ops}
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            m, mock = CMX_modules(folder, clients=1)
+            clients = make_CMX_v2_clients(size + ops)
+            moved   = make_CMX_v2_clients(ops, seed=1)      # The first "ops" clients again, at other positions
+            m.Add_CMXclients(clients[:size])
+            extra   = [c.macAddress for c in clients[size:]]
+            warmup  = make_CMX_v2_clients(1, seed=2)[0]     # One call of each first, so nothing is timed on its first run
+            warmup.macAddress = "ff:ff:ff:ff:ff:ff"
+            m.Add_CMXclient(warmup)
+            m.Quarantine_CMXclient(warmup.macAddress)
+            m.Purge_CMXclient(warmup.macAddress)
+            rng     = random.Random(0)
+            wanted  = [clients[rng.randrange(size)].macAddress for i in range(min(ops, 200))]
+            r = {}
+            for step, run in (("add",        lambda: [m.Add_CMXclient(c) for c in clients[size:]]),
+                              ("update",     lambda: [m.Add_CMXclient(c) for c in moved]),
+                              ("quarantine", lambda: [m.Quarantine_CMXclient(mac) for mac in extra]),
+                              ("purge",      lambda: [m.Purge_CMXclient(mac) for mac in extra])):
+                start   = time.perf_counter()
+                run()
+                r[step] = (time.perf_counter() - start) / ops
+            listed = clients[:size]
+            start  = time.perf_counter()
+            for mac in wanted:
+                next(c for c in listed if c.macAddress == mac)
+            r["listScan"] = (time.perf_counter() - start) / len(wanted)
+            results[str(size)] = r
+            CMX_modules_close(m)
+    if verbose:
+        print("bench_registry() - Sizes: [", ", ".join(str(s) for s in sizes), "]\tCalls: [", ops, "]")
+        print("    {:<9}".format("tracked") + "".join("{:>12}".format(step) for step in ("add", "update", "quarantine", "purge", "listScan")) + "  (us/call)")
+        for size in sizes:
+            r = results[str(size)]
+            print("    {:<9}".format(size) + "".join("{:>12.2f}".format(r[step]*1e6) for step in ("add", "update", "quarantine", "purge", "listScan")))
+    return(results)
+
+# -------------------------------------------------------------------
+# bench_map_latency() - Time of one Map_CMXclient() for each floor plan size.  The sample floor plan is scaled to each size.
+#   first       - The first map on the floor, which also decodes the floor plan.
+#   map         - Median of the others.  (Floor plan already decoded.)
+#   bytes       - Average size of the map files.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_map_latency(sizes=((701,480),(1402,960),(2801,1912)),renders=10,profile="full",verbose=True):
+    here    = os.path.dirname(os.path.abspath(__file__))
+    results = {"renders": renders, "profile": profile}
+    with tempfile.TemporaryDirectory() as folder:
+        m, mock = CMX_modules(folder, clients=1)
+        m.CMXrenderAsync = False
+        m.MapProfile     = profile
+        clients  = make_CMX_v2_clients(renders)             # All on "simfloor.jpg"
+        floorImg = Image.open(os.path.join(here, "CMX", "FloorPlans", "simfloor.jpg"))
+        for size in sizes:
+            name = "{}x{}".format(*size)
+            m.MapLocation = os.path.join(folder, name) + "/"
+            os.makedirs(m.MapLocation)
+            floorImg.resize(size).save(m.MapLocation + "simfloor.jpg", quality=90)
+            times, sizes_ = [], []
+            for c in clients:
+                start = time.perf_counter()
+                m.Map_CMXclient(c)
+                times.append(time.perf_counter() - start)
+                sizes_.append(os.path.getsize(m.get_CMXmap_info(c)[2]))
+            results[name] = {"first": times[0], "map": _median(times[1:] or times), "bytes": sum(sizes_) // len(sizes_)}
+        CMX_modules_close(m)
+    if verbose:
+        print("bench_map_latency() - Renders: [", renders, "]\tProfile: [", profile, "]")
+        for size in sizes:
+            r = results["{}x{}".format(*size)]
+            print("    {:<10} {:>8.1f} ms first  {:>8.1f} ms/map  {:>10,} bytes".format("{}x{}".format(*size), r["first"]*1000, r["map"]*1000, r["bytes"]))
+    return(results)
+
+# -------------------------------------------------------------------
+# bench_lookup() - CMX_lookup() end to end against a stand-in CMX [See:  cmx_mockserver.py] holding "clients" clients:
+#   over "local" (CMX_LocalTransport, no sockets, so only our own code is timed) and over "http" (CMX_MockServer on
+#   this machine).  "latency" seconds are added to every CMX call.  Maps are drawn in the background, as by default.
+#   cold        - Median time of a lookup CMX is asked for.  (coldP95 is the 95th percentile.)
+#   cached      - Median time of a lookup answered from CMXlocationCache.
+#   many        - CMX_lookup_many() of the same MACs, per MAC.
+#   drain       - Time for the background maps of the lookups to finish after each step.  (Waited for, so one step's maps
+#                 don't slow down the next step.)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def bench_lookup(clients=5000,lookups=200,latency=0.0,transports=("local","http"),verbose=True):
+    results = {"clients": clients, "lookups": lookups, "latency": latency}
+    macs    = [make_CMX_mac(i) for i in random.Random(0).sample(range(clients), lookups)]
+    with tempfile.TemporaryDirectory() as folder:
+        for transport in transports:
+            m, mock = CMX_modules(folder, clients=clients, latency=latency)
+            host, server = m.CMX["host"], None
+            try:
+                if transport == "http":
+                    server = CMX_MockServer(mock).start()
+                    m.set_CMX_transport(None, server.address, "http")
+                    m.CMX_init()
+                r = {"drain": 0.0}
+                def drain():
+                    start = time.perf_counter()
+                    if m.CMXrenderQueue != "":
+                        m.CMXrenderQueue.wait()
+                    r["drain"] += time.perf_counter() - start
+                for step in ("cold", "cached"):
+                    times = []
+                    for mac in macs:
+                        start = time.perf_counter()
+                        m.CMX_lookup(mac)
+                        times.append(time.perf_counter() - start)
+                    r[step] = _median(times)
+                    if step == "cold":
+                        r["coldP95"] = _p95(times)
+                    drain()
+                m.CMXlocationCache.clear()
+                start = time.perf_counter()
+                m.CMX_lookup_many(macs)
+                r["many"] = (time.perf_counter() - start) / lookups
+                drain()
+                r["requests"] = mock.requests
+                results[transport] = r
+            finally:
+                if server is not None:
+                    server.stop()
+                m.CMX["host"] = host
+                CMX_modules_close(m)
+    if verbose:
+        print("bench_lookup() - Clients: [", clients, "]\tLookups: [", lookups, "]\tLatency: [", latency, "s ]")
+        for transport in transports:
+            r = results[transport]
+            print("    {:<6} cold {:>7.2f} ms  p95 {:>7.2f} ms  cached {:>7.3f} ms  many {:>7.3f} ms/MAC  drain {:>7.1f} ms  ({} CMX calls)".format(
+                  transport, r["cold"]*1000, r["coldP95"]*1000, r["cached"]*1000, r["many"]*1000, r["drain"]*1000, r["requests"]))
+    return(results)
+
+
+# -------------------------------------------------------------------
+# CMX_Benchmarks - Every benchmark by name:  (routine, smaller arguments for "--quick").
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+CMX_Benchmarks = {
+    "memory":          (bench_client_memory,   {"n": 5000}),
+    "parse":           (bench_parse,           {"n": 5000, "repeat": 1}),
+    "v3_vs_v2":        (bench_v3_vs_v2,        {"n": 5000, "repeat": 1, "samples": 200}),
+    "parse_clients":   (bench_parse_clients,   {"n": 5000, "repeat": 1}),
+    "transform":       (bench_transform,       {"n": 5000, "repeat": 1}),
+    "warm_restart":    (bench_warm_restart,    {"n": 500, "repeat": 1}),
+    "spatial":         (bench_spatial,         {"n": 5000, "queries": 50}),
+    "registry":        (bench_registry,        {"sizes": (100, 1000, 5000), "ops": 200}),
+    "render_profiles": (bench_render_profiles, {"renders": 3}),
+    "map_latency":     (bench_map_latency,     {"sizes": ((701, 480), (1402, 960)), "renders": 3}),
+    "tiles":           (bench_tiles,           {"moves": 3}),
+    "lookup":          (bench_lookup,          {"clients": 1000, "lookups": 50}),
+}
+CMX_HigherIsBetter = ("PerSecond", "Throughput", "speedup")   # Result names where a bigger number is an improvement
+
+# -------------------------------------------------------------------
+# run_benchmarks() - Runs the named benchmarks (default all) and returns {"meta": {...}, "results": {name: results}}.
+#   The "meta" block records what the numbers were measured on, so two runs can be told apart.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def run_benchmarks(names=None,quick=False,verbose=True):
+    Results = {}
+    for name in names or list(CMX_Benchmarks):
+        routine, quickArgs = CMX_Benchmarks[name]
+        Results[name] = routine(verbose=verbose, **(quickArgs if quick else {}))
+        if verbose:
+            print()
+    meta = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "quick": quick, "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count(), "pillow": PIL.__version__,
+            "numpy": getattr(cmx_transform.numpy, "__version__", None), "decoder": CMXjsonLoads.__module__}
+    return({"meta": meta, "results": Results})
+
+def _flatten(results,prefix=""):                        # {"a": {"b": 1}} --> {"a.b": 1}, numbers only
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, prefix + key + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return(flat)
+
+# -------------------------------------------------------------------
+# compare_benchmarks() - Compares two runs of run_benchmarks().  Returns a list of (result, old, new, change), where
+#   "change" is how much worse the new run is (0.25 is 25% worse, -0.5 is twice as good).  Only numbers that are in both
+#   runs and differ are listed, so the settings of a benchmark (client counts, sizes) drop out when they match.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def compare_benchmarks(new,old):
+    Changes = []
+    for name in new["results"]:
+        if name not in old["results"]:
+            continue
+        before = _flatten(old["results"][name])
+        for key, value in _flatten(new["results"][name]).items():
+            was = before.get(key)
+            if was is None or was == value or was == 0 or value == 0:
+                continue
+            ratio = value / was
+            if key.split(".")[-1].endswith(CMX_HigherIsBetter):
+                ratio = 1 / ratio
+            Changes.append((name + "." + key, was, value, ratio - 1))
+    return(Changes)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the CMX routines.  No CMX server needed.")
+    parser.add_argument("names", nargs="*", help="benchmarks to run (default all):  " + ", ".join(CMX_Benchmarks))
+    parser.add_argument("--quick", action="store_true", help="smaller data sets, for a fast check")
+    parser.add_argument("--json", metavar="FILE", help="write the results to FILE as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare with the results of an earlier --json run")
+    parser.add_argument("--threshold", type=float, default=0.10, help="change reported as a regression (default 0.10 = 10%%)")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in CMX_Benchmarks]
+    if unknown:
+        parser.error("unknown benchmark: " + ", ".join(unknown))
+
+    run = run_benchmarks(args.names, args.quick)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(run, f, indent=2, default=str)
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        if old["meta"].get("quick") != run["meta"]["quick"]:
+            print("<<%>> The runs were made with different --quick settings.  Their numbers don't compare.")
+        Changes    = compare_benchmarks(run, old)
+        Regressed  = [c for c in Changes if c[3] > args.threshold]
+        print("Compared with [", args.compare, "] of", old["meta"].get("time"), "\t[", len(Changes), "] results changed")
+        for key, was, value, change in sorted(Changes, key=lambda c: -c[3]):
+            if abs(change) > args.threshold:
+                print("    {:<45} {:>14.6g} --> {:<14.6g} {:>+7.1%} {}".format(key, was, value, change, "REGRESSED" if change > args.threshold else "improved"))
+        if Regressed:
+            print("[", len(Regressed), "] results regressed by more than {:.0%}".format(args.threshold))
+            sys.exit(1)
@@ -0,0 +1,359 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_cache() - defines the caches used by the CMX routines.
+#   - Each cache keeps its own hit/miss counters, which can be read with stats().
+#   - All caches are thread safe, since lookups can run on the lookup thread pool.
+
+import os, shutil, threading, time
+from collections import OrderedDict
+from PIL import Image                                   # Image manipulation tools, From:  "pip install Pillow"
+
+# -------------------------------------------------------------------
+# CMX_render_key() - Builds the render cache key for one client map.  Two maps with the same key are identical images.
+#   The key is the floor image, the rounded (x,y) position, the icon and the output format or render profile.  The modify times of the
+#   floor image and icon are part of the key too, so replacing either file on disk never returns a stale map.
+#   Returns "None" if either file can't be found.  (Those maps are never cached.)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_render_key(floorImage,xy,icon,fmt):
+    try:
+        floorTime = os.stat(floorImage).st_mtime_ns
+        iconTime  = os.stat(icon).st_mtime_ns
+    except OSError:
+        return(None)
+    return((floorImage, floorTime, (round(xy[0]), round(xy[1])), icon, iconTime, fmt))
+
+
+# -------------------------------------------------------------------
+# CMX_composite_key() - Builds the render cache key for a floor composite map.  [See:  Map_CMXfloors() in CMX-Modules.py]
+#   markers     - List of ((x,y), icon) for every client drawn on the floor.  Their order doesn't matter.
+#   Like CMX_render_key(), the modify times of the floor image and of every icon are part of the key.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_composite_key(floorImage,markers,fmt):
+    try:
+        floorTime = os.stat(floorImage).st_mtime_ns
+        iconTimes = tuple((icon, os.stat(icon).st_mtime_ns) for icon in sorted(set(m[1] for m in markers)))
+    except OSError:
+        return(None)
+    placed = tuple(sorted(((round(xy[0]), round(xy[1])), icon) for xy, icon in markers))
+    return((floorImage, floorTime, placed, iconTimes, fmt))
+
+
+# -------------------------------------------------------------------
+# CMX_RenderCache - Remembers which map file on disk already holds each rendered map.  [See:  CMX_render_key()]
+#   maxEntries  - Most render keys remembered.  The least recently used key is dropped first.
+#   When a client is mapped again and hasn't moved, its map file already holds that image, so there is nothing to do.
+#   When a different client lands on exactly the same spot, the finished file is copied instead of decoding, pasting and
+#   encoding it again.  Counters:  "hits" (nothing to do), "copies" (copied from another map), "misses" (had to render).
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_RenderCache:
+    def __init__ (self,maxEntries=1024):
+        self.maxEntries   = int(maxEntries)             # Most render keys remembered
+        self.hits         = 0                           # Map file already up to date
+        self.copies       = 0                           # Map copied from another file with the same render
+        self.misses       = 0                           # Map had to be rendered
+        self._entries     = OrderedDict()               # render key --> map file holding that render
+        self._outputs     = {}                          # map file --> render key it holds
+        self._lock        = threading.Lock()
+
+    def reuse(self,key,ofname):                         # True if "ofname" now holds this render.  False means render it.
+        if key is None:
+            return(False)
+        with self._lock:
+            if self._outputs.get(ofname) == key and os.path.isfile(ofname):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return(True)
+            source = self._entries.get(key)
+        if source is not None and source != ofname:
+            try:
+                tmpname = "{}.{}.tmp".format(ofname, threading.get_ident())
+                shutil.copyfile(source, tmpname)
+                os.replace(tmpname, ofname)
+                with self._lock:
+                    self.copies += 1
+                self.record(key, ofname)
+                return(True)
+            except OSError:                             # Source map was removed.  Forget it and render again.
+                with self._lock:
+                    if self._entries.get(key) == source:
+                        del self._entries[key]
+        with self._lock:
+            self.misses += 1
+        return(False)
+
+    def record(self,key,ofname):                        # "ofname" was just written with this render
+        if key is None:
+            return()
+        with self._lock:
+            oldKey = self._outputs.get(ofname)
+            if oldKey is not None and oldKey != key and self._entries.get(oldKey) == ofname:
+                del self._entries[oldKey]                   # That file no longer holds the old render
+            self._outputs[ofname] = key
+            self._entries[key] = ofname
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+        return()
+
+    def forget(self,ofname):                            # "ofname" was changed outside the cache
+        with self._lock:
+            key = self._outputs.pop(ofname, None)
+            if key is not None and self._entries.get(key) == ofname:
+                del self._entries[key]
+        return()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._outputs.clear()
+            self.hits = self.copies = self.misses = 0
+        return()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.copies + self.misses
+            return({"hits": self.hits, "copies": self.copies, "misses": self.misses, "entries": len(self._entries),
+                    "hitRate": (self.hits + self.copies) / total if total else 0.0})
+
+    def __str__(self):
+        s = self.stats()
+        return("Render Cache: Hits: ["+str(s["hits"])+"]\tCopies: ["+str(s["copies"])+"]\tMisses: ["+str(s["misses"])+"]\tEntries: ["+str(s["entries"])+"]")
+
+
+# -------------------------------------------------------------------
+# CMX_ImageCache - Process-wide cache of decoded floor plans and icons.
+#   maxBytes    - Memory budget for decoded images.  When it is exceeded, the least recently used image is dropped first.
+#   Decoding a floor plan JPEG is the most expensive step of drawing a map, and the same few floors and icons get drawn
+#   over and over.  get() returns the decoded image, and only decodes the file again when its modify time has changed.
+#   The image returned is shared, so callers must copy() it before drawing on it.
+#   Counters:  "hits", "misses" (never loaded), "reloads" (file changed on disk), "evictions" (dropped for the budget).
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_ImageCache:
+    BytesPerPixel = {'1': 1, 'L': 1, 'P': 1, 'LA': 2, 'I;16': 2, 'RGB': 3, 'YCbCr': 3, 'LAB': 3, 'HSV': 3, 'RGBA': 4, 'CMYK': 4, 'I': 4, 'F': 4}
+
+    def __init__ (self,maxBytes=256*1024*1024):
+        self.maxBytes     = int(maxBytes)               # Memory budget for decoded images
+        self.bytes        = 0                           # Memory used by the images held now (estimated)
+        self.hits         = 0
+        self.misses       = 0
+        self.reloads      = 0
+        self.evictions    = 0
+        self._entries     = OrderedDict()               # path --> (modify time, image, bytes)
+        self._sizes       = {}                          # path --> (modify time, (width, height))  [See:  size()]
+        self._lock        = threading.Lock()
+
+    def get(self,path):                                 # Decoded image for this file.  (Shared - copy() before changing it.)
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == mtime:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return(entry[1])
+            if entry is not None:
+                self.reloads += 1
+                self._drop(path)
+            else:
+                self.misses += 1
+        img = Image.open(path)
+        img.load()                                      # Decode now, outside the lock
+        size = img.width * img.height * self.BytesPerPixel.get(img.mode, 4)
+        with self._lock:
+            if size <= self.maxBytes:
+                if path in self._entries:               # Another thread loaded it at the same time
+                    self._drop(path)
+                self._entries[path] = (mtime, img, size)
+                self.bytes += size
+                while self.bytes > self.maxBytes:
+                    self._drop(next(iter(self._entries)))
+                    self.evictions += 1
+        return(img)
+
+    def size(self,path):                                # (width, height) of an image, without decoding it if it isn't cached
+        mtime = os.stat(path).st_mtime_ns
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == mtime:
+            return(entry[1].size)
+        known = self._sizes.get(path)
+        if known is not None and known[0] == mtime:
+            return(known[1])
+        with Image.open(path) as img:                   # Only reads the header
+            size = img.size
+        self._sizes[path] = (mtime, size)
+        return(size)
+
+    def preload(self,paths):                            # Decode a list of files up front.  Files that can't be read are skipped.
+        loaded = 0
+        for path in paths:
+            try:
+                self.get(path)
+                loaded += 1
+            except (OSError, ValueError):
+                pass
+        return(loaded)
+
+    def resize(self,maxBytes):                          # Change the memory budget, dropping images if needed
+        with self._lock:
+            self.maxBytes = int(maxBytes)
+            while self.bytes > self.maxBytes and len(self._entries) > 0:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+        return()
+
+    def invalidate(self,path=None):                     # Forget one image, or all of them
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+                self._sizes.clear()
+                self.bytes = 0
+            else:
+                self._sizes.pop(path, None)
+                if path in self._entries:
+                    self._drop(path)
+        return()
+
+    def _drop(self,path):                               # (Caller holds the lock.)
+        entry = self._entries.pop(path)
+        self.bytes -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            return({"hits": self.hits, "misses": self.misses, "reloads": self.reloads, "evictions": self.evictions,
+                    "images": len(self._entries), "bytes": self.bytes, "maxBytes": self.maxBytes})
+
+    def __str__(self):
+        s = self.stats()
+        return("Image Cache: Images: ["+str(s["images"])+"]\tBytes: ["+str(s["bytes"])+"/"+str(s["maxBytes"])+"]\tHits: ["+str(s["hits"])+"]\tMisses: ["+str(s["misses"])+"]\tReloads: ["+str(s["reloads"])+"]\tEvictions: ["+str(s["evictions"])+"]")
+
+
+# -------------------------------------------------------------------
+# CMX_LocationCache - Recent CMX answers for single MAC lookups, each kept for a limited time.  [See:  CMX_lookup()]
+#   fetch       - Routine called as fetch(mac, *args) to ask CMX.  It returns a client, or None if the call failed.  (An error
+#                 status must come back as None, not a placeholder, or an outage is remembered as unknown MACs.)
+#   ttl         - Seconds a located client is served from the cache before CMX is asked again.
+#   negativeTtl - Seconds a MAC that CMX doesn't know is remembered.  (Those come back as an "OffNet" placeholder.)
+#   maxEntries  - Most MACs remembered.  The least recently used MAC is dropped first.
+#   keyOf       - Routine that turns a MAC into the cache key.  [See:  normalize_CMX_mac()]
+#   When several threads look up the same MAC at once, only the first one calls CMX.  The others wait for its answer.
+#   A failed call (None) is handed to the waiting threads, but never cached.  The client returned is shared, so callers
+#   must not change it.  Counters:  "hits", "negativeHits" (MAC CMX doesn't know), "misses" (never seen), "stale"
+#   (expired, asked again), "coalesced" (waited for another thread's call), "errors" (fetch returned None or raised).
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_LocationCache:
+    def __init__ (self,fetch,ttl=30,negativeTtl=300,maxEntries=10000,keyOf=None):
+        self.fetch        = fetch
+        self.ttl          = ttl                         # Seconds a located client is fresh
+        self.negativeTtl  = negativeTtl                 # Seconds an unknown MAC is remembered
+        self.maxEntries   = int(maxEntries)
+        self.keyOf        = keyOf if keyOf is not None else (lambda mac: mac)
+        self.hits         = 0
+        self.negativeHits = 0
+        self.misses       = 0
+        self.stale        = 0
+        self.coalesced    = 0
+        self.errors       = 0
+        self._entries     = OrderedDict()               # key --> (expires, client)
+        self._inflight    = {}                          # key --> [Event, client] of the call being made now
+        self._lock        = threading.Lock()
+
+    def get(self,mac,*args):                            # Client for this MAC, from the cache or from CMX.  None if the call failed.
+        key = self.keyOf(mac)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    if self._negative(entry[1]):
+                        self.negativeHits += 1
+                    else:
+                        self.hits += 1
+                    return(entry[1])
+                del self._entries[key]
+            call = self._inflight.get(key)
+            leader = call is None
+            if not leader:
+                self.coalesced += 1
+            else:
+                call = self._inflight[key] = [threading.Event(), None]
+                if entry is not None:
+                    self.stale += 1
+                else:
+                    self.misses += 1
+        if not leader:
+            call[0].wait()
+            return(call[1])
+        cmxClient = None
+        try:
+            cmxClient = self.fetch(mac, *args)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+                if cmxClient is None:
+                    self.errors += 1
+                else:
+                    self._store(key, cmxClient)
+            call[1] = cmxClient
+            call[0].set()
+        return(cmxClient)
+
+    def put(self,mac,cmxClient):                        # Remember a client found some other way  (e.g. in the full client list)
+        with self._lock:
+            self._store(self.keyOf(mac), cmxClient)
+        return()
+
+    def invalidate(self,mac=None):                      # Forget one MAC, or all of them
+        with self._lock:
+            if mac is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self.keyOf(mac), None)
+        return()
+
+    def _negative(self,cmxClient):                      # A placeholder for a MAC that CMX doesn't know
+        return(getattr(cmxClient, "Loc_Status", None) == "OffNet")
+
+    def _store(self,key,cmxClient):                     # (Caller holds the lock.)
+        ttl = self.negativeTtl if self._negative(cmxClient) else self.ttl
+        self._entries[key] = (time.monotonic() + ttl, cmxClient)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxEntries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.negativeHits = self.misses = self.stale = self.coalesced = self.errors = 0
+        return()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.negativeHits + self.misses + self.stale + self.coalesced
+            return({"hits": self.hits, "negativeHits": self.negativeHits, "misses": self.misses, "stale": self.stale,
+                    "coalesced": self.coalesced, "errors": self.errors, "entries": len(self._entries),
+                    "hitRate": (self.hits + self.negativeHits + self.coalesced) / total if total else 0.0})
+
+    def __str__(self):
+        s = self.stats()
+        return("Location Cache: Hits: ["+str(s["hits"])+"]\tNegative: ["+str(s["negativeHits"])+"]\tMisses: ["+str(s["misses"])+"]\tStale: ["+str(s["stale"])+"]\tCoalesced: ["+str(s["coalesced"])+"]\tErrors: ["+str(s["errors"])+"]\tEntries: ["+str(s["entries"])+"]")
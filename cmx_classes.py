@@ -23,6 +23,122 @@ SOFTWARE.
 #   - In some cases I will add additional information to the class in order to stitch data from our various sandboxes together.
 #   - Those elements are defined by the '<<>>' comments are in addition to the data provided by the API call
 #   - Each class has a print statement for diagnostics, based on the information we use in our application
+#   - The client location classes use "__slots__" instead of a per-client "__dict__", and share one copy of values that
+#     repeat across clients (units, names ...).  [See:  CMX_shared()]  The floor metadata of a v2 client is one shared
+#     record per floor.  [See:  CMX_FloorTable]  With a full campus client list, memory per client is what counts.
+#     For even less, a client list can be stored as columns.  [See:  CMX_ClientTable]
+
+import sys, threading
+from array import array
+
+CMX_SharedValues = {}                                   # (type, value) --> the one shared copy of that value
+
+# -------------------------------------------------------------------
+# CMX_shared() - Returns one shared copy of a value that repeats across many clients.  Strings are interned, and numbers
+#   outside the small-int range are shared by value, so 50,000 clients on the same floor all point at the same "2801".
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_shared(value):
+    if type(value) is str:
+        return(sys.intern(value))
+    return(CMX_SharedValues.setdefault((type(value), value), value))
+
+# -------------------------------------------------------------------
+# CMX_FloorInfo - The "mapInfo" block of a v2 client:  floor dimensions and the floor image.  Every client on a floor sees
+#   exactly the same block, so it is stored once per floor [See:  CMX_FloorTable] and each client holds a reference to it.
+#   A CMX_FloorInfo is shared, so never change it in place.  replace() returns a changed copy.
+#   The floor dimensions are kept as floats, since real floors aren't a whole number of feet.  [See:  cmx_transform.py]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_FloorInfo:
+    __slots__ = ("height", "length", "offsetX", "offsetY", "unit", "width", "floorRefId",
+                 "imageHeight", "imageName", "maxRes", "size", "imageWidth", "zoom")
+    def __init__ (self,height,length,offsetX,offsetY,unit,width,floorRefId,imageHeight,imageName,maxRes,size,imageWidth,zoom):
+        self.height      = CMX_shared(float(height))    # Always '10'   in CMX sandbox
+        self.length      = CMX_shared(float(length))    # Always '400'  in CMX sandbox
+        self.offsetX     = CMX_shared(float(offsetX))   # Always '0'    in CMX sandbox
+        self.offsetY     = CMX_shared(float(offsetY))   # Always '4'    in CMX sandbox
+        self.unit        = CMX_shared(str(unit))        # Units: 'FEET' in CMX sandbox
+        self.width       = CMX_shared(float(width))     # Always '400'  in CMX sandbox
+        self.floorRefId  = CMX_shared(str(floorRefId))  # Actually an INT/treat as a string now - 9 floors in CMX sandbox
+        self.imageHeight = CMX_shared(int(imageHeight)) # Always '1912' in CMX sandbox
+        self.imageName   = CMX_shared(str(imageName))   # Always 'simfloor.jpg' in CMX sandbox - (can't access image via API in sandbox)
+        self.maxRes      = CMX_shared(int(maxRes))      # Always '16'   in CMX sandbox
+        self.size        = CMX_shared(int(size))        # Always '3104' in CMX sandbox
+        self.imageWidth  = CMX_shared(int(imageWidth))  # Always '2801' in CMX sandbox
+        self.zoom        = CMX_shared(int(zoom))        # Always '5'    in CMX sandbox
+
+    def values(self):                                   # All fields, in constructor order
+        return(tuple(getattr(self, f) for f in self.__slots__))
+
+    def replace(self,**changes):                        # A copy with some fields changed.  (Not added to any floor table.)
+        fields = dict(zip(self.__slots__, self.values()))
+        fields.update(changes)
+        return(CMX_FloorInfo(**fields))
+
+    def __copy__(self):                                 # Shared, so copies of a client share it too
+        return(self)
+
+    def __deepcopy__(self,memo):
+        return(self)
+
+    def __eq__(self,other):
+        return(isinstance(other, CMX_FloorInfo) and self.values() == other.values())
+
+    def __hash__(self):
+        return(hash(self.values()))
+
+    def __str__(self):
+        return("["+self.floorRefId+"\t"+self.imageName+"\t"+str(self.width)+"x"+str(self.length)+" "+self.unit+"]")
+
+# -------------------------------------------------------------------
+# CMX_FloorTable - Every floor seen so far, keyed by floorRefId.  [See:  CMX_FloorInfo]
+#   intern() is called by the client parser with the raw "mapInfo" values.  When they match the floor we already hold, that
+#   same CMX_FloorInfo is returned without building anything.  When a floor's metadata changes on CMX, a new entry replaces
+#   the old one.  (Clients parsed earlier keep the old entry until they are updated.)  All methods are thread safe.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_FloorTable:
+    def __init__ (self):
+        self._floors      = {}                          # floorRefId --> CMX_FloorInfo
+        self._raw         = {}                          # floorRefId --> raw values that CMX_FloorInfo was built from
+        self._lock        = threading.Lock()
+
+    def intern(self,*values):                           # Shared CMX_FloorInfo for these values.  (CMX_FloorInfo argument order.)
+        key = str(values[6])
+        if self._raw.get(key) == values:                # Same floor as last time.  (Most clients.)
+            return(self._floors[key])
+        floor = CMX_FloorInfo(*values)
+        with self._lock:
+            old = self._floors.get(key)
+            if old is not None and old == floor:        # Same floor, values just typed differently
+                floor = old
+            self._floors[key] = floor
+            self._raw[key]    = values
+        return(floor)
+
+    def get(self,floorRefId):                           # The floor with this floorRefId, or None
+        return(self._floors.get(str(floorRefId)))
+
+    def floors(self):                                   # Snapshot list of every floor
+        with self._lock:
+            return(list(self._floors.values()))
+
+    def clear(self):
+        with self._lock:
+            self._floors.clear()
+            self._raw.clear()
+
+    def __contains__(self,floorRefId):
+        return(str(floorRefId) in self._floors)
+
+    def __len__(self):
+        return(len(self._floors))
+
+    def __str__(self):
+        return("CMX Floor Table: Floors: ["+str(len(self._floors))+"]")
+
+CMX_Floors = CMX_FloorTable()                           # The floors shared by every client parsed in this process
 
 # -------------------------------------------------------------------
 # CMX_ClientLocation - "/api/location/v2/clients"
@@ -39,30 +155,20 @@ SOFTWARE.
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #
 class CMX_ClientLocation_v2:				# "/api/location/v2/clients"
+    __slots__ = ("Loc_IRFmac", "Loc_time", "Loc_Status", "macAddress", "manufacturer", "map_unit", "map_xcord", "map_ycord", "map_zcord",
+                 "floor", "mapHierarchy", "ipAddress", "networkStatus", "userName", "currentServerTime", "firstLocateTime", "lastLocateTime")
     def __init__ (self,a1,a2,a3,a4,a5,a6,a7,a8,a9,b1,b2,b3,b4,b5,b6,b7,b8,b9,c):
         self.Loc_IRFmac      = '00:00:00:00:00:00'      # <<>> Not part of CMX data. Used to map to IRFlow Mac address <<>>
         self.Loc_time        = "NoTime"                 # <<>> Not part of CMX data. Used to hold current time of the API call <<>>
         self.Loc_Status      = "OnNet"					# <<>> Not part of CMX data. Used to identify the status of the client [OnNet, OffNet, Quarantined] <<>>
         self.macAddress      = str(a1)                  # Sandbox MACs are somewhat sequential, but can occur multiple times in CMX sandbox
-        self.manufacturer    = str(a2)                  # Always 'Lexmark' in CMX sandbox - This maybe valuable in the "real-world"
-        self.map_unit        = str(a3)                  # Units: 'FEET' in CMX sandbox
+        self.manufacturer    = CMX_shared(str(a2))      # Always 'Lexmark' in CMX sandbox - This maybe valuable in the "real-world"
+        self.map_unit        = CMX_shared(str(a3))      # Units: 'FEET' in CMX sandbox
         self.map_xcord       = float(a4)                # Client X-coordinate
         self.map_ycord       = float(a5)                # Client Y-coordinate
         self.map_zcord       = 0                        # Always zero   Client Z-coordinate
-        self.mapinfo_height  = int(a6)                  # Always '10'   in CMX sandbox
-        self.mapinfo_length  = int(a7)                  # Always '400'  in CMX sandbox
-        self.mapinfo_offsetX = int(a8)                  # Always '0'    in CMX sandbox
-        self.mapinfo_offsetY = int(a9)                  # Always '4'    in CMX sandbox
-        self.mapinfo_unit    = str(b1)                  # Units: 'FEET' in CMX sandbox
-        self.mapinfo_width   = int(b2)                  # Always '400'  in CMX sandbox
-        self.mapinfo_floorRefId   = str(b3)             # Actually an INT/treat as a string now - 9 floors in CMX sandbox
-        self.floorimage_height    = int(b4)             # Always '1912' in CMX sandbox
-        self.floorimage_imageName = str(b5)             # Always 'simfloor.jpg' in CMX sandbox - (can't access image via API in sandbox)
-        self.floorimage_maxRes    = int(b6)             # Always '16'   in CMX sandbox
-        self.floorimage_size      = int(b7)             # Always '3104' in CMX sandbox
-        self.floorimage_width     = int(b8)             # Always '2801' in CMX sandbox
-        self.floorimage_zoom      = int(b9)             # Always '5'    in CMX sandbox
-        self.mapHierarchy         = str(c)              # 112 defined Zones in CMX sandbox
+        self.floor           = CMX_Floors.intern(a6,a7,a8,a9,b1,b2,b3,b4,b5,b6,b7,b8,b9)  # Shared floor metadata  [See:  CMX_FloorInfo]
+        self.mapHierarchy         = CMX_shared(str(c))  # 112 defined Zones in CMX sandbox
         self.ipAddress            = "0.0.0.0"           # CMX sandbox returns "null" for all data. Will deal with this on a live system later.
         self.networkStatus        = "ACTIVE"            # CMX sancbox returns "ACTIVE" for all data.
         self.userName             = "NoName"            # CMX sancbox returns "" for all data.
@@ -72,31 +178,169 @@ class CMX_ClientLocation_v2:				# "/api/location/v2/clients"
     def __str__(self):
         return("["+self.Loc_IRFmac+"] ["+self.macAddress+"\t"+self.ipAddress+"\t"+self.manufacturer+"\t"+self.mapinfo_floorRefId+"\t"+str(self.map_xcord)+"\t"+str(self.map_ycord)+"\t"+self.mapHierarchy+"]")
 
+# The original per-client floor fields still work.  They read through to the shared floor, and setting one gives this
+# client its own changed copy of the floor, leaving every other client alone.
+CMX_FloorFields = (("mapinfo_height", "height"), ("mapinfo_length", "length"), ("mapinfo_offsetX", "offsetX"), ("mapinfo_offsetY", "offsetY"),
+                   ("mapinfo_unit", "unit"), ("mapinfo_width", "width"), ("mapinfo_floorRefId", "floorRefId"), ("floorimage_height", "imageHeight"),
+                   ("floorimage_imageName", "imageName"), ("floorimage_maxRes", "maxRes"), ("floorimage_size", "size"),
+                   ("floorimage_width", "imageWidth"), ("floorimage_zoom", "zoom"))
+
+def _floor_field(name):
+    def get(self):
+        return(getattr(self.floor, name))
+    def put(self,value):
+        self.floor = self.floor.replace(**{name: value})
+    return(property(get, put))
+
+for _clientField, _floorField in CMX_FloorFields:
+    setattr(CMX_ClientLocation_v2, _clientField, _floor_field(_floorField))
+
+# -------------------------------------------------------------------
+# CMX_ClientTable - A column-store version of a list of CMX_ClientLocation_v2 clients.  (Optional - for very large lists.)
+#   Coordinates are kept in typed arrays, and every value that repeats (floors, manufacturer, units, hierarchy, times) is
+#   stored once in a lookup table with a small integer index per client.  A client costs a few dozen bytes
+#   instead of a full object.
+#   The table still reads like a list of clients:  len(table), table[i], "for client in table" and find(mac) all give back
+#   ordinary CMX_ClientLocation_v2 objects, built on demand.  Coordinates can be read directly as columns:
+#   table.map_xcord[i], table.map_ycord[i].  Only the fields below are kept, the rest come back with their defaults.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_ClientTable:
+    def __init__ (self,clients=()):
+        self.macAddress      = []                       # Client MACs
+        self.map_xcord       = array('d')               # Client X-coordinates
+        self.map_ycord       = array('d')               # Client Y-coordinates
+        self._floor          = array('I')               # Index into _floors
+        self._manufacturer   = array('I')               # Index into _strings  (same for the columns below)
+        self._unit           = array('I')
+        self._hierarchy      = array('I')
+        self._status         = array('I')
+        self._time           = array('I')
+        self._lastLocate     = array('I')
+        self._floors         = []                       # Unique floors  [CMX_FloorInfo]
+        self._floorIds       = {}
+        self._strings        = []                       # Unique strings
+        self._stringIds      = {}
+        self._rows           = None                     # mac --> row, built on the first find()
+        self.extend(clients)
+
+    def _string(self,s):
+        i = self._stringIds.get(s)
+        if i is None:
+            i = self._stringIds[s] = len(self._strings)
+            self._strings.append(s)
+        return(i)
+
+    def append(self,cmxClient):
+        c = cmxClient
+        f = self._floorIds.get(c.floor)
+        if f is None:
+            f = self._floorIds[c.floor] = len(self._floors)
+            self._floors.append(c.floor)
+        if self._rows is not None:
+            self._rows.setdefault(c.macAddress, len(self.macAddress))
+        self.macAddress.append(c.macAddress)
+        self.map_xcord.append(c.map_xcord)
+        self.map_ycord.append(c.map_ycord)
+        self._floor.append(f)
+        self._manufacturer.append(self._string(c.manufacturer))
+        self._unit.append(self._string(c.map_unit))
+        self._hierarchy.append(self._string(c.mapHierarchy))
+        self._status.append(self._string(c.Loc_Status))
+        self._time.append(self._string(c.Loc_time))
+        self._lastLocate.append(self._string(c.lastLocateTime))
+
+    def extend(self,clients):
+        for cmxClient in clients:
+            self.append(cmxClient)
+
+    def row(self,i):                                    # Rebuild client "i" as a CMX_ClientLocation_v2
+        S = self._strings
+        floor = self._floors[self._floor[i]]
+        client = CMX_ClientLocation_v2(self.macAddress[i], S[self._manufacturer[i]], S[self._unit[i]], self.map_xcord[i], self.map_ycord[i],
+                                       *floor.values(), S[self._hierarchy[i]])
+        client.floor          = floor
+        client.Loc_Status     = S[self._status[i]]
+        client.Loc_time       = S[self._time[i]]
+        client.lastLocateTime = S[self._lastLocate[i]]
+        return(client)
+
+    def find(self,mac):                                 # First client with this MAC, or None
+        if self._rows is None:
+            self._rows = {}
+            for i, m in enumerate(self.macAddress):
+                self._rows.setdefault(m, i)
+        i = self._rows.get(mac)
+        if i is None:
+            return(None)
+        return(self.row(i))
+
+    def __len__(self):
+        return(len(self.macAddress))
+
+    def __getitem__(self,i):
+        if isinstance(i, slice):
+            return([self.row(j) for j in range(*i.indices(len(self)))])
+        if i < 0:
+            i += len(self)
+        return(self.row(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.row(i)
+
+    def __str__(self):
+        return("CMX Client Table: Clients: ["+str(len(self))+"]\tFloors: ["+str(len(self._floors))+"]\tStrings: ["+str(len(self._strings))+"]")
+
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #
 class CMX_ClientLocation_v3:			    # "/api/location/v3/clients"
-    def __init__ (self,a1,a2,a3,a4,a5,a6,a7,a8,a9,b1,b2,b3,b4,b5,b6):
+    __slots__ = ("Loc_IRFmac", "Loc_time", "Loc_Status", "locationMapHierarchy", "locationCoordinateX", "locationCoordinateY", "locationCoordinateZ",
+                 "locationUnit", "geoCoordLat", "geoCoordLong", "geoCoordUnit", "confidenceFactor", "userName", "ipAddress", "floorRefId", "deviceId",
+                 "lastSeen", "manufacturer", "timestamp", "notificationTime")
+    def __init__ (self,a1,a2,a3,a4,a5,a6,a7,a8,a9,b1,b2,b3,b4,b5,b6,b7=None,b8=None):
+        self.Loc_IRFmac           = '00:00:00:00:00:00' # <<>> Not part of CMX data. Used to map to IRFlow Mac address <<>>
+        self.Loc_time             = "NoTime"            # <<>> Not part of CMX data. Used to hold current time of the API call <<>>
         self.Loc_Status           = "OnNet"				# <<>> Not part of CMX data. Used to identify the status of the client [OnNet, OffNet, Quarantined] <<>>
-        self.locationMapHierarchy = str(a1)             # Location Map Hierarchy
-        self.locationCoordinateX  = str(a2)             # client Location X-Coordinate
-        self.locationCoordinateY  = str(a3)             # client Location Y-Coordinate
-        self.locationCoordinateZ  = str(a4)             # client Location Z-Coordinate
-        self.locationUnit         = str(a5)             # client Location Units
+        self.locationMapHierarchy = CMX_shared(str(a1)) # Location Map Hierarchy
+        self.locationCoordinateX  = float(a2)           # client Location X-Coordinate
+        self.locationCoordinateY  = float(a3)           # client Location Y-Coordinate
+        self.locationCoordinateZ  = float(a4)           # client Location Z-Coordinate
+        self.locationUnit         = CMX_shared(str(a5)) # client Location Units
         self.geoCoordLat          = float(a6)           # Geocoordinate - Latitued
         self.geoCoordLong         = float(a7)           # Geocoordinate - Longitude
-        self.geoCoordUnit         = str(a8)             # Geocoordinate - Unit
+        self.geoCoordUnit         = CMX_shared(str(a8)) # Geocoordinate - Unit
         self.confidenceFactor     = int(a9)             #
-        self.userName             = "NoName"            # CMX sancbox returns "" for all data.
-        self.ipAddress            = []                  # v3 Sandbox returns a list of addresses.
-        self.floorRefId           = int(b1)             #
+        self.userName             = str(b8) if b8 else "NoName"  # CMX sancbox returns "" for all data.
+        self.ipAddress            = list(b7) if isinstance(b7, list) else ([str(b7)] if b7 else [])  # v3 Sandbox returns a list of addresses.
+        self.floorRefId           = CMX_shared(str(b1)) # Actually an INT/treat as a string, like v2
         self.deviceId             = str(b2)             # Same as macAddress in v2 (I think) 
         self.lastSeen             = str(b3)             # Something like "2019-02-22T12:44:15.646+0000" 
-        self.manufacturer         = str(b4)             # Always
+        self.manufacturer         = CMX_shared(str(b4)) # Always
         self.timestamp            = int(b5)             # maybe current time?
         self.notificationTime     = int(b6)             # Not sure what time this is.  Close to timestamp.
         
+    @property
+    def floor(self):                                    # Floor metadata, if a v2 lookup or the maps API has told us about this floor
+        return(CMX_Floors.get(self.floorRefId))
+
     def __str__(self):
-        return("["+self.deviceId+"\t"+self.ipAddress+"\t"+self.manufacturer+"]")
+        return("["+self.Loc_IRFmac+"] ["+self.deviceId+"\t"+", ".join(self.ipAddress)+"\t"+self.manufacturer+"\t"+self.floorRefId+"\t"+str(self.locationCoordinateX)+"\t"+str(self.locationCoordinateY)+"\t"+self.locationMapHierarchy+"]")
+
+# The v2 names of the v3 fields, so code written against v2 clients (maps, registry, Validate()) works on either.
+CMX_v3Aliases = (("macAddress", "deviceId"), ("map_xcord", "locationCoordinateX"), ("map_ycord", "locationCoordinateY"),
+                 ("map_zcord", "locationCoordinateZ"), ("map_unit", "locationUnit"), ("mapHierarchy", "locationMapHierarchy"),
+                 ("mapinfo_floorRefId", "floorRefId"), ("lastLocateTime", "lastSeen"))
+
+def _alias_field(name):
+    def get(self):
+        return(getattr(self, name))
+    def put(self,value):
+        setattr(self, name, value)
+    return(property(get, put))
+
+for _v2Field, _v3Field in CMX_v3Aliases:
+    setattr(CMX_ClientLocation_v3, _v2Field, _alias_field(_v3Field))
         
         
 # -------------------------------------------------------------------
@@ -157,6 +401,8 @@ class CMX_version:                                      # "/api/config/v1/versio
 #       The "campusCounts" field is a list of Class:  CampusCounts.
 #           The "buildingCounts" field is a list of Class: BuildingCounts.
 #               The "floorCounts" field is a list of Class:  FloorCounts. 
+#   Walking that tree to find one floor is slow on a large deployment, so index() also files every campus, building and
+#   floor by name in flat dictionaries.  find() maps a client's "mapHierarchy" straight to its floor.
 # - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
 #
 class CMX_MapsCount:                                    # "/api/config/v1/maps/count"
@@ -166,6 +412,34 @@ class CMX_MapsCount:                                    # "/api/config/v1/maps/c
         self.totalFloors     	= int(tf)               # Total Floors
         self.totalAps        	= int(ta)               # Total AP's
         self.campusCounts       = []                    # List of Campuses which in turn has lists of Buildings & lists of Floors
+        self.campuses           = {}                    # <<>> campusName --> CampusCounts  [See:  index()]
+        self.buildings          = {}                    # <<>> (campusName, buildingName) --> BuildingCounts
+        self.floors             = {}                    # <<>> (campusName, buildingName, floorName) --> FloorCounts
+        self._byHierarchy       = {}                    # <<>> mapHierarchy string --> FloorCounts (or None), as found
+    def index(self):                                    # (Re)build the flat dictionaries from the campusCounts tree
+        self.campuses, self.buildings, self.floors, self._byHierarchy = {}, {}, {}, {}
+        for camp in self.campusCounts:
+            self.campuses[camp.campusName] = camp
+            for bldg in camp.buildingCounts:
+                self.buildings[(camp.campusName, bldg.buildingName)] = bldg
+                for floor in bldg.floorCounts:
+                    self.floors[(camp.campusName, bldg.buildingName, floor.floorName)] = floor
+        return(self)
+    def campus(self,campusName):
+        return(self.campuses.get(campusName))
+    def building(self,campusName,buildingName):
+        return(self.buildings.get((campusName, buildingName)))
+    def floor(self,campusName,buildingName,floorName):
+        return(self.floors.get((campusName, buildingName, floorName)))
+    def find(self,hierarchy):                           # FloorCounts of a "Campus>Building>Floor>Zone" string, or None
+        try:
+            return(self._byHierarchy[hierarchy])
+        except KeyError:
+            pass
+        names = str(hierarchy).split(">")
+        floor = self.floors.get(tuple(names[:3])) if len(names) >= 3 else None
+        self._byHierarchy[hierarchy] = floor            # Clients on a floor share a handful of hierarchy strings
+        return(floor)
     def __str__(self):
         return("Total Campuses: "+str(self.totalCampuses)+"\tTotal Buildings: "+str(self.totalBuildings)+"\tTotal Floors: "+str(self.totalFloors)+"\t\tTotal AP's: "+str(self.totalAps))
 
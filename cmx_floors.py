@@ -0,0 +1,161 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_floors() - defines the floor resolver used for v3 clients.
+#   - A v2 client record carries its whole floor ("mapInfo"), but a v3 client record only carries its floorRefId.  Finding
+#     the floor image and dimensions takes the map API calls, and making those on every lookup would double its latency.
+#   - The CMX_FloorResolver loads every floor from "/api/config/v1/maps" once, in the background, and files them in the
+#     shared floor table [CMX_Floors].  A lookup on a known floor costs no extra request at all.
+#   - A floor that isn't in the table yet is fetched on its own ("/api/config/v1/maps/info/:campus/:building/:floor", one
+#     request) using the client's map hierarchy.  A floor CMX doesn't know is remembered for a while, so it isn't asked
+#     for again on every lookup.
+#   - The floor list is refreshed in the background once it is older than "maxAge".  Lookups never wait for a refresh.
+
+import threading, time
+from cmx_classes import CMX_Floors
+
+# -------------------------------------------------------------------
+# CMX_floor_values() - Turns one floor of the maps API into the CMX_FloorInfo values.  (CMX_FloorTable.intern() order.)
+#   The floor's "aesUid" is the floorRefId that the client records point to.  Returns None if a field is missing.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_floor_values(floorJson):
+    try:
+        dim = floorJson["dimension"]
+        img = floorJson["image"]
+        return((dim["height"], dim["length"], dim["offsetX"], dim["offsetY"], dim["unit"], dim["width"], floorJson["aesUid"],
+                img["height"], img["imageName"], img.get("maxResolution", 0), img.get("size", 0), img["width"], img.get("zoomLevel", 0)))
+    except (KeyError, TypeError):
+        return(None)
+
+
+# -------------------------------------------------------------------
+# CMX_FloorResolver - floorRefId --> floor image and dimensions, for clients that don't carry their own floor.
+#   fetchAll    - Called as fetchAll() to get the decoded "/api/config/v1/maps" response, or None if the call failed.
+#   fetchFloor  - Called as fetchFloor(campus, building, floor) to get one decoded floor, or None.  (Optional.)
+#   floors      - The floor table to fill.  (Default is the shared CMX_Floors.)
+#   maxAge      - Seconds before the floor list is refreshed in the background.
+#   retryAfter  - Seconds before a failed refresh, or a floor CMX didn't know, is tried again.
+#   Counters:  "hits" (floor known), "misses" (not known), "fetches" (single floor calls), "refreshes" and "failures".
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_FloorResolver:
+    def __init__ (self,fetchAll,fetchFloor=None,floors=None,maxAge=3600,retryAfter=60):
+        self.fetchAll     = fetchAll
+        self.fetchFloor   = fetchFloor
+        self.floors       = floors if floors is not None else CMX_Floors
+        self.maxAge       = maxAge
+        self.retryAfter   = retryAfter
+        self.names        = {}                          # floorRefId --> "Campus>Building>Floor"
+        self.loaded       = None                        # time.monotonic() of the last good refresh
+        self.hits         = 0
+        self.misses       = 0
+        self.fetches      = 0
+        self.refreshes    = 0
+        self.failures     = 0
+        self._attempted   = None                        # time.monotonic() of the last refresh attempt
+        self._missing     = {}                          # floorRefId --> time.monotonic() we last failed to find it
+        self._thread      = None                        # Background refresh in flight
+        self._lock        = threading.Lock()
+
+    def resolve(self,floorRefId,hierarchy=None):        # The CMX_FloorInfo for this floor, or None if it isn't known (yet)
+        key = str(floorRefId)
+        floor = self.floors.get(key)
+        if floor is not None:
+            self.hits += 1
+            if self.stale():
+                self.refresh_async()
+            return(floor)
+        self.misses += 1
+        now = time.monotonic()
+        with self._lock:
+            lastMissed = self._missing.get(key)
+        if lastMissed is not None and now - lastMissed < self.retryAfter:
+            return(None)
+        if hierarchy and self.fetchFloor is not None:
+            floor = self._fetch_one(key, hierarchy)
+            if floor is not None:
+                return(floor)
+        with self._lock:
+            self._missing[key] = now
+        if self.loaded is None or self.stale():
+            self.refresh_async()
+        return(None)
+
+    def stale(self):                                    # True if the floor list should be refreshed
+        now = time.monotonic()
+        if self._attempted is not None and now - self._attempted < self.retryAfter:
+            return(False)
+        return(self.loaded is None or now - self.loaded > self.maxAge)
+
+    def refresh(self):                                  # Load every floor now.  Returns the number of floors, or None on failure.
+        self._attempted = time.monotonic()
+        data = self.fetchAll()
+        if not isinstance(data, dict):
+            self.failures += 1
+            return(None)
+        count = 0
+        for campus in data.get("campuses") or []:
+            for building in campus.get("buildingList") or []:
+                for floorJson in building.get("floorList") or []:
+                    values = CMX_floor_values(floorJson)
+                    if values is None:
+                        continue
+                    floor = self.floors.intern(*values)
+                    with self._lock:
+                        self.names[floor.floorRefId] = "{}>{}>{}".format(campus.get("name"), building.get("name"), floorJson.get("name"))
+                        self._missing.pop(floor.floorRefId, None)
+                    count += 1
+        self.loaded = time.monotonic()
+        self.refreshes += 1
+        return(count)
+
+    def refresh_async(self):                            # Start a background refresh, unless one is already running
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return(self._thread)
+            self._attempted = time.monotonic()
+            self._thread = threading.Thread(target=self.refresh, name="CMX-floor-refresh", daemon=True)
+            self._thread.start()
+            return(self._thread)
+
+    def wait(self,timeout=None):                        # Wait for a background refresh to finish
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _fetch_one(self,key,hierarchy):                 # Fetch one floor by its "Campus>Building>Floor>..." hierarchy
+        names = str(hierarchy).split(">")
+        if len(names) < 3:
+            return(None)
+        self.fetches += 1
+        values = CMX_floor_values(self.fetchFloor(names[0], names[1], names[2]))
+        if values is None or str(values[6]) != key:
+            return(None)
+        floor = self.floors.intern(*values)
+        with self._lock:
+            self.names[key] = ">".join(names[:3])
+        return(floor)
+
+    def stats(self):
+        return({"hits": self.hits, "misses": self.misses, "fetches": self.fetches, "refreshes": self.refreshes,
+                "failures": self.failures, "floors": len(self.floors), "loaded": self.loaded})
+
+    def __str__(self):
+        return("Floor Resolver: Floors: ["+str(len(self.floors))+"]\tHits: ["+str(self.hits)+"]\tMisses: ["+str(self.misses)+"]\tFetches: ["+str(self.fetches)+"]\tRefreshes: ["+str(self.refreshes)+"]")
@@ -0,0 +1,196 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_history() - defines the location history of the tracked clients.
+#   - update_v2CMXclient() overwrites a client's location in place, so the trail of where a device has been was lost.
+#     The history keeps that trail, one track per MAC.
+#   - A track is four numeric arrays (time, floor, x, y), about 20 bytes per point, instead of a list of objects.  The
+#     floorRefId strings are kept once, and the track holds their index.
+#   - Points are kept in time order, so a time range is found with two bisect() calls.
+#   - Retention is bounded:  points older than "maxAge" and beyond "maxPoints" per MAC are dropped.  A client that
+#     hasn't moved only adds a point every "minInterval" seconds.  Queries can thin a track out further.  [See:  range()]
+
+import math, threading, time
+from array import array
+from bisect import bisect_left, bisect_right
+from cmx_registry import normalize_CMX_mac
+
+# -------------------------------------------------------------------
+# CMX_client_time() - Time a client was located, in seconds since the epoch.  v3 clients carry a "timestamp" in
+#   milliseconds.  v2 clients don't carry a live one, so the time now is used.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_client_time(cmxClient):
+    stamp = getattr(cmxClient, "timestamp", 0)
+    if isinstance(stamp, (int, float)) and stamp > 0:
+        return(stamp / 1000.0)
+    return(time.time())
+
+
+# -------------------------------------------------------------------
+# CMX_Track - The history of one MAC:  parallel arrays of time, floor index, x and y.  [See:  CMX_LocationHistory]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_Track:
+    __slots__ = ("times", "floors", "xs", "ys", "unit")
+
+    def __init__ (self,unit):
+        self.times        = array('d')                  # Seconds since the epoch, ascending
+        self.floors       = array('I')                  # Index into CMX_LocationHistory._floorIds
+        self.xs           = array('f')                  # Floor units
+        self.ys           = array('f')
+        self.unit         = unit                        # Unit of xs & ys  (map_unit of the client)
+
+    def insert(self,t,floor,x,y):
+        if len(self.times) == 0 or t >= self.times[-1]:
+            i = len(self.times)
+        else:                                           # Arrived late.  Keep the time order.
+            i = bisect_right(self.times, t)
+        self.times.insert(i, t)
+        self.floors.insert(i, floor)
+        self.xs.insert(i, x)
+        self.ys.insert(i, y)
+
+    def drop(self,n):                                   # Drop the "n" oldest points
+        if n > 0:
+            del self.times[:n]
+            del self.floors[:n]
+            del self.xs[:n]
+            del self.ys[:n]
+
+    def __len__(self):
+        return(len(self.times))
+
+
+# -------------------------------------------------------------------
+# CMX_LocationHistory - A track of time-stamped locations for each MAC.
+#   maxPoints   - Most points kept per MAC.  The oldest are dropped first.
+#   maxAge      - Seconds a point is kept.  A MAC with no point left is forgotten.  [See:  expire()]
+#   minInterval - A client on the same floor that moved no more than "minDistance" floor units only gets a new point
+#   minDistance   once "minInterval" seconds have passed since its last one.
+#   All methods are thread safe.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_LocationHistory:
+    def __init__ (self,maxPoints=10000,maxAge=7*24*3600,minInterval=300,minDistance=1.0):
+        self.maxPoints    = int(maxPoints)
+        self.maxAge       = maxAge
+        self.minInterval  = minInterval
+        self.minDistance  = minDistance
+        self.recorded     = 0                           # Points added
+        self.skipped      = 0                           # Points not added  (client hadn't moved)
+        self._tracks      = {}                          # mac --> CMX_Track
+        self._floorIds    = []                          # floor index --> floorRefId
+        self._floorIndex  = {}                          # floorRefId --> floor index
+        self._lock        = threading.Lock()
+
+    def record(self,mac,floorRefId,x,y,t=None,unit="FEET"):  # Add one location.  Returns False if it was skipped.
+        mac = normalize_CMX_mac(mac)
+        t   = time.time() if t is None else float(t)
+        with self._lock:
+            floor = self._floorIndex.get(floorRefId)
+            if floor is None:
+                floor = self._floorIndex[floorRefId] = len(self._floorIds)
+                self._floorIds.append(floorRefId)
+            track = self._tracks.get(mac)
+            if track is None:
+                track = self._tracks[mac] = CMX_Track(unit)
+            elif len(track) > 0 and t >= track.times[-1] and track.floors[-1] == floor and \
+                 t - track.times[-1] < self.minInterval and math.hypot(x - track.xs[-1], y - track.ys[-1]) <= self.minDistance:
+                self.skipped += 1
+                return(False)
+            track.unit = unit
+            track.insert(t, floor, x, y)
+            self.recorded += 1
+            self._trim(track, t)
+        if self.recorded % 1000 == 0:                   # Now and then, forget the MACs that stopped being recorded
+            self.expire()
+        return(True)
+
+    def record_client(self,mac,cmxClient,floorRefId):   # Add the current location of a client
+        return(self.record(mac, floorRefId, cmxClient.map_xcord, cmxClient.map_ycord, CMX_client_time(cmxClient), cmxClient.map_unit))
+
+    def range(self,mac,start=None,end=None,step=None):  # [(time, floorRefId, x, y), ...] from "start" to "end" (inclusive)
+        with self._lock:                                #   step - At most one point per "step" seconds  (and every floor change)
+            track = self._tracks.get(normalize_CMX_mac(mac))
+            if track is None:
+                return([])
+            lo = 0 if start is None else bisect_left(track.times, start)
+            hi = len(track) if end is None else bisect_right(track.times, end)
+            Points = []
+            nextTime  = None
+            lastFloor = None
+            for i in range(lo, hi):
+                t, floor = track.times[i], track.floors[i]
+                if step is not None and floor == lastFloor and t < nextTime:
+                    continue
+                Points.append((t, self._floorIds[floor], track.xs[i], track.ys[i]))
+                lastFloor = floor
+                nextTime  = t + step if step is not None else None
+            return(Points)
+
+    def unit(self,mac):                                 # Unit of a MAC's points, or None
+        track = self._tracks.get(normalize_CMX_mac(mac))
+        return(track.unit if track is not None else None)
+
+    def last(self,mac):                                 # Most recent (time, floorRefId, x, y), or None
+        with self._lock:
+            track = self._tracks.get(normalize_CMX_mac(mac))
+            if track is None or len(track) == 0:
+                return(None)
+            return((track.times[-1], self._floorIds[track.floors[-1]], track.xs[-1], track.ys[-1]))
+
+    def expire(self,now=None):                          # Apply "maxAge" to every track.  Returns the number of MACs forgotten.
+        now = time.time() if now is None else now
+        with self._lock:
+            for track in self._tracks.values():
+                self._trim(track, now)
+            Empty = [mac for mac, track in self._tracks.items() if len(track) == 0]
+            for mac in Empty:
+                del self._tracks[mac]
+            return(len(Empty))
+
+    def forget(self,mac):
+        with self._lock:
+            return(self._tracks.pop(normalize_CMX_mac(mac), None) is not None)
+
+    def _trim(self,track,now):                          # (Caller holds the lock.)
+        drop = bisect_left(track.times, now - self.maxAge) if self.maxAge is not None else 0
+        drop = max(drop, len(track) - self.maxPoints)
+        track.drop(drop)
+
+    def macs(self):
+        with self._lock:
+            return(list(self._tracks))
+
+    def __contains__(self,mac):
+        return(normalize_CMX_mac(mac) in self._tracks)
+
+    def __len__(self):
+        return(len(self._tracks))
+
+    def stats(self):
+        with self._lock:
+            points = sum(len(track) for track in self._tracks.values())
+            return({"macs": len(self._tracks), "points": points, "recorded": self.recorded, "skipped": self.skipped,
+                    "floors": len(self._floorIds)})
+
+    def __str__(self):
+        s = self.stats()
+        return("Location History: MACs: ["+str(s["macs"])+"]\tPoints: ["+str(s["points"])+"]\tRecorded: ["+str(s["recorded"])+"]\tSkipped: ["+str(s["skipped"])+"]")
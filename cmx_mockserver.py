@@ -0,0 +1,225 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+# cmx_mockserver() - a stand-in CMX server for offline tests and benchmarks.
+#   - The public sandboxes come and go, and some days return no clients at all, so nothing measured against them can be
+#     repeated.  This server answers the CMX API calls these modules make from a synthetic data set [See:  cmx_synthetic.py]
+#     of any size, with a set latency, so every run sees the same data and the same delays.
+#   - CMX_MockCMX holds the data and answers the calls.  It can be served over HTTP by CMX_MockServer, or called straight
+#     from this process through CMX_LocalTransport [See:  cmx_session.py] to leave the network out of a measurement.
+#   - Run it directly to serve it on a port:  "python cmx_mockserver.py --clients 5000 --latency 0.02 --port 8080"
+#     and point CMX-Modules.py at it with:  CMX["host"] = "127.0.0.1:8080"  and  CMXscheme = "http"
+
+import argparse, json, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from cmx_synthetic import CMX_SyntheticFloorBase, make_CMX_v2_payload, make_CMX_v3_payload
+
+CMX_MockVersions = {"v2": "CMX_CMX-10.3.0-62", "v3": "CMX_CMX-10.5.0-206"}   # "cmx_image_version" that get_CMX_version() reads as each API
+CMX_MockCampus   = "DevNetCampus"                       # Names in the synthetic map hierarchies
+CMX_MockBuilding = "DevNetBuilding"
+
+# -------------------------------------------------------------------
+# CMX_MockCMX - The data and API of a stand-in CMX.
+#   clients     - Number of synthetic clients.
+#   api         - "v2" (CMX 10.3) or "v3" (CMX 10.4+).  Sets the version reported and the shape of the client records.
+#   floors      - Number of floors the clients are spread over.
+#   latency     - Seconds each call takes before it answers, plus up to "jitter" seconds more at random.
+#   paging      - Answer "?page=&pageSize=" with one page.  With False the whole list is returned, as older servers do.
+#   credentials - "Authorization" header every call must carry, or None to accept any call.
+#   Serves:  /api/config/v1/version/image, /api/config/v1/maps/count, /api/config/v1/maps, /api/config/v1/maps/info/...,
+#            /api/location/<api>/clients (whole, paged or "?macAddress=") and /api/location/<api>/clients/count.
+#   Counters:  "requests" and "notFound" (a path it doesn't serve, or a MAC it doesn't know).
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_MockCMX:
+    def __init__ (self,clients=1000,api="v2",floors=9,latency=0.0,jitter=0.0,seed=0,paging=True,credentials=None):
+        if api not in CMX_MockVersions:
+            raise ValueError("Unknown CMX API: "+str(api))
+        self.api          = api
+        self.floors       = int(floors)
+        self.latency      = float(latency)
+        self.jitter       = float(jitter)
+        self.paging       = paging
+        self.credentials  = credentials
+        self.macField     = "deviceId" if api == "v3" else "macAddress"
+        self.records      = (make_CMX_v3_payload if api == "v3" else make_CMX_v2_payload)(int(clients), self.floors, seed)
+        self.requests     = 0
+        self.notFound     = 0
+        self._byMac       = {r[self.macField]: r for r in self.records}
+        self._all         = None                        # Encoded full client list, built on the first call
+        self._rng         = random.Random(seed)
+        self._lock        = threading.Lock()
+
+    def handle(self,path,headers=None):                 # Answers one GET.  Returns (status, reason, body bytes).
+        with self._lock:
+            self.requests += 1
+            delay = self.latency + (self._rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+        if self.credentials is not None and (headers or {}).get("Authorization") != self.credentials:
+            return(401, "Unauthorized", b'{"error":"Unauthorized"}')
+        parts = urlsplit(path)
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+        route = parts.path.rstrip("/")
+        if route == "/api/config/v1/version/image":
+            return(self._json({"cmx_image_version": CMX_MockVersions[self.api],
+                               "cmx_rpm_versions": ["cmx-connect-10.0.0", "cmx-wips-10.0.0", "cmx-10.0.0"]}))
+        if route == "/api/config/v1/maps/count":
+            return(self._json(self.maps_count()))
+        if route == "/api/config/v1/maps":
+            return(self._json({"campuses": [{"name": CMX_MockCampus, "buildingList": [{"name": CMX_MockBuilding,
+                               "floorList": [self.floor(f) for f in range(self.floors)]}]}]}))
+        if route.startswith("/api/config/v1/maps/info/"):
+            names = [unquote(n) for n in route[len("/api/config/v1/maps/info/"):].split("/")]
+            for f in range(self.floors):
+                if names == [CMX_MockCampus, CMX_MockBuilding, "DevNetZone{}".format(f)]:
+                    return(self._json(self.floor(f)))
+        elif route == "/api/location/" + self.api + "/clients/count":
+            n = len(self.records)
+            if self.api == "v3":
+                return(self._json({"totalCount": n, "associatedCount": n - n // 4, "probingCount": n // 4}))
+            return(self._json({"deviceQueryString": None, "deviceType": "CLIENT", "count": n}))
+        elif route == "/api/location/" + self.api + "/clients":
+            return(self.clients(query))
+        with self._lock:
+            self.notFound += 1
+        return(404, "Not Found", b'{"error":"Not Found"}')
+
+    def clients(self,query):                            # The client list, one page of it, or one client
+        if "macAddress" in query:
+            record = self._byMac.get(query["macAddress"].strip().lower())
+            if record is None:
+                with self._lock:
+                    self.notFound += 1
+                return(204, "No Content", b"")
+            return(self._json([record]))
+        if self.paging and "page" in query:
+            size  = max(1, int(query.get("pageSize", 1000)))
+            start = (max(1, int(query["page"])) - 1) * size
+            return(self._json(self.records[start:start + size]))
+        with self._lock:
+            if self._all is None:
+                self._all = json.dumps(self.records).encode()
+            return(200, "OK", self._all)
+
+    def move(self,fraction=0.1,step=5.0):               # Moves a share of the clients up to "step" feet, as a real floor would.  Returns how many.
+        coord = "locationCoordinate" if self.api == "v3" else "mapCoordinate"
+        with self._lock:
+            moved = self._rng.sample(self.records, int(len(self.records) * fraction))
+            for r in moved:
+                xy = r[coord]
+                xy["x"] = round(min(max(xy["x"] + self._rng.uniform(-step, step), 0), 400), 6)
+                xy["y"] = round(min(max(xy["y"] + self._rng.uniform(-step, step), 0), 400), 6)
+            self._all = None
+        return(len(moved))
+
+    def maps_count(self):
+        return({"totalCampuses": 1, "totalBuildings": 1, "totalFloors": self.floors, "totalAps": self.floors * 4,
+                "campusCounts": [{"campusName": CMX_MockCampus, "totalBuildings": 1,
+                                  "buildingCounts": [{"buildingName": CMX_MockBuilding, "totalFloors": self.floors,
+                                                      "floorCounts": [{"floorName": "DevNetZone{}".format(f), "apCount": 4}
+                                                                      for f in range(self.floors)]}]}]})
+
+    def floor(self,f):                                  # One floor of "/api/config/v1/maps".  (The floor of the synthetic records.)
+        return({"name": "DevNetZone{}".format(f), "aesUid": CMX_SyntheticFloorBase + f,
+                "dimension": {"length": 400, "width": 400, "height": 10, "offsetX": 0, "offsetY": 4, "unit": "FEET"},
+                "image": {"imageName": "simfloor.jpg", "zoomLevel": 5, "width": 2801, "height": 1912, "size": 3104,
+                          "maxResolution": 16, "colorDepth": 8}})
+
+    def _json(self,data):
+        return(200, "OK", json.dumps(data).encode())
+
+    def stats(self):
+        return({"api": self.api, "clients": len(self.records), "floors": self.floors, "latency": self.latency,
+                "requests": self.requests, "notFound": self.notFound})
+
+    def __str__(self):
+        s = self.stats()
+        return("Mock CMX: API: ["+s["api"]+"]\tClients: ["+str(s["clients"])+"]\tFloors: ["+str(s["floors"])+"]\tLatency: ["+str(s["latency"])+"]\tRequests: ["+str(s["requests"])+"]\tNot Found: ["+str(s["notFound"])+"]")
+
+
+# -------------------------------------------------------------------
+# CMX_MockServer - Serves a CMX_MockCMX over plain HTTP, one thread per connection, with keep-alive.
+#   port 0 picks a free port.  "address" is the "host:port" to put in CMX["host"].
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"                       # Keep-alive, so the pooled session is measured as it runs against CMX
+    disable_nagle_algorithm = True                      # Headers and body go out as two writes.  Don't let the body wait on a delayed ACK.
+
+    def do_GET(self):
+        status, reason, body = self.server.cmx.handle(self.path, self.headers)
+        self.send_response(status, reason)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self,format,*args):                 # Quiet.  A benchmark makes thousands of calls.
+        return
+
+class CMX_MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__ (self,cmx,host="127.0.0.1",port=0):
+        super().__init__((host, port), CMX_MockHandler)
+        self.cmx          = cmx
+        self._thread      = None
+
+    @property
+    def address(self):
+        return("{}:{}".format(self.server_address[0], self.server_address[1]))
+
+    def start(self):                                    # Serve in a background thread.  Returns the server.
+        self._thread = threading.Thread(target=self.serve_forever, name="CMX_mockserver", daemon=True)
+        self._thread.start()
+        return(self)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        return()
+
+    def __enter__(self):
+        return(self.start())
+
+    def __exit__(self,*exc):
+        self.stop()
+        return(False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in CMX server with synthetic clients")
+    parser.add_argument("--clients", type=int, default=1000, help="number of synthetic clients")
+    parser.add_argument("--api", choices=sorted(CMX_MockVersions), default="v2", help="CMX API version to serve")
+    parser.add_argument("--floors", type=int, default=9, help="floors the clients are spread over")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds each call takes")
+    parser.add_argument("--jitter", type=float, default=0.0, help="up to this many seconds more, at random")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+    server = CMX_MockServer(CMX_MockCMX(args.clients, args.api, args.floors, args.latency, args.jitter), args.host, args.port)
+    print(server.cmx)
+    print("Serving on http://"+server.address+"  -  set CMX[\"host\"] = \""+server.address+"\" and CMXscheme = \"http\"")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,195 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_parser() - defines the schema-driven parsers for the CMX client JSON.
+#   - The original parser looked up every field from the top of the record ( jsonR[cl]["mapInfo"]["floorDimension"]["height"] ),
+#     so the same nested blocks were looked up again and again for each of the 19 fields.  One bad record threw away the batch.
+#   - A parser here is "compiled" once from a schema:  the list of field paths, in the order the client class constructor
+#     wants them.  Each nested block is fetched once per record, and each field is read straight from its block.
+#   - A record that is missing a field, or holds a bad value, is skipped and noted in a CMX_ParseReport.  The rest of the
+#     batch is still parsed.
+#   - The parsers accept decoded JSON, or the raw response bytes.  Raw bytes are decoded with "CMXjsonLoads", which is
+#     orjson when it is installed, and the standard json module otherwise.
+
+import json
+
+try:
+    import orjson                                       # Faster JSON decoder, From:  "pip install orjson"  (Optional)
+    CMXjsonLoads = orjson.loads
+except ImportError:
+    CMXjsonLoads = json.loads
+
+# -------------------------------------------------------------------
+# CMX_optional() - Marks a schema path as optional.  A record without it, or with it set to null, gets "default" instead of
+#   being skipped.  If every path through a block is optional, the whole block may be missing or null.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_optional(tuple):
+    def __new__ (cls,path,default=None):
+        self = tuple.__new__(cls, path)
+        self.default = default
+        return(self)
+
+# -------------------------------------------------------------------
+# CMX_v2ClientSchema - Where each CMX_ClientLocation_v2 constructor argument lives in a "/api/location/v2/clients" record.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+CMX_v2ClientSchema = (
+    ("macAddress",),                                    # a1
+    ("manufacturer",),                                  # a2
+    ("mapCoordinate", "unit"),                          # a3
+    ("mapCoordinate", "x"),                             # a4
+    ("mapCoordinate", "y"),                             # a5
+    ("mapInfo", "floorDimension", "height"),            # a6
+    ("mapInfo", "floorDimension", "length"),            # a7
+    ("mapInfo", "floorDimension", "offsetX"),           # a8
+    ("mapInfo", "floorDimension", "offsetY"),           # a9
+    ("mapInfo", "floorDimension", "unit"),              # b1
+    ("mapInfo", "floorDimension", "width"),             # b2
+    ("mapInfo", "floorRefId"),                          # b3
+    ("mapInfo", "image", "height"),                     # b4
+    ("mapInfo", "image", "imageName"),                  # b5
+    ("mapInfo", "image", "maxResolution"),              # b6
+    ("mapInfo", "image", "size"),                       # b7
+    ("mapInfo", "image", "width"),                      # b8
+    ("mapInfo", "image", "zoomLevel"),                  # b9
+    ("mapInfo", "mapHierarchyString"),                  # c
+)
+
+# -------------------------------------------------------------------
+# CMX_v3ClientSchema - Where each CMX_ClientLocation_v3 constructor argument lives in a "/api/location/v3/clients" record.
+#   CMX 10.4+ leaves out the geo coordinate on floors without GPS markers, and some releases drop the times.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+CMX_v3ClientSchema = (
+    ("locationMapHierarchy",),                          # a1
+    ("locationCoordinate", "x"),                        # a2
+    ("locationCoordinate", "y"),                        # a3
+    CMX_optional(("locationCoordinate", "z"), 0),       # a4
+    ("locationCoordinate", "unit"),                     # a5
+    CMX_optional(("geoCoordinate", "latitude"), -999),  # a6
+    CMX_optional(("geoCoordinate", "longitude"), -999), # a7
+    CMX_optional(("geoCoordinate", "unit"), "DEGREES"), # a8
+    CMX_optional(("confidenceFactor",), 0),             # a9
+    ("floorRefId",),                                    # b1
+    ("deviceId",),                                      # b2
+    CMX_optional(("lastSeen",), ""),                    # b3
+    CMX_optional(("manufacturer",), "Unknown"),         # b4
+    CMX_optional(("timestamp",), 0),                    # b5
+    CMX_optional(("notificationTime",), 0),             # b6
+    CMX_optional(("ipAddress",), None),                 # b7
+    CMX_optional(("userName",), None),                  # b8
+)
+
+# -------------------------------------------------------------------
+# CMX_ParseReport - What happened to one parse:  how many records came in, how many were parsed, and the first few bad
+#   records with the reason each one was skipped.
+#   maxErrors   - Most bad records kept in "errors".  ("bad" still counts all of them.)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_ParseReport:
+    def __init__ (self,maxErrors=20):
+        self.maxErrors    = int(maxErrors)
+        self.records      = 0                           # Records delivered
+        self.parsed       = 0                           # Records turned into clients
+        self.bad          = 0                           # Records skipped
+        self.errors       = []                          # [(record number, reason), ...]
+
+    def fail(self,index,reason):
+        self.bad += 1
+        if len(self.errors) < self.maxErrors:
+            self.errors.append((index, reason))
+
+    def __str__(self):
+        return("Parse Report: Records: ["+str(self.records)+"]\tParsed: ["+str(self.parsed)+"]\tBad: ["+str(self.bad)+"]")
+
+# -------------------------------------------------------------------
+# CMX_Parser - A parser compiled from a schema.
+#   schema      - Field paths, in the order "build" takes them.  [See:  CMX_v2ClientSchema & CMX_optional()]
+#   build       - Called as build(*values) for each record.  (Usually the client class.)
+#   The schema is turned into the source of a small parsing loop, the way collections.namedtuple() builds its classes.
+#   Each nested block is fetched once into a local, and every field is read straight from its block, so a record costs a
+#   handful of subscripts instead of one full path walk per field.  "source" holds the generated code.
+# parse() - Parses a list of records (or the raw JSON bytes of one) into a list of clients.  Bad records are skipped and
+#   noted in "report".  Any extra keyword arguments are set on every client, e.g. parse(data, Loc_time=now).
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_Parser:
+    def __init__ (self,schema,build):
+        self.schema       = tuple(path if isinstance(path, CMX_optional) else tuple(path) for path in schema)
+        self.build        = build
+        self.source       = self._compile(self.schema)
+        namespace         = {"defaults": tuple(getattr(path, "default", None) for path in self.schema)}
+        exec(self.source, namespace)
+        self._parse       = namespace["_parse"]
+
+    @staticmethod
+    def _compile(schema):
+        blocks = {(): "r0"}                             # block path --> local variable holding it
+        lines  = []
+        for path in schema:
+            for depth in range(1, len(path)):
+                block = path[:depth]
+                if block not in blocks:
+                    blocks[block] = "r"+str(len(blocks))
+                    optional = all(isinstance(p, CMX_optional) for p in schema if p[:depth] == block)
+                    lines.append("            {} = {}{}{}".format(blocks[block], "(" if optional else "", blocks[block[:-1]],
+                                 ".get({!r}) or {{}})".format(block[-1]) if optional else "[{!r}]".format(block[-1])))
+        values = []
+        for i, path in enumerate(schema):
+            if isinstance(path, CMX_optional):
+                values.append("(defaults[{2}] if {0}.get({1!r}) is None else {0}[{1!r}])".format(blocks[path[:-1]], path[-1], i))
+            else:
+                values.append("{}[{!r}]".format(blocks[path[:-1]], path[-1]))
+        values = ", ".join(values)
+        return("\n".join(["def _parse(data, build, report, fields):",
+                           "    Clist = []",
+                           "    append = Clist.append",
+                           "    for i, r0 in enumerate(data):",
+                           "        try:"] + lines + [
+                           "            client = build({})".format(values),
+                           "        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as err:",
+                           "            report.fail(i, type(err).__name__+': '+str(err))",
+                           "            continue",
+                           "        for name in fields:",
+                           "            setattr(client, name, fields[name])",
+                           "        append(client)",
+                           "    return(Clist)", ""]))
+
+    def parse(self,data,report=None,**fields):         # Records, or raw JSON, to a list of clients
+        if report is None:
+            report = CMX_ParseReport()
+        if isinstance(data, (bytes, bytearray, memoryview, str)):
+            try:
+                data = CMXjsonLoads(data)
+            except ValueError as err:
+                report.fail(None, "Not valid JSON: "+str(err))
+                return([])
+        if isinstance(data, dict):                      # A single record
+            data = [data]
+        if not isinstance(data, list):
+            report.fail(None, "Expected a list of records, got "+type(data).__name__)
+            return([])
+        report.records += len(data)
+        Clist = self._parse(data, self.build, report, fields)
+        report.parsed += len(Clist)
+        return(Clist)
+
+    def __str__(self):
+        return("CMX Parser: Fields: ["+str(len(self.schema))+"]")
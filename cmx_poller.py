@@ -0,0 +1,158 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_poller() - defines the background poller that keeps the tracked clients' locations current.
+#   - Without it, the only way to follow a client was to call CMX_lookup() in a loop, and every call re-drew its map.
+#   - The poller asks CMX for every tracked MAC once per interval, in one batch, and compares each answer with the location
+#     we already hold.  Only clients whose floor changed, or who moved further than "threshold" floor units, are passed on
+#     to the listeners.  [See:  apply_CMX_changes() in CMX-Modules.py]
+#   - A failed call, or a placeholder for a client we hold a location for, is never passed on as a move.  The last known
+#     location is kept, so a CMX outage can't send every tracked client off the floor.
+
+import math, threading, time
+from cmx_registry import CMX_client_mac, CMX_client_floor, normalize_CMX_mac
+
+# -------------------------------------------------------------------
+# CMX_client_position() - (floorRefId, x, y) of a client, in floor units.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_client_position(cmxClient):
+    return((CMX_client_floor(cmxClient), cmxClient.map_xcord, cmxClient.map_ycord))
+
+# -------------------------------------------------------------------
+# CMX_moved() - True if a client at position "new" has moved from position "old":  another floor, or further than
+#   "threshold" floor units away.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_moved(old,new,threshold):
+    if old[0] != new[0]:
+        return(True)
+    return(math.hypot(new[1] - old[1], new[2] - old[2]) > threshold)
+
+# -------------------------------------------------------------------
+# CMX_placeholder() - True if a client is the "OffNet" placeholder for a MAC that CMX has no location for.
+#   [See:  Empty_v2_Client() in CMX-Modules.py]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_placeholder(cmxClient):
+    return(getattr(cmxClient, "Loc_Status", None) == "OffNet")
+
+
+# -------------------------------------------------------------------
+# CMX_Poller - Polls CMX for the tracked clients and reports the ones that moved.
+#   tracked     - Routine that returns the clients we are tracking now.  [See:  CMX_ClientRegistry.clients()]
+#   fetch       - Routine called as fetch(macs) that returns {mac: client}, with None for a MAC whose call failed.
+#                 [See:  fetch_CMX_clients() in CMX-Modules.py]
+#   interval    - Seconds between polls.
+#   threshold   - Floor units a client must move (on the same floor) before it counts as moved.
+#   Each poll calls every listener as listener(changes), where changes is a list of (tracked client, new client) pairs, and
+#   only when the list isn't empty.  The tracked client still holds the old location until a listener updates it.  A listener that raises doesn't stop the poller or the other listeners.
+#   A placeholder answer for a tracked client that has a location is not a change.  The tracked client keeps its location.
+#   Counters:  "polls", "fetched" (clients answered), "changed", "failed" (MACs whose call failed), "unseen" (located
+#   clients CMX answered for without a location), "errors" (polls or listeners that raised), "lastPoll" (seconds the
+#   last poll took).
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_Poller:
+    def __init__ (self,tracked,fetch,interval=30,threshold=1.0):
+        self.tracked      = tracked
+        self.fetch        = fetch
+        self.interval     = interval                    # Seconds between polls
+        self.threshold    = threshold                   # Floor units moved before a client counts as moved
+        self.listeners    = []                          # Called as listener(changes) after each poll with changes
+        self.polls        = 0
+        self.fetched      = 0
+        self.changed      = 0
+        self.failed       = 0
+        self.unseen       = 0
+        self.errors       = 0
+        self.lastPoll     = 0.0
+        self._stop        = threading.Event()
+        self._thread      = None
+        self._lock        = threading.Lock()            # One poll at a time
+
+    def add_listener(self,listener):
+        self.listeners.append(listener)
+        return(listener)
+
+    def remove_listener(self,listener):
+        self.listeners.remove(listener)
+        return()
+
+    def poll(self):                                     # Poll once, now.  Returns the list of (old, new) changes.
+        with self._lock:
+            start   = time.perf_counter()
+            Tracked = {normalize_CMX_mac(CMX_client_mac(c)): c for c in self.tracked()}
+            Changes = []
+            if len(Tracked) > 0:
+                Fetched = self.fetch(list(Tracked))
+                for mac, cmxClient in Fetched.items():
+                    old = Tracked.get(normalize_CMX_mac(mac))
+                    if cmxClient is None:
+                        self.failed += 1
+                    elif old is not None and CMX_placeholder(cmxClient) and not CMX_placeholder(old):
+                        self.unseen += 1                # Keep the last known location
+                    elif old is not None:
+                        self.fetched += 1
+                        if CMX_moved(CMX_client_position(old), CMX_client_position(cmxClient), self.threshold):
+                            Changes.append((old, cmxClient))
+            self.polls   += 1
+            self.changed += len(Changes)
+            self.lastPoll = time.perf_counter() - start
+        if len(Changes) > 0:
+            for listener in list(self.listeners):
+                try:
+                    listener(Changes)
+                except Exception as err:
+                    self.errors += 1
+                    print("\n<<!>> CMX_Poller - Warning:  Listener failed:\t[",err,"]\n")
+        return(Changes)
+
+    def start(self):                                    # Poll every "interval" seconds on a background thread
+        if self.running():
+            return(False)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="CMX_poller", daemon=True)
+        self._thread.start()
+        return(True)
+
+    def stop(self,wait=True):
+        self._stop.set()
+        if wait and self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        return()
+
+    def running(self):
+        return(self._thread is not None and self._thread.is_alive())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as err:                    # Keep polling.  CMX may be back by the next poll.
+                self.errors += 1
+                print("\n<<!>> CMX_Poller - Warning:  Poll failed:\t[",err,"]\n")
+
+    def stats(self):
+        return({"polls": self.polls, "fetched": self.fetched, "changed": self.changed, "failed": self.failed,
+                "unseen": self.unseen, "errors": self.errors, "lastPoll": self.lastPoll, "running": self.running()})
+
+    def __str__(self):
+        s = self.stats()
+        return("CMX Poller: Polls: ["+str(s["polls"])+"]\tFetched: ["+str(s["fetched"])+"]\tChanged: ["+str(s["changed"])+"]\tFailed: ["+str(s["failed"])+"]\tUnseen: ["+str(s["unseen"])+"]\tErrors: ["+str(s["errors"])+"]\tLast: ["+"{:.3f}".format(s["lastPoll"])+"s]")
@@ -0,0 +1,254 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_registry() - defines the registry of every client we are tracking (infected, quarantined or off the network).
+#   - The original InfectMacList and QuarantineMacList were plain lists.  Every add, quarantine and purge walked them by
+#     index comparing MAC addresses, so each one cost O(n).
+#   - The registry keeps one dictionary keyed by the normalized MAC address, with the status of each client as a field.
+#     Add, update, quarantine, purge and lookup are all O(1).
+#   - InfectMacList and QuarantineMacList still exist, but as "views" of the registry.  They can be read like the old
+#     lists (len(), [i], for ... in ...), and append()/del still work, but they no longer hold data of their own.
+
+import copy, threading
+from collections.abc import Sequence
+
+CMX_Statuses = ("IoC", "Quarantined", "OffNet")         # Status of a tracked client.  (Also kept in its "Loc_Status" field.)
+
+# -------------------------------------------------------------------
+# normalize_CMX_mac() - Returns a MAC address in one standard form: lower case, colon separated.
+#   "00:20:00:19:89:E0", "00-20-00-19-89-e0" and "0020.0019.89e0" all become "00:20:00:19:89:e0".
+#   Anything that isn't 12 hex digits is just stripped and lower-cased.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def normalize_CMX_mac(mac):
+    mac  = str(mac).strip().lower()
+    hexd = mac.replace(":", "").replace("-", "").replace(".", "")
+    if len(hexd) == 12 and all(c in "0123456789abcdef" for c in hexd):
+        return(":".join(hexd[i:i+2] for i in range(0, 12, 2)))
+    return(mac)
+
+# -------------------------------------------------------------------
+# CMX_client_mac() - Returns the MAC address of a client.  (v2 clients call it "macAddress", v3 clients "deviceId".)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_client_mac(cmxClient):
+    mac = getattr(cmxClient, "macAddress", None)
+    if mac is None:
+        mac = cmxClient.deviceId
+    return(mac)
+
+# -------------------------------------------------------------------
+# CMX_client_floor() - Returns the floor reference ID of a client, as a string.  (v2 clients call it "mapinfo_floorRefId",
+#   v3 clients "floorRefId".)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_client_floor(cmxClient):
+    floorRefId = getattr(cmxClient, "mapinfo_floorRefId", None)
+    if floorRefId is None:
+        floorRefId = cmxClient.floorRefId
+    return(str(floorRefId))
+
+
+# -------------------------------------------------------------------
+# CMX_ClientRegistry - All tracked clients, keyed by normalized MAC address.
+#   updater     - Routine called as updater(newData, oldData) when a client we already track is added again.
+#                 [See:  update_CMXclient() in CMX-Modules.py]
+#   listener    - Routine called as listener("put", mac, client) after a client is added, updated or changes status, and
+#                 listener("purge", mac, client) after it is purged.  It runs under the lock, so calls arrive in the order
+#                 the changes were made.  [See:  CMX_ClientStore in cmx_store.py]
+#   The clients are also filed by status, so each status can be listed in the order the clients were added without a scan,
+#   and by floor, so the clients on one floor can be listed without a scan.  [See:  on_floor()]
+#   All methods are thread safe.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_ClientRegistry:
+    def __init__ (self,updater=None,listener=None):
+        self.updater      = updater                     # Copies new data over a client we already track
+        self.listener     = listener                    # Told about every change  (e.g. to keep a copy on disk)
+        self._clients     = {}                          # mac --> client
+        self._byStatus    = {s: {} for s in CMX_Statuses}   # status --> {mac: client}  (insertion ordered)
+        self._byFloor     = {}                          # floorRefId --> {mac: client}
+        self._floorOf     = {}                          # mac --> floorRefId it is filed under
+        self._lock        = threading.RLock()
+
+    def add(self,cmxClient,status="IoC"):               # Add a new client, or update one we already track.  Returns the tracked client.
+        mac = normalize_CMX_mac(CMX_client_mac(cmxClient))
+        with self._lock:
+            tracked = self._clients.get(mac)
+            if tracked is None:
+                tracked = copy.deepcopy(cmxClient)
+                self._clients[mac] = tracked
+                self._file(mac, tracked, status)
+            else:
+                if self.updater is not None:
+                    self.updater(cmxClient, tracked)
+                if tracked.Loc_Status != "Quarantined":     # A quarantined client stays quarantined until it is purged
+                    self._file(mac, tracked, status)
+            self._place(mac, tracked)
+            self._notify("put", mac, tracked)
+            return(tracked)
+
+    def restore(self,cmxClient,status):                 # Track a client reloaded from disk.  (No copy, no updater, no listener.)
+        mac = normalize_CMX_mac(CMX_client_mac(cmxClient))
+        with self._lock:
+            if mac in self._clients:
+                return(self._clients[mac])
+            self._clients[mac] = cmxClient
+            self._file(mac, cmxClient, status)
+            self._place(mac, cmxClient)
+            return(cmxClient)
+
+    def get(self,mac):                                  # The tracked client for this MAC, or None
+        return(self._clients.get(normalize_CMX_mac(mac)))
+
+    def status(self,mac):                               # The status of this MAC, or None if we don't track it
+        tracked = self.get(mac)
+        if tracked is None:
+            return(None)
+        return(tracked.Loc_Status)
+
+    def set_status(self,mac,status):                    # Move a tracked client to a new status.  False if we don't track it.
+        mac = normalize_CMX_mac(mac)
+        with self._lock:
+            tracked = self._clients.get(mac)
+            if tracked is None:
+                return(False)
+            self._file(mac, tracked, status)
+            self._notify("put", mac, tracked)
+            return(True)
+
+    def quarantine(self,mac):
+        return(self.set_status(mac, "Quarantined"))
+
+    def purge(self,mac):                                # Stop tracking a client.  Returns the client removed, or None.
+        mac = normalize_CMX_mac(mac)
+        with self._lock:
+            tracked = self._clients.pop(mac, None)
+            if tracked is not None:
+                self._byStatus[tracked.Loc_Status].pop(mac, None)
+                self._unplace(mac)
+                self._notify("purge", mac, tracked)
+            return(tracked)
+
+    def clients(self,*statuses):                        # Snapshot list of the tracked clients (all of them, or just these statuses)
+        with self._lock:
+            if len(statuses) == 0:
+                return(list(self._clients.values()))
+            return([c for s in statuses for c in self._byStatus[s].values()])
+
+    def count(self,*statuses):
+        with self._lock:
+            if len(statuses) == 0:
+                return(len(self._clients))
+            return(sum(len(self._byStatus[s]) for s in statuses))
+
+    def on_floor(self,floorRefId,*statuses):           # Snapshot list of the tracked clients on one floor (all of them, or just these statuses)
+        with self._lock:
+            onFloor = self._byFloor.get(str(floorRefId), {}).values()
+            if len(statuses) == 0:
+                return(list(onFloor))
+            return([c for c in onFloor if c.Loc_Status in statuses])
+
+    def floors(self):                                   # {floorRefId: number of tracked clients on it}
+        with self._lock:
+            return({f: len(self._byFloor[f]) for f in self._byFloor})
+
+    def view(self,*statuses):                           # A list-like view of the clients with these statuses
+        return(CMX_RegistryView(self, statuses))
+
+    def _file(self,mac,tracked,status):                 # File the client under its new status.  (Caller holds the lock.)
+        if status not in self._byStatus:
+            raise ValueError("Unknown client status: "+str(status))
+        old = getattr(tracked, "Loc_Status", None)
+        if old in self._byStatus:
+            self._byStatus[old].pop(mac, None)
+        tracked.Loc_Status = status
+        self._byStatus[status][mac] = tracked
+
+    def _notify(self,event,mac,tracked):                # (Caller holds the lock.)
+        if self.listener is not None:
+            self.listener(event, mac, tracked)
+
+    def _place(self,mac,tracked):                       # File the client under its current floor.  (Caller holds the lock.)
+        floorRefId = CMX_client_floor(tracked)
+        if self._floorOf.get(mac) != floorRefId:
+            self._unplace(mac)
+            self._floorOf[mac] = floorRefId
+            self._byFloor.setdefault(floorRefId, {})[mac] = tracked
+
+    def _unplace(self,mac):                             # (Caller holds the lock.)
+        floorRefId = self._floorOf.pop(mac, None)
+        if floorRefId is not None:
+            onFloor = self._byFloor[floorRefId]
+            onFloor.pop(mac, None)
+            if len(onFloor) == 0:
+                del self._byFloor[floorRefId]
+
+    def __contains__(self,mac):
+        return(normalize_CMX_mac(mac) in self._clients)
+
+    def __len__(self):
+        return(len(self._clients))
+
+    def __str__(self):
+        return("CMX Registry: "+"\t".join(s+": ["+str(len(self._byStatus[s]))+"]" for s in CMX_Statuses))
+
+
+# -------------------------------------------------------------------
+# CMX_RegistryView - A list-like view of the registry, limited to some statuses.  This is what InfectMacList and
+#   QuarantineMacList are now.  Reading works like the old lists.  append() adds the client with the first status of the
+#   view, and "del view[i]" or remove() purges the client from the registry.  Indexing by position is O(n), like it
+#   always was, so new code should use the registry itself.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_RegistryView(Sequence):
+    def __init__ (self,registry,statuses):
+        self.registry     = registry
+        self.statuses     = tuple(statuses)
+
+    def __len__(self):
+        return(self.registry.count(*self.statuses))
+
+    def __getitem__(self,i):
+        return(self.registry.clients(*self.statuses)[i])
+
+    def __iter__(self):
+        return(iter(self.registry.clients(*self.statuses)))
+
+    def __contains__(self,cmxClient):
+        tracked = self.registry.get(CMX_client_mac(cmxClient))
+        return(tracked is not None and tracked.Loc_Status in self.statuses)
+
+    def __delitem__(self,i):
+        self.registry.purge(CMX_client_mac(self[i]))
+
+    def append(self,cmxClient):
+        self.registry.add(cmxClient, self.statuses[0])
+
+    def remove(self,cmxClient):
+        if cmxClient not in self:
+            raise ValueError("Client is not in this list")
+        self.registry.purge(CMX_client_mac(cmxClient))
+
+    def clear(self):
+        for cmxClient in self:
+            self.registry.purge(CMX_client_mac(cmxClient))
+
+    def __str__(self):
+        return("["+", ".join(str(c) for c in self)+"]")
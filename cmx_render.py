@@ -0,0 +1,236 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_render() - defines the render queue that draws client maps off the lookup path.
+#   - CMX_lookup() used to draw the client map itself, so the caller waited for the floor decode, the icon paste and the
+#     PNG encode before getting an answer, and the next API call waited behind them.
+#   - Now the lookup queues a render job and returns.  A pool of workers draws the maps.  With "processes", the workers are
+#     separate processes, so the Pillow decode and encode run on other cores instead of holding the GIL.
+#   - Each job is keyed by MAC.  A MAC that is queued again before its map was drawn gets only one render, of its latest
+#     position.  Every caller gets a Future for the map file.
+#   - The render itself [CMX_render_map()] only uses this module, so a worker process never imports CMX-Modules.py.
+#   - How a map is written is set by a render profile:  format, quality, palette, scale and crop.  [See:  CMX_RenderProfiles]
+
+import os, threading
+from collections import namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from PIL import Image                                   # Image manipulation tools, From:  "pip install Pillow"
+from cmx_cache import CMX_ImageCache
+
+CMX_WorkerImages = CMX_ImageCache(128*1024*1024)        # Decoded floor plans & icons of this process  (each worker has its own)
+
+# -------------------------------------------------------------------
+# CMX_RenderProfile - How a client map is drawn and written.
+#   fmt         - "PNG", "JPEG" or "WEBP".
+#   quality     - JPEG / WebP quality (1-95).  Ignored for PNG.
+#   colors      - Reduce a PNG to a palette of this many colors (2-256).  0 keeps full color.
+#   scale       - Shrink the map by this factor  (0.5 is half the width and height).  The icon keeps its size.
+#   crop        - (width, height) in floor image pixels of a "zoomed in" map centred on the client, or None for the whole floor.
+#   A profile is hashable, so it can be part of a render key.  [See:  CMX_render_key() in cmx_cache.py]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_RenderProfile(namedtuple("CMX_RenderProfile", "fmt quality colors scale crop")):
+    __slots__ = ()
+    Extensions = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+
+    def __new__ (cls,fmt="PNG",quality=85,colors=0,scale=1.0,crop=None):
+        fmt = str(fmt).upper()
+        if fmt not in cls.Extensions:
+            raise ValueError("Unknown map format: "+fmt)
+        return(super().__new__(cls, fmt, int(quality), int(colors), float(scale), tuple(crop) if crop else None))
+
+    @property
+    def ext(self):                                      # File extension of this format
+        return(self.Extensions[self.fmt])
+
+    def options(self):                                  # Keyword arguments for Image.save()
+        if self.fmt == "JPEG":
+            return({"quality": self.quality, "optimize": False})
+        if self.fmt == "WEBP":
+            return({"quality": self.quality, "method": 2})   # (0 = fastest, 6 = smallest)
+        return({})                                      # PNG:  Pillow's defaults, as the maps have always been written
+
+CMX_RenderProfiles = {                                  # Named profiles.  [See:  "MapProfile" in CMX-Modules.py]
+    "full":  CMX_RenderProfile("PNG"),                  # Whole floor, full color PNG.  (The original maps.)
+    "png8":  CMX_RenderProfile("PNG", colors=64),       # Whole floor, 64 color PNG
+    "jpeg":  CMX_RenderProfile("JPEG", quality=80),     # Whole floor, JPEG
+    "webp":  CMX_RenderProfile("WEBP", quality=75),     # Whole floor, WebP
+    "half":  CMX_RenderProfile("JPEG", quality=80, scale=0.5),              # Half size JPEG
+    "thumb": CMX_RenderProfile("JPEG", quality=80, crop=(320, 240)),        # 320x240 JPEG around the client
+}
+
+# -------------------------------------------------------------------
+# CMX_draw_map() - Draws one client map by a profile and returns it, ready to save.  The floor image isn't changed.
+#   The floor is cropped and scaled before the icon is pasted, so only the pixels that are written get copied, and the
+#   icon keeps its size on a shrunken map.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_draw_map(floorImg,icon,xy,profile):
+    box = (0, 0, floorImg.width, floorImg.height)
+    if profile.crop is not None:                        # A window centred on the client, kept inside the floor
+        w, h = min(profile.crop[0], floorImg.width), min(profile.crop[1], floorImg.height)
+        left = min(max(int(xy[0]) - w // 2, 0), floorImg.width - w)
+        top  = min(max(int(xy[1]) - h // 2, 0), floorImg.height - h)
+        box  = (left, top, left + w, top + h)
+    mapImg = floorImg.crop(box)
+    if profile.scale != 1.0:
+        mapImg = mapImg.resize((max(1, round(mapImg.width * profile.scale)), max(1, round(mapImg.height * profile.scale))),
+                               Image.Resampling.BILINEAR)
+    if profile.fmt == "JPEG" and mapImg.mode not in ("RGB", "L"):
+        mapImg = mapImg.convert("RGB")
+    CMX_paste_icon(mapImg, icon, (round((xy[0] - box[0]) * profile.scale), round((xy[1] - box[1]) * profile.scale)))
+    if profile.colors and profile.fmt == "PNG":
+        mapImg = mapImg.convert("RGB").quantize(profile.colors, method=Image.Quantize.FASTOCTREE)
+    return(mapImg)
+
+# -------------------------------------------------------------------
+# CMX_paste_icon() - Pastes an icon onto a map, centred on the client's pixel (xy).  Icons with transparency (the colored
+#    dots) are pasted through their own mask so only the dot is drawn, not its square background.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_paste_icon(mapImg,icon,xy):
+    corner = (xy[0] - icon.width // 2, xy[1] - icon.height // 2)
+    if icon.mode in ("RGBA", "LA"):
+        mapImg.paste(icon,corner,icon)
+    else:
+        mapImg.paste(icon,corner)
+    return()
+
+# -------------------------------------------------------------------
+# CMX_save_map() - Writes a map to disk.  The image is written to a temporary file first and then renamed over the old
+#    map, so two renders of the same map (in any thread or process) never leave a half written file behind.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_save_map(mapImg,ofname,fmt,**options):       # options - Image.save() settings  [See:  CMX_RenderProfile.options()]
+    tmpname = "{}.{}.{}.tmp".format(ofname, os.getpid(), threading.get_ident())
+    mapImg.save(tmpname, format=fmt, **options)
+    os.replace(tmpname, ofname)
+    return()
+
+# -------------------------------------------------------------------
+# CMX_render_map() - Draws one client map.  Runs in a worker.
+#   job         - (floor image, (x,y), icon, output file, profile, render key).  [See:  CMX_RenderQueue.submit()]
+#   Returns the output file.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_render_map(job):
+    floorImage, xy, icon, ofname, profile = job[:5]
+    mapImg = CMX_draw_map(CMX_WorkerImages.get(floorImage), CMX_WorkerImages.get(icon), xy, profile)
+    CMX_save_map(mapImg, ofname, profile.fmt, **profile.options())
+    return(ofname)
+
+
+# -------------------------------------------------------------------
+# CMX_RenderQueue - Renders map jobs on a worker pool, one job at a time per key.
+#   render      - Routine called as render(job) in a worker.  It must be a module level routine so a process can run it.
+#   workers     - Renders running at once.
+#   processes   - Run render() in worker processes.  Otherwise it runs on the queue's threads.
+#   done        - Routine called as done(job, result) in this process after each successful render.  [See:  CMXrenderCache]
+#   submit() returns a Future of the result.  While a key's job is still waiting, a new job for that key replaces it, and
+#   both callers get the same Future.  A key whose job is already running gets its new job run right after it.
+#   Counters:  "submitted", "coalesced" (replaced a waiting job), "rendered", "failed".
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_RenderQueue:
+    def __init__ (self,render=CMX_render_map,workers=2,processes=True,done=None):
+        self.render       = render
+        self.workers      = int(workers)
+        self.processes    = processes
+        self.done         = done
+        self.submitted    = 0
+        self.coalesced    = 0
+        self.rendered     = 0
+        self.failed       = 0
+        self._waiting     = {}                          # key --> [job, Future] not started yet
+        self._running     = {}                          # key --> Future being rendered now
+        self._latest      = {}                          # key --> Future of the last job submitted
+        self._threads     = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="CMX_render")
+        self._pool        = ProcessPoolExecutor(max_workers=self.workers) if processes else None
+        self._lock        = threading.Lock()
+
+    def submit(self,key,job):                           # Queue a job.  Returns a Future of its result.
+        with self._lock:
+            self.submitted += 1
+            waiting = self._waiting.get(key)
+            if waiting is not None:                     # Not started yet.  Render the newest job instead.
+                waiting[0] = job
+                self.coalesced += 1
+                return(waiting[1])
+            future = Future()
+            self._waiting[key] = [job, future]
+            self._latest[key]  = future
+            if key not in self._running:
+                self._threads.submit(self._run, key)
+            return(future)
+
+    def future(self,key):                               # Future of the last job submitted for this key, or None
+        return(self._latest.get(key))
+
+    def busy(self,key):                                 # True while a job for this key is waiting or running
+        with self._lock:
+            return(key in self._waiting or key in self._running)
+
+    def _run(self,key):
+        with self._lock:
+            job, future = self._waiting.pop(key)
+            self._running[key] = future
+        try:
+            if self._pool is not None:
+                result = self._pool.submit(self.render, job).result()
+            else:
+                result = self.render(job)
+            if self.done is not None:
+                self.done(job, result)
+            with self._lock:
+                self.rendered += 1
+            future.set_result(result)
+        except Exception as err:
+            with self._lock:
+                self.failed += 1
+            future.set_exception(err)
+        finally:
+            with self._lock:
+                del self._running[key]
+                if key in self._waiting:                # Queued again while it was rendering
+                    self._threads.submit(self._run, key)
+
+    def wait(self,timeout=None):                        # Wait for every queued job.  False if "timeout" ran out first.
+        with self._lock:
+            Futures = list(self._latest.values())
+        for future in Futures:
+            try:
+                future.exception(timeout)
+            except TimeoutError:
+                return(False)
+        return(True)
+
+    def shutdown(self,wait=True):
+        self._threads.shutdown(wait=wait)
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+        return()
+
+    def stats(self):
+        with self._lock:
+            return({"submitted": self.submitted, "coalesced": self.coalesced, "rendered": self.rendered, "failed": self.failed,
+                    "queued": len(self._waiting), "running": len(self._running)})
+
+    def __str__(self):
+        s = self.stats()
+        return("Render Queue: Submitted: ["+str(s["submitted"])+"]\tCoalesced: ["+str(s["coalesced"])+"]\tRendered: ["+str(s["rendered"])+"]\tFailed: ["+str(s["failed"])+"]\tQueued: ["+str(s["queued"])+"]\tRunning: ["+str(s["running"])+"]")
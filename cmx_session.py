@@ -0,0 +1,149 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_session() - defines the HTTP session used for every CMX API call.
+#   - A bare "requests.get()" opens a new TCP+TLS connection for each call.  During an incident we can fire hundreds of
+#     lookups a minute, and the handshake ends up costing more than the lookup itself.
+#   - The CMX_Session class keeps a pool of keep-alive connections to the CMX host, so only the first call to a host pays
+#     for the handshake.  The pool size, retries and the default timeouts are all set when the session is created.
+#   - Every call can override the default timeout.  A timeout is either a single number of seconds, or a (connect, read) pair.
+#   - The session doesn't talk to the network itself.  It hands each call to a transport:  CMX_HTTPTransport (requests,
+#     the default) or CMX_LocalTransport, which answers from a routine in this process, so tests and benchmarks can run
+#     against a stand-in CMX without a server.  [See:  cmx_mockserver.py]
+
+import json, threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+
+# -------------------------------------------------------------------
+# CMX_Response - The answer of a CMX_LocalTransport call.  It has the parts of a "requests" response that the CMX routines use.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_Response:
+    def __init__ (self,status_code,reason,content,headers=None):
+        self.status_code     = status_code              # HTTP status
+        self.reason          = reason                   # HTTP reason phrase
+        self.content         = content                  # Body (bytes)
+        self.headers         = headers or {}            # Response headers
+
+    def json(self):
+        return(json.loads(self.content))
+
+    def __repr__(self):
+        return("<Response ["+str(self.status_code)+"]>")
+
+
+# -------------------------------------------------------------------
+# CMX_HTTPTransport - Sends the calls over HTTP(S) with "requests", on a pool of keep-alive connections per host.
+#   poolSize    - Number of keep-alive connections kept open per CMX host.  (Also the most requests in flight per host.)
+#   retries     - Number of times a failed connection attempt is retried before giving up.
+#   verify      - TLS certificate verification.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_HTTPTransport:
+    def __init__ (self,poolSize=10,retries=1,verify=False):
+        self.poolSize        = int(poolSize)
+        self.retries         = int(retries)
+        self.verify          = verify
+        self._lock           = threading.Lock()
+        self._session        = self._new_session()
+
+    def _new_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.poolSize, pool_maxsize=self.poolSize, max_retries=self.retries, pool_block=True)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.verify = self.verify
+        session.headers.update({'Connection': "keep-alive"})
+        return(session)
+
+    def get(self,url,headers=None,timeout=None,**kwargs):
+        return(self._session.get(url, headers=headers, timeout=timeout, **kwargs))
+
+    def resize(self,poolSize):                          # Change the pool size.  Open connections are dropped and re-opened on demand.
+        with self._lock:
+            old = self._session
+            self.poolSize = int(poolSize)
+            self._session = self._new_session()
+        old.close()
+
+    def close(self):
+        self._session.close()
+
+
+# -------------------------------------------------------------------
+# CMX_LocalTransport - Answers the calls from a routine in this process, with no sockets at all.
+#   handler     - Called as handler(path, headers), where "path" includes the query string.  Returns (status, reason, body bytes).
+#                 [See:  CMX_MockCMX.handle() in cmx_mockserver.py]
+#   The host and scheme of the URL are ignored.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_LocalTransport:
+    def __init__ (self,handler):
+        self.handler         = handler
+
+    def get(self,url,headers=None,timeout=None,**kwargs):
+        parts = urlsplit(url)
+        path  = parts.path + ("?" + parts.query if parts.query else "")
+        status, reason, body = self.handler(path, headers or {})
+        return(CMX_Response(status, reason, body, {"Content-Type": "application/json"}))
+
+    def resize(self,poolSize):
+        return()
+
+    def close(self):
+        return()
+
+
+# -------------------------------------------------------------------
+# CMX_Session - Shared client for the CMX API calls.
+#   poolSize    - Number of keep-alive connections kept open per CMX host.  (Also the most requests in flight per host.)
+#   timeout     - Default timeout for each call.  (connect, read) in seconds.
+#   retries     - Number of times a failed connection attempt is retried before giving up.
+#   verify      - TLS certificate verification.  The CMX sandboxes use self-signed certificates, so this is off by default.
+#   transport   - What carries the calls.  Default is a CMX_HTTPTransport built from the settings above.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_Session:
+    def __init__ (self,poolSize=10,timeout=(3.05,15),retries=1,verify=False,transport=None):
+        self.poolSize        = int(poolSize)            # Keep-alive connections per host
+        self.timeout         = timeout                  # Default (connect, read) timeout in seconds
+        self.retries         = int(retries)             # Connection retries
+        self.verify          = verify                   # TLS verification
+        self.transport       = transport or CMX_HTTPTransport(self.poolSize, self.retries, self.verify)
+        self.Loc_requests    = 0                        # <<>> Not part of CMX data. Count of API calls made through this session <<>>
+        self._lock           = threading.Lock()
+
+    def get(self,url,headers=None,timeout=None,**kwargs):
+        with self._lock:
+            self.Loc_requests += 1
+        if timeout is None:
+            timeout = self.timeout
+        return(self.transport.get(url, headers=headers, timeout=timeout, **kwargs))
+
+    def resize(self,poolSize):                          # Change the pool size.  Open connections are dropped and re-opened on demand.
+        self.poolSize = int(poolSize)
+        self.transport.resize(self.poolSize)
+
+    def close(self):
+        self.transport.close()
+
+    def __str__(self):
+        return("CMX Session: Pool Size: ["+str(self.poolSize)+"]\tTimeout: ["+str(self.timeout)+"]\tTransport: ["+type(self.transport).__name__+"]\tRequests: ["+str(self.Loc_requests)+"]")
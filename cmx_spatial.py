@@ -0,0 +1,168 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_spatial() - defines the spatial index used to answer "who was near the infected device".
+#   - Finding the clients within N feet of a client meant scanning every client CMX reports.  The index files each client
+#     in a square grid cell of its floor, so a query only looks at the cells that overlap the circle it asks about.
+#   - refresh() takes the full client list each time, but only touches the grid for clients that changed cell, appeared
+#     or disappeared.  A client that moved within its cell only has its coordinates updated.
+#   - Coordinates are floor units (map_unit), FEET on the sandboxes.
+
+import heapq, math, threading
+from cmx_registry import CMX_client_mac, CMX_client_floor, normalize_CMX_mac
+
+# -------------------------------------------------------------------
+# CMX_SpatialIndex - Per-floor grid of client positions.
+#   cellSize    - Width of a grid cell in floor units.  Roughly the radius of a typical query works well.
+#   All methods are thread safe.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_SpatialIndex:
+    def __init__ (self,cellSize=25.0):
+        self.cellSize     = float(cellSize)
+        self.refreshes    = 0
+        self._where       = {}                          # mac --> (floorRefId, x, y, cell)
+        self._clients     = {}                          # mac --> client
+        self._grids       = {}                          # floorRefId --> {cell: {mac: None}}
+        self._keys        = {}                          # MAC as CMX reports it --> normalized MAC  (saves normalizing it every refresh)
+        self._lock        = threading.Lock()
+
+    def _cell(self,x,y):
+        return((int(x // self.cellSize), int(y // self.cellSize)))
+
+    def refresh(self,cmxClients):                       # Make the index match this client list.  Returns what changed.
+        counts = {"added": 0, "moved": 0, "updated": 0, "removed": 0}
+        with self._lock:
+            where, grids, keys = self._where, self._grids, self._keys
+            Seen = set()
+            Keys = {}
+            for cmxClient in cmxClients:
+                raw   = CMX_client_mac(cmxClient)
+                mac   = keys.get(raw)
+                if mac is None:
+                    mac = normalize_CMX_mac(raw)
+                Keys[raw] = mac
+                floor = CMX_client_floor(cmxClient)
+                x, y  = cmxClient.map_xcord, cmxClient.map_ycord
+                cell  = self._cell(x, y)
+                Seen.add(mac)
+                self._clients[mac] = cmxClient
+                old = where.get(mac)
+                if old is not None and old[0] == floor and old[3] == cell:
+                    counts["updated"] += 1
+                else:
+                    if old is not None:
+                        self._unfile(mac, old)
+                        counts["moved"] += 1
+                    else:
+                        counts["added"] += 1
+                    grids.setdefault(floor, {}).setdefault(cell, {})[mac] = None
+                where[mac] = (floor, x, y, cell)
+            for mac in [mac for mac in where if mac not in Seen]:
+                self._unfile(mac, where.pop(mac))
+                del self._clients[mac]
+                counts["removed"] += 1
+            self._keys = Keys
+            self.refreshes += 1
+        return(counts)
+
+    def _unfile(self,mac,old):                          # (Caller holds the lock.)
+        grid  = self._grids[old[0]]
+        cell  = grid[old[3]]
+        del cell[mac]
+        if len(cell) == 0:
+            del grid[old[3]]
+            if len(grid) == 0:
+                del self._grids[old[0]]
+
+    def position(self,mac):                             # (floorRefId, x, y) of a MAC, or None
+        found = self._where.get(normalize_CMX_mac(mac))
+        return(found[:3] if found is not None else None)
+
+    def near(self,floorRefId,x,y,radius):               # [(distance, client), ...] within "radius" of (x,y), nearest first
+        Found = []
+        with self._lock:
+            grid = self._grids.get(str(floorRefId))
+            if grid is None:
+                return(Found)
+            (cx0, cy0), (cx1, cy1) = self._cell(x - radius, y - radius), self._cell(x + radius, y + radius)
+            if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(grid):  # Circle covers more cells than are in use.  Just check them all.
+                Cells = [cell for cell in grid.values()]
+            else:
+                Cells = [grid[(cx, cy)] for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1) if (cx, cy) in grid]
+            where = self._where
+            for cell in Cells:
+                for mac in cell:
+                    w = where[mac]
+                    d = math.hypot(w[1] - x, w[2] - y)
+                    if d <= radius:
+                        Found.append((d, self._clients[mac]))
+        Found.sort(key=lambda found: found[0])
+        return(Found)
+
+    def nearest(self,floorRefId,x,y,k,maxRadius=None):  # [(distance, client), ...] of the "k" clients nearest (x,y)
+        with self._lock:
+            grid = self._grids.get(str(floorRefId))
+            if grid is None or k <= 0:
+                return([])
+            cx, cy = self._cell(x, y)
+            Cells  = list(grid)
+            reach  = max(max(abs(c[0] - cx), abs(c[1] - cy)) for c in Cells)   # Furthest ring with a client in it
+            Heap   = []                                 # The k best so far, as (-distance, mac)
+            where  = self._where
+            for ring in range(reach + 1):               # Rings of cells around (cx,cy), nearest first
+                if ring == 0:
+                    Ring = [(cx, cy)]
+                else:
+                    Ring = [(cx + dx, cy + dy) for dx in range(-ring, ring + 1) for dy in (-ring, ring)] + \
+                           [(cx + dx, cy + dy) for dx in (-ring, ring) for dy in range(-ring + 1, ring)]
+                for key in Ring:
+                    cell = grid.get(key)
+                    if cell is None:
+                        continue
+                    for mac in cell:
+                        w = where[mac]
+                        d = math.hypot(w[1] - x, w[2] - y)
+                        if maxRadius is not None and d > maxRadius:
+                            continue
+                        if len(Heap) < k:
+                            heapq.heappush(Heap, (-d, mac))
+                        elif d < -Heap[0][0]:
+                            heapq.heapreplace(Heap, (-d, mac))
+                edge = ring * self.cellSize             # Every cell further out is at least this far from (x,y)
+                if (len(Heap) == k and -Heap[0][0] <= edge) or (maxRadius is not None and edge > maxRadius):
+                    break
+            Found = [(-d, self._clients[mac]) for d, mac in sorted(Heap, reverse=True)]
+        return(Found)
+
+    def __contains__(self,mac):
+        return(normalize_CMX_mac(mac) in self._where)
+
+    def __len__(self):
+        return(len(self._where))
+
+    def stats(self):
+        with self._lock:
+            cells = sum(len(grid) for grid in self._grids.values())
+            return({"clients": len(self._where), "floors": len(self._grids), "cells": cells,
+                    "perCell": len(self._where) / cells if cells else 0.0, "refreshes": self.refreshes})
+
+    def __str__(self):
+        s = self.stats()
+        return("Spatial Index: Clients: ["+str(s["clients"])+"]\tFloors: ["+str(s["floors"])+"]\tCells: ["+str(s["cells"])+"]\tPer Cell: ["+"{:.1f}".format(s["perCell"])+"]")
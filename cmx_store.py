@@ -0,0 +1,253 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_store() - defines the on-disk store of tracked clients.  [See:  TinyLoc in env_vars.py]
+#   - The InfectMacList and QuarantineMacList only live in memory, so a restart lost every incident and every MAC had to be
+#     looked up on CMX again.  The store keeps a copy of every tracked client on disk.
+#   - Writes are append-only:  each add, update, status change or purge is one JSON line at the end of a journal file, so a
+#     write never rewrites the file and a crash can at worst lose its last, half written line.
+#   - load() replays the journal into {mac: (client, status)}.  Clients are rebuilt straight from their fields without the
+#     parser, and their floors go back into the shared floor table.
+#   - Every update of a client adds a line, so the journal grows.  Once it holds "compactEvery" more lines than there are
+#     clients, it is compacted on a background thread:  the live clients are written to a new file that replaces the old
+#     one in a single rename.  Writes go on while it runs.  Only the lines written meanwhile are copied over with the lock
+#     held, so an append never waits for a compaction.
+
+import json, os, threading
+from cmx_classes import CMX_ClientLocation_v2, CMX_ClientLocation_v3, CMX_Floors, CMX_shared
+from cmx_parser import CMXjsonLoads
+
+CMX_StoreClasses = {"v2": CMX_ClientLocation_v2, "v3": CMX_ClientLocation_v3}
+
+# -------------------------------------------------------------------
+# CMX_client_record() - A client as a JSON-ready dictionary:  its class version and all of its fields.
+#   A v2 client's floor is stored as its list of values.  [See:  CMX_FloorInfo.values()]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_client_record(cmxClient):
+    version = "v3" if isinstance(cmxClient, CMX_ClientLocation_v3) else "v2"
+    fields = {}
+    for name in type(cmxClient).__slots__:
+        value = getattr(cmxClient, name, None)
+        if name == "floor":
+            value = list(value.values()) if value is not None else None
+        fields[name] = value
+    return({"v": version, "fields": fields})
+
+# -------------------------------------------------------------------
+# CMX_client_from_record() - Rebuilds a client from CMX_client_record().  Its strings are shared like a parsed client's.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_client_from_record(record):
+    cls = CMX_StoreClasses[record["v"]]
+    cmxClient = cls.__new__(cls)
+    for name, value in record["fields"].items():
+        if type(value) is str:
+            value = CMX_shared(value)
+        elif name == "floor" and value is not None:
+            value = CMX_Floors.intern(*value)
+        setattr(cmxClient, name, value)
+    return(cmxClient)
+
+
+# -------------------------------------------------------------------
+# CMX_ClientStore - Append-only journal of the tracked clients.
+#   path         - Journal file.  Its folder is created if needed.
+#   compactEvery - Extra journal lines (beyond one per live client) allowed before compact() runs on its own, in the
+#                  background.  [See:  wait()]
+#   sync         - os.fsync() after every write.  Safer across a power loss, but every write waits for the disk.
+#   All methods are thread safe.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_ClientStore:
+    def __init__ (self,path,compactEvery=1000,sync=False):
+        self.path         = str(path)
+        self.compactEvery = int(compactEvery)
+        self.sync         = sync
+        self.lines        = 0                           # Lines in the journal now
+        self.live         = set()                       # MACs stored now
+        self.writes       = 0
+        self.compactions  = 0
+        self.skipped      = 0                           # Bad lines skipped by the last load()
+        self._file        = None
+        self._lock        = threading.Lock()            # Guards the journal file and the counters
+        self._compactLock = threading.Lock()            # One compaction at a time
+        self._compactor   = None                        # Background compaction thread, while one runs
+        folder = os.path.dirname(self.path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def load(self):                                     # Replay the journal.  Returns {mac: (client, status)} in the order added.
+        with self._lock:
+            return(self._replay())
+
+    def _replay(self):                                  # (Caller holds the lock.)
+        Clients = {}
+        self.skipped = 0
+        self.lines   = 0
+        if os.path.isfile(self.path):
+            with open(self.path, "rb") as journal:
+                for line in journal:
+                    self.lines += 1
+                    try:
+                        entry = CMXjsonLoads(line)
+                        if entry["op"] == "put":
+                            Clients[entry["mac"]] = (CMX_client_from_record(entry["client"]), entry["status"])
+                        elif entry["op"] == "del":
+                            Clients.pop(entry["mac"], None)
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        self.skipped += 1               # A half written last line, or a line we can't read
+        self.live = set(Clients)
+        return(Clients)
+
+    def put(self,mac,cmxClient,status):                 # Record a client's current state
+        self._append({"op": "put", "mac": mac, "status": status, "client": CMX_client_record(cmxClient)}, mac, True)
+
+    def delete(self,mac):                               # Record a purged client
+        self._append({"op": "del", "mac": mac}, mac, False)
+
+    def _append(self,entry,mac,live):
+        line = (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            if self._file is None:
+                self._file = self._open()
+            self._file.write(line)
+            self._file.flush()
+            if self.sync:
+                os.fsync(self._file.fileno())
+            self.lines  += 1
+            self.writes += 1
+            if live:
+                self.live.add(mac)
+            else:
+                self.live.discard(mac)
+            if self.lines - len(self.live) > self.compactEvery and self._compactor is None:
+                self._compactor = threading.Thread(target=self._compact_background, name="CMX_store_compact", daemon=True)
+                self._compactor.start()
+
+    def _compact_background(self):
+        try:
+            self.compact()
+        except OSError as err:                          # Keep the journal as it is.  The next append tries again.
+            print("\n<<!>> CMX_ClientStore - Warning:  Compaction of [",self.path,"] failed:\t[",err,"]\n")
+        finally:
+            with self._lock:
+                self._compactor = None
+
+    def _open(self):                                    # Open the journal to append.  (Caller holds the lock.)
+        journal = open(self.path, "a+b")
+        if journal.tell() > 0:
+            journal.seek(journal.tell() - 1)
+            if journal.read(1) != b"\n":                # Don't run on from a half written line
+                journal.write(b"\n")
+                self.lines += 1
+        return(journal)
+
+    def compact(self,clients=None):                     # Rewrite the journal with one line per live client.  (Default:  from the journal.)
+        tmpname = "{}.{}.tmp".format(self.path, threading.get_ident())
+        with self._compactLock:
+            if clients is not None:
+                with open(tmpname, "w", encoding="utf-8") as snapshot:
+                    for mac, (cmxClient, status) in clients.items():
+                        snapshot.write(json.dumps({"op": "put", "mac": mac, "status": status, "client": CMX_client_record(cmxClient)},
+                                                  separators=(",", ":")) + "\n")
+                    snapshot.flush()
+                    os.fsync(snapshot.fileno())
+                with self._lock:
+                    self._swap(tmpname)
+                    self.lines = len(clients)
+                    self.live  = set(clients)
+                return(len(clients))
+            with self._lock:                            # Everything up to "end" is compacted without the lock
+                if self._file is not None:
+                    self._file.flush()
+                end = os.path.getsize(self.path) if os.path.isfile(self.path) else 0
+            Latest = self._latest(end)
+            with open(tmpname, "wb") as snapshot:
+                snapshot.writelines(Latest.values())
+                end, tail = self._copy_tail(end, snapshot)   # Most of what was written meanwhile, still without the lock
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+                with self._lock:
+                    if self._file is not None:
+                        self._file.flush()
+                    end, last = self._copy_tail(end, snapshot)
+                    if last > 0:
+                        snapshot.flush()
+                        os.fsync(snapshot.fileno())
+                    snapshot.close()
+                    self._swap(tmpname)
+                    self.lines = len(Latest) + tail + last
+        return(len(Latest))
+
+    def _latest(self,end):                              # {mac: last "put" line} of the journal up to byte "end"
+        Latest = {}
+        if end == 0:
+            return(Latest)
+        with open(self.path, "rb") as journal:
+            pos = 0
+            for line in journal:
+                pos += len(line)
+                if pos > end:
+                    break
+                try:
+                    entry = CMXjsonLoads(line)
+                    if entry["op"] == "put":
+                        Latest[entry["mac"]] = line if line.endswith(b"\n") else line + b"\n"
+                    elif entry["op"] == "del":
+                        Latest.pop(entry["mac"], None)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    pass                                # A half written line, or a line we can't read
+        return(Latest)
+
+    def _copy_tail(self,start,snapshot):                # Copy the journal from byte "start" on.  Returns (new end, lines copied).
+        if not os.path.isfile(self.path):
+            return(start, 0)
+        with open(self.path, "rb") as journal:
+            journal.seek(start)
+            tail = journal.read()
+        snapshot.write(tail)
+        return(start + len(tail), tail.count(b"\n"))
+
+    def _swap(self,tmpname):                            # Put the new journal in place.  (Caller holds the lock.)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.replace(tmpname, self.path)
+        self.compactions += 1
+
+    def wait(self):                                     # Wait for a background compaction to finish
+        compactor = self._compactor
+        if compactor is not None and compactor is not threading.current_thread():
+            compactor.join()
+        return()
+
+    def close(self):
+        self.wait()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self):
+        return({"clients": len(self.live), "lines": self.lines, "writes": self.writes, "compactions": self.compactions,
+                "skipped": self.skipped})
+
+    def __str__(self):
+        return("Client Store: ["+self.path+"]\tClients: ["+str(len(self.live))+"]\tLines: ["+str(self.lines)+"]\tCompactions: ["+str(self.compactions)+"]")
@@ -0,0 +1,117 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_synthetic() - builds synthetic CMX API data for benchmarks and offline testing.
+#   - The public sandboxes only hold a few hundred clients, and some days they hold none.  These routines build client
+#     records shaped like the real "/api/location/v2/clients" response, in any number, from a fixed random seed.
+#   - The values mirror the dCloud sandbox:  'Lexmark' clients on 'simfloor.jpg' floors of 400x400 FEET, with zones
+#     spread over each floor.
+
+import random
+from cmx_classes import CMX_ClientLocation_v2
+
+CMX_SyntheticFloorBase = 723413320329068590             # floorRefIds are numbered up from here
+CMX_SyntheticZones     = 12                             # Zones per floor
+
+# -------------------------------------------------------------------
+# make_CMX_mac() - The MAC address of synthetic client "i".  (Unique for any i below 2^32.)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def make_CMX_mac(i):
+    return("00:00:{:02x}:{:02x}:{:02x}:{:02x}".format((i >> 24) & 255, (i >> 16) & 255, (i >> 8) & 255, i & 255))
+
+# -------------------------------------------------------------------
+# make_CMX_v2_record() - One synthetic client, as a decoded JSON record from "/api/location/v2/clients".
+#   i           - Client number.  (Sets the MAC address.)
+#   floor       - Floor number.  (Sets the floorRefId and hierarchy.)
+#   rng         - random.Random() used for the position and zone.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def make_CMX_v2_record(i,floor,rng):
+    zone = rng.randrange(CMX_SyntheticZones)
+    return({"macAddress": make_CMX_mac(i),
+            "ipAddress": None,
+            "manufacturer": "Lexmark",
+            "mapCoordinate": {"x": round(rng.uniform(0, 400), 6), "y": round(rng.uniform(0, 400), 6), "z": 0, "unit": "FEET"},
+            "mapInfo": {"mapHierarchyString": "DevNetCampus>DevNetBuilding>DevNetZone{}>Zone{}".format(floor, zone),
+                        "floorRefId": str(CMX_SyntheticFloorBase + floor),
+                        "floorDimension": {"length": 400, "width": 400, "height": 10, "offsetX": 0, "offsetY": 4, "unit": "FEET"},
+                        "image": {"imageName": "simfloor.jpg", "zoomLevel": 5, "width": 2801, "height": 1912, "size": 3104,
+                                  "maxResolution": 16, "colorDepth": 8}},
+            "currentlyTracked": True,
+            "networkStatus": "ACTIVE",
+            "userName": "",
+            "statistics": {"currentServerTime": "2019-02-25T04:17:16.311+0000",
+                           "firstLocatedTime": "2019-02-25T04:03:38.397+0000",
+                           "lastLocatedTime": "2019-02-25T04:17:14.009+0000"}})
+
+# -------------------------------------------------------------------
+# make_CMX_v3_record() - One synthetic client, as a decoded JSON record from "/api/location/v3/clients".  (CMX 10.4+)
+#   Same client, floor and position as make_CMX_v2_record() gives for the same arguments and random state.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def make_CMX_v3_record(i,floor,rng):
+    zone = rng.randrange(CMX_SyntheticZones)
+    return({"deviceId": make_CMX_mac(i),
+            "locationMapHierarchy": "DevNetCampus>DevNetBuilding>DevNetZone{}>Zone{}".format(floor, zone),
+            "locationCoordinate": {"x": round(rng.uniform(0, 400), 6), "y": round(rng.uniform(0, 400), 6), "z": 0, "unit": "FEET"},
+            "geoCoordinate": {"latitude": -999, "longitude": -999, "unit": "DEGREES"},
+            "confidenceFactor": 24,
+            "userName": "",
+            "ipAddress": ["10.10.{}.{}".format((i >> 8) & 255, i & 255)],
+            "floorRefId": str(CMX_SyntheticFloorBase + floor),
+            "lastSeen": "2019-02-22T12:44:15.646+0000",
+            "manufacturer": "Lexmark",
+            "timestamp": 1550839455646,
+            "notificationTime": 1550839455646})
+
+# -------------------------------------------------------------------
+# make_CMX_v3_payload() - A full synthetic "/api/location/v3/clients" response.  [See:  make_CMX_v2_payload()]
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def make_CMX_v3_payload(n,floors=9,seed=0):
+    rng = random.Random(seed)
+    return([make_CMX_v3_record(i, i % floors, rng) for i in range(n)])
+
+# -------------------------------------------------------------------
+# make_CMX_v2_payload() - A full synthetic "/api/location/v2/clients" response:  a list of "n" records over "floors" floors.
+#   The same seed always gives the same payload.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def make_CMX_v2_payload(n,floors=9,seed=0):
+    rng = random.Random(seed)
+    return([make_CMX_v2_record(i, i % floors, rng) for i in range(n)])
+
+# -------------------------------------------------------------------
+# make_CMX_v2_clients() - "n" synthetic clients as CMX_ClientLocation_v2 objects.  (Same data as make_CMX_v2_payload().)
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def make_CMX_v2_clients(n,floors=9,seed=0):
+    rng = random.Random(seed)
+    Clist = []
+    for i in range(n):
+        r  = make_CMX_v2_record(i, i % floors, rng)
+        mi = r["mapInfo"]
+        fd = mi["floorDimension"]
+        im = mi["image"]
+        Clist.append(CMX_ClientLocation_v2(r["macAddress"], r["manufacturer"], r["mapCoordinate"]["unit"], r["mapCoordinate"]["x"],
+                                           r["mapCoordinate"]["y"], fd["height"], fd["length"], fd["offsetX"], fd["offsetY"], fd["unit"],
+                                           fd["width"], mi["floorRefId"], im["height"], im["imageName"], im["maxResolution"], im["size"],
+                                           im["width"], im["zoomLevel"], mi["mapHierarchyString"]))
+    return(Clist)
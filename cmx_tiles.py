@@ -0,0 +1,276 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+# cmx_tiles() - cuts the floor plans into tile pyramids, and draws the client overlays onto tiles.
+#   - A client map re-encodes the whole floor plan for one small icon.  A tile map only re-encodes the few tiles the
+#     icon touches, on each zoom level, so a position update writes a handful of small tiles instead of a full image.
+#   - Each floor image is cut once into "tileSize" square tiles at every zoom level, from the full image (the top level)
+#     down to the level that fits in one tile, halving each time.  The pyramid is kept on disk and only cut again when
+#     the floor image changes.
+#   - Tile files are named after a hash of their content (<z>_<x>_<y>.<hash>.jpg), so they never change once written and
+#     can be served from disk with a "cache forever" header.  A changed tile gets a new name.
+#   - "manifest.json" in each floor folder lists the base tiles.  "clients/<mac>.json" lists the overlay tiles of one client,
+#     which replace those base tiles.  Every other tile of the client's view is the base tile.
+
+import hashlib, io, json, math, os, threading
+from PIL import Image                                   # Image manipulation tools, From:  "pip install Pillow"
+from cmx_render import CMX_RenderProfiles, CMX_paste_icon
+
+
+# -------------------------------------------------------------------
+# CMX_write_tile() - Encodes a tile and writes it to "folder/<sub>/<name>.<hash><ext>", unless a tile with the same
+#   content is already there.  Like CMX_save_map(), the file is written to a temporary name and renamed into place.
+#   Returns (the path of the tile relative to "folder", True if it was written).
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_write_tile(tileImg,folder,sub,name,profile):
+    data = io.BytesIO()
+    tileImg.save(data, format=profile.fmt, **profile.options())
+    data = data.getvalue()
+    rel  = sub + "/" + name + "." + hashlib.sha1(data).hexdigest()[:12] + profile.ext
+    path = os.path.join(folder, rel)
+    if os.path.isfile(path):
+        return(rel, False)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmpname = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(tmpname, "wb") as f:
+        f.write(data)
+    os.replace(tmpname, path)
+    return(rel, True)
+
+def CMX_write_json(path,data):                          # Written to a temporary file and renamed, so a reader never sees half of it
+    tmpname = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+    with open(tmpname, "w") as f:
+        json.dump(data, f, separators=(",", ":"))
+    os.replace(tmpname, path)
+    return()
+
+def CMX_load_image(path):                               # Default icon loader of CMX_TilePyramid
+    img = Image.open(path)
+    img.load()
+    return(img)
+
+
+# -------------------------------------------------------------------
+# CMX_TilePyramid - The tile pyramid of one floor image, and the overlay tiles of the clients drawn on it.
+#   floorImage  - Floor plan file.
+#   folder      - Folder of this floor's tiles.
+#   tileSize    - Width and height of a tile in pixels.  (Tiles on the right and bottom edges can be smaller.)
+#   profile     - Format and quality of the tiles.  [See:  CMX_RenderProfile in cmx_render.py]  Its scale and crop are ignored.
+#   loader      - Routine that returns the decoded image of an icon file.  [See:  CMXimageCache]
+#   Zoom level "maxZoom" is the full size image.  Each level below it is half the size, down to level 0.
+#   Counters:  "cut" (base tiles written), "drawn" (overlay tiles written), "kept" (overlay tiles that didn't change).
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_TilePyramid:
+    def __init__ (self,floorImage,folder,tileSize=256,profile=None,loader=None):
+        self.floorImage   = floorImage
+        self.folder       = folder
+        self.tileSize     = int(tileSize)
+        self.profile      = profile or CMX_RenderProfiles["jpeg"]
+        self.loader       = loader or CMX_load_image
+        self.manifest     = None                        # Contents of "manifest.json", once built
+        self.cut          = 0
+        self.drawn        = 0
+        self.kept         = 0
+        self._clients     = {}                          # client name --> {"z/x/y": (overlay key, tile path)}
+        self._lock        = threading.RLock()
+
+    def _source(self):                                  # What the manifest must match to be reused
+        st = os.stat(self.floorImage)
+        return({"floorImage": os.path.basename(self.floorImage), "mtime": st.st_mtime_ns, "bytes": st.st_size,
+                "tileSize": self.tileSize, "format": self.profile.fmt, "quality": self.profile.quality})
+
+    def build(self,force=False):                        # Cuts the pyramid, unless the one on disk is still current.  Returns the manifest.
+        with self._lock:
+            source = self._source()
+            if not force:
+                if self.manifest is not None and self.manifest["source"] == source:
+                    return(self.manifest)
+                manifest = self._load("manifest.json")   # Cut before a restart?
+                if manifest is not None and manifest.get("source") == source and \
+                   all(os.path.isfile(os.path.join(self.folder, rel)) for rel in manifest["tiles"].values()):
+                    self.manifest = manifest
+                    return(self.manifest)
+            levelImg = Image.open(self.floorImage).convert("RGB")
+            maxZoom  = max(0, math.ceil(math.log2(max(levelImg.size) / self.tileSize)))
+            Levels, Tiles = {}, {}
+            for z in range(maxZoom, -1, -1):
+                if z < maxZoom:
+                    levelImg = levelImg.reduce(2)
+                Levels[str(z)] = list(levelImg.size)
+                for ty in range(math.ceil(levelImg.height / self.tileSize)):
+                    for tx in range(math.ceil(levelImg.width / self.tileSize)):
+                        box = (tx * self.tileSize, ty * self.tileSize,
+                               min((tx + 1) * self.tileSize, levelImg.width), min((ty + 1) * self.tileSize, levelImg.height))
+                        rel, written = CMX_write_tile(levelImg.crop(box), self.folder, "base", "{}_{}_{}".format(z, tx, ty), self.profile)
+                        Tiles["{}/{}/{}".format(z, tx, ty)] = rel
+                        self.cut += written
+            self.manifest = {"source": source, "tileSize": self.tileSize, "maxZoom": maxZoom, "levels": Levels, "tiles": Tiles}
+            CMX_write_json(os.path.join(self.folder, "manifest.json"), self.manifest)
+            self._prune("base", set(Tiles.values()))    # Tiles of the old floor image
+            return(self.manifest)
+
+    def place(self,name,xy,icon):                       # Draws a client at (x,y) in full size pixels.  Returns the path of its manifest.
+        with self._lock:
+            manifest = self.build()
+            iconImg  = self.loader(icon)
+            iconKey  = (icon, os.stat(icon).st_mtime_ns)
+            previous = self._clients.get(name)
+            if previous is None:                        # Not drawn since startup.  Its old tiles are replaced.
+                previous = {tile: (None, rel) for tile, rel in (self._load("clients/" + name + ".json") or {"tiles": {}})["tiles"].items()}
+            Overlay = {}
+            for tile, (tx, ty, pxy) in self.touched(xy, iconImg.size).items():
+                baseRel = manifest["tiles"][tile]
+                key = (baseRel, pxy, iconKey)           # What the tile looks like:  the base tile, where the icon sits on it, and the icon
+                if previous.get(tile, (None,))[0] == key:
+                    Overlay[tile] = previous[tile]
+                    self.kept += 1
+                    continue
+                tileImg = Image.open(os.path.join(self.folder, baseRel)).convert("RGB")
+                CMX_paste_icon(tileImg, iconImg, pxy)
+                rel, written = CMX_write_tile(tileImg, self.folder, "clients/" + name, tile.replace("/", "_"), self.profile)
+                Overlay[tile] = (key, rel)
+                self.drawn += 1
+            self._clients[name] = Overlay
+            ofname = os.path.join(self.folder, "clients", name + ".json")
+            os.makedirs(os.path.dirname(ofname), exist_ok=True)
+            CMX_write_json(ofname, {"floor": "manifest.json", "xy": [round(xy[0]), round(xy[1])], "icon": os.path.basename(icon),
+                                    "tiles": {tile: rel for tile, (key, rel) in Overlay.items()}})
+            self._prune("clients/" + name, set(rel for key, rel in Overlay.values()))
+            return(ofname)
+
+    def touched(self,xy,iconSize):                      # {"z/x/y": (x, y, icon centre on that tile)} of the tiles an icon at (x,y) covers
+        Tiles = {}
+        maxZoom = self.manifest["maxZoom"]
+        for z in range(maxZoom + 1):
+            width, height = self.manifest["levels"][str(z)]
+            f  = 2 ** (maxZoom - z)
+            cx = round(xy[0] / f)
+            cy = round(xy[1] / f)
+            left, top = cx - iconSize[0] // 2, cy - iconSize[1] // 2
+            right  = min(left + iconSize[0], width) - 1
+            bottom = min(top + iconSize[1], height) - 1
+            for ty in range(max(top, 0) // self.tileSize, bottom // self.tileSize + 1 if bottom >= 0 else 0):
+                for tx in range(max(left, 0) // self.tileSize, right // self.tileSize + 1 if right >= 0 else 0):
+                    Tiles["{}/{}/{}".format(z, tx, ty)] = (tx, ty, (cx - tx * self.tileSize, cy - ty * self.tileSize))
+        return(Tiles)
+
+    def remove(self,name):                              # Deletes the overlay of a client
+        with self._lock:
+            self._clients.pop(name, None)
+            try:
+                os.remove(os.path.join(self.folder, "clients", name + ".json"))
+            except OSError:
+                pass
+            self._prune("clients/" + name, set())
+            try:
+                os.rmdir(os.path.join(self.folder, "clients", name))
+            except OSError:
+                pass
+            return()
+
+    def clients(self):                                  # Names of the clients drawn since startup
+        return(list(self._clients))
+
+    def _load(self,rel):
+        try:
+            with open(os.path.join(self.folder, rel)) as f:
+                return(json.load(f))
+        except (OSError, ValueError):
+            return(None)
+
+    def _prune(self,sub,keep):                          # Deletes the tiles in "sub" that aren't in "keep"
+        folder = os.path.join(self.folder, sub)
+        if not os.path.isdir(folder):
+            return()
+        for f in os.listdir(folder):
+            if sub + "/" + f not in keep:
+                try:
+                    os.remove(os.path.join(folder, f))
+                except OSError:
+                    pass
+        return()
+
+    def stats(self):
+        return({"floorImage": self.floorImage, "maxZoom": self.manifest["maxZoom"] if self.manifest else None,
+                "tiles": len(self.manifest["tiles"]) if self.manifest else 0, "clients": len(self._clients),
+                "cut": self.cut, "drawn": self.drawn, "kept": self.kept})
+
+    def __str__(self):
+        s = self.stats()
+        return("Tile Pyramid: ["+os.path.basename(s["floorImage"])+"]\tZoom: [0-"+str(s["maxZoom"])+"]\tTiles: ["+str(s["tiles"])+"]\tClients: ["+str(s["clients"])+"]\tCut: ["+str(s["cut"])+"]\tDrawn: ["+str(s["drawn"])+"]\tKept: ["+str(s["kept"])+"]")
+
+
+# -------------------------------------------------------------------
+# CMX_TileCache - The tile pyramids of every floor image, in one folder per floor ("folder/<floor image name>/").
+#   A client is drawn on one floor at a time.  When it moves to another floor, its overlay on the old floor is removed.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_TileCache:
+    def __init__ (self,folder,tileSize=256,profile=None,loader=None):
+        self.folder       = folder
+        self.tileSize     = int(tileSize)
+        self.profile      = profile
+        self.loader       = loader
+        self._pyramids    = {}                          # floor image --> CMX_TilePyramid
+        self._floorOf     = {}                          # client name --> floor image it is drawn on
+        self._lock        = threading.Lock()
+
+    def pyramid(self,floorImage):                       # Pyramid of a floor image, cut the first time it is asked for
+        with self._lock:
+            pyramid = self._pyramids.get(floorImage)
+            if pyramid is None:
+                name    = os.path.splitext(os.path.basename(floorImage))[0]
+                pyramid = self._pyramids[floorImage] = CMX_TilePyramid(floorImage, os.path.join(self.folder, name),
+                                                                       self.tileSize, self.profile, self.loader)
+        pyramid.build()
+        return(pyramid)
+
+    def build_all(self,floorImages):                    # Cuts (or checks) the pyramid of each floor image.  Returns how many there are.
+        for floorImage in floorImages:
+            self.pyramid(floorImage)
+        return(len(self._pyramids))
+
+    def place(self,name,floorImage,xy,icon):            # Draws a client on a floor.  Returns the path of its manifest.
+        with self._lock:
+            old = self._floorOf.get(name)
+            self._floorOf[name] = floorImage
+        if old is not None and old != floorImage:
+            self._pyramids[old].remove(name)
+        return(self.pyramid(floorImage).place(name, xy, icon))
+
+    def remove(self,name):
+        with self._lock:
+            floorImage = self._floorOf.pop(name, None)
+        if floorImage is not None:
+            self._pyramids[floorImage].remove(name)
+        return()
+
+    def stats(self):
+        with self._lock:
+            Pyramids = [p.stats() for p in self._pyramids.values()]
+            return({"floors": len(Pyramids), "clients": len(self._floorOf), "tiles": sum(p["tiles"] for p in Pyramids),
+                    "cut": sum(p["cut"] for p in Pyramids), "drawn": sum(p["drawn"] for p in Pyramids),
+                    "kept": sum(p["kept"] for p in Pyramids)})
+
+    def __str__(self):
+        s = self.stats()
+        return("Tile Cache: Floors: ["+str(s["floors"])+"]\tClients: ["+str(s["clients"])+"]\tTiles: ["+str(s["tiles"])+"]\tCut: ["+str(s["cut"])+"]\tDrawn: ["+str(s["drawn"])+"]\tKept: ["+str(s["kept"])+"]")
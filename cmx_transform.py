@@ -0,0 +1,131 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+# cmx_transform() - defines the floor transforms that turn CMX client coordinates into pixels on the floor image.
+#   - CMX reports a client position in floor units (FEET on the sandboxes), measured from the floor's offset.  The floor
+#     image is a different size again:  the CMX metadata says 2801x1912, while the copy on disk can be any size.
+#   - A CMX_FloorTransform is worked out once per floor from the floor dimensions, offsets and image sizes:
+#         pixel = (position - offset) * (image pixels per floor unit) * (disk image size / CMX image size)
+#     and is cached by floorRefId, so mapping a client is two multiplies and two adds.
+#   - apply_many() transforms a whole batch of clients in one NumPy pass when NumPy is installed, and in a plain loop
+#     when it isn't.
+
+import threading
+
+try:
+    import numpy                                        # Vectorized batches, From:  "pip install numpy"  (Optional)
+except ImportError:
+    numpy = None
+
+CMX_UnitMeters = {"FEET": 0.3048, "FOOT": 0.3048, "METER": 1.0, "METERS": 1.0, "INCH": 0.0254, "INCHES": 0.0254,
+                  "CENTIMETER": 0.01, "CENTIMETERS": 0.01}   # Length of one unit in meters
+
+# -------------------------------------------------------------------
+# CMX_unit_factor() - Multiplier that converts a length from one unit to another.  Unknown units are left alone.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_unit_factor(fromUnit,toUnit):
+    fromMeters = CMX_UnitMeters.get(str(fromUnit).upper())
+    toMeters   = CMX_UnitMeters.get(str(toUnit).upper())
+    if fromMeters is None or toMeters is None:
+        return(1.0)
+    return(fromMeters / toMeters)
+
+
+# -------------------------------------------------------------------
+# CMX_FloorTransform - Floor position --> pixel on the floor image, for one floor.
+#   floor       - The floor [CMX_FloorInfo].  "None" (a floor we don't know) maps one floor unit to one pixel.
+#   imageSize   - (width, height) of the floor image actually drawn on.
+#   Pixels are the centre of the client, clamped to the image, so a client just off the floor is still drawn on its edge.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_FloorTransform:
+    __slots__ = ("floor", "unit", "width", "height", "scaleX", "scaleY", "offsetX", "offsetY")
+    def __init__ (self,floor,imageSize):
+        self.floor       = floor
+        self.width       = int(imageSize[0])
+        self.height      = int(imageSize[1])
+        if floor is None or floor.width <= 0 or floor.length <= 0:
+            self.unit    = None
+            self.scaleX  = self.scaleY  = 1.0
+            self.offsetX = self.offsetY = 0.0
+            return
+        cmxWidth  = floor.imageWidth  if floor.imageWidth  > 0 else self.width   # Image size according to CMX
+        cmxHeight = floor.imageHeight if floor.imageHeight > 0 else self.height
+        self.unit    = floor.unit
+        self.scaleX  = (cmxWidth  / floor.width)  * (self.width  / cmxWidth)     # floor units --> CMX pixels --> disk pixels
+        self.scaleY  = (cmxHeight / floor.length) * (self.height / cmxHeight)
+        self.offsetX = float(floor.offsetX)
+        self.offsetY = float(floor.offsetY)
+
+    def apply(self,x,y,unit=None):                      # One position --> (x, y) pixel
+        factor = 1.0 if unit is None or self.unit is None else CMX_unit_factor(unit, self.unit)
+        px = round((x * factor - self.offsetX) * self.scaleX)
+        py = round((y * factor - self.offsetY) * self.scaleY)
+        return((min(max(px, 0), self.width - 1), min(max(py, 0), self.height - 1)))
+
+    def apply_many(self,xs,ys,unit=None):               # Lists of positions --> list of (x, y) pixels
+        factor = 1.0 if unit is None or self.unit is None else CMX_unit_factor(unit, self.unit)
+        if numpy is not None:
+            px = numpy.rint((numpy.asarray(xs, dtype=float) * factor - self.offsetX) * self.scaleX)
+            py = numpy.rint((numpy.asarray(ys, dtype=float) * factor - self.offsetY) * self.scaleY)
+            px = numpy.clip(px, 0, self.width - 1).astype(int)
+            py = numpy.clip(py, 0, self.height - 1).astype(int)
+            return(list(zip(px.tolist(), py.tolist())))
+        return([self.apply(x, y, unit) for x, y in zip(xs, ys)])
+
+    def __str__(self):
+        return("Floor Transform: ["+(self.floor.floorRefId if self.floor is not None else "None")+"]\tImage: ["+str(self.width)+"x"+str(self.height)+
+               "]\tScale: ["+format(self.scaleX, ".3f")+", "+format(self.scaleY, ".3f")+"]\tOffset: ["+str(self.offsetX)+", "+str(self.offsetY)+"]")
+
+
+# -------------------------------------------------------------------
+# CMX_TransformCache - The floor transforms worked out so far, keyed by floorRefId and image size.
+#   A transform is rebuilt when the floor's metadata changes.  [See:  CMX_FloorTable]  Counters:  "hits" and "misses".
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_TransformCache:
+    def __init__ (self):
+        self.hits         = 0
+        self.misses       = 0
+        self._entries     = {}                          # (floorRefId, image size) --> CMX_FloorTransform
+        self._lock        = threading.Lock()
+
+    def get(self,floor,imageSize):
+        key = (floor.floorRefId if floor is not None else None, tuple(imageSize))
+        transform = self._entries.get(key)
+        if transform is not None and (transform.floor is floor or transform.floor == floor):
+            self.hits += 1
+            return(transform)
+        transform = CMX_FloorTransform(floor, imageSize)
+        with self._lock:
+            self.misses += 1
+            self._entries[key] = transform
+        return(transform)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return(len(self._entries))
+
+    def __str__(self):
+        return("Transform Cache: Floors: ["+str(len(self._entries))+"]\tHits: ["+str(self.hits)+"]\tMisses: ["+str(self.misses)+"]")
@@ -0,0 +1,64 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+# test_parser() - CMX_Parser on records with null fields.  A null optional value gets its default, and any other bad
+#   record is skipped and counted, without losing the rest of the batch.
+#   Run with:  python -m unittest discover tests    (or:  python -m pytest tests)
+
+import copy, os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cmx_classes import CMX_ClientLocation_v2, CMX_ClientLocation_v3
+from cmx_parser import CMX_Parser, CMX_ParseReport, CMX_v2ClientSchema, CMX_v3ClientSchema
+from cmx_synthetic import make_CMX_v2_payload, make_CMX_v3_payload
+
+
+class CMX_ParserTest(unittest.TestCase):
+
+    def parse(self,schema,cls,records):
+        report = CMX_ParseReport()
+        Clist  = CMX_Parser(schema, cls).parse(records, report)
+        return(Clist, report)
+
+    def test_v3_null_optional_block_and_leaf(self):
+        records = copy.deepcopy(make_CMX_v3_payload(6))
+        records[1]["geoCoordinate"]      = None     # Null optional block:  defaults
+        records[2]["manufacturer"]       = None     # Null optional leaf:  default
+        records[3]["geoCoordinate"]      = "n/a"    # Optional block that isn't a block:  bad
+        records[4]["locationCoordinate"] = None     # Null required block:  bad
+        Clist, report = self.parse(CMX_v3ClientSchema, CMX_ClientLocation_v3, records)
+        self.assertEqual([c.deviceId for c in Clist], [records[i]["deviceId"] for i in (0, 1, 2, 5)])
+        self.assertEqual((Clist[1].geoCoordLat, Clist[1].geoCoordLong, Clist[1].geoCoordUnit), (-999, -999, "DEGREES"))
+        self.assertEqual(Clist[2].manufacturer, "Unknown")
+        self.assertEqual((report.records, report.parsed, report.bad), (6, 4, 2))
+        self.assertEqual([e[0] for e in report.errors], [3, 4])
+        self.assertTrue(report.errors[0][1].startswith("AttributeError"))
+
+    def test_v2_null_required_leaf(self):           # v2 has no optional fields.  A null in a block is one bad record.
+        records = copy.deepcopy(make_CMX_v2_payload(3))
+        records[1]["mapInfo"] = None
+        Clist, report = self.parse(CMX_v2ClientSchema, CMX_ClientLocation_v2, records)
+        self.assertEqual([c.macAddress for c in Clist], [records[0]["macAddress"], records[2]["macAddress"]])
+        self.assertEqual((report.parsed, report.bad), (2, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
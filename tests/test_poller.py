@@ -0,0 +1,129 @@
+'''
+Copyright (c) 2018, Cisco Systems, Inc. All rights reserved.
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+The above copyright notice and this permission notice shall be included in all
+copies or substantial portions of the Software.
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+SOFTWARE.
+'''
+
+
+# test_poller() - CMX_Poller against a CMX that fails.  An outage must not look like every tracked client moved.
+#   Run with:  python -m unittest discover tests    (or:  python -m pytest tests)
+
+import importlib.util, os, sys, tempfile, unittest
+
+Here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, Here)
+
+from cmx_mockserver import CMX_MockCMX
+from cmx_poller import CMX_Poller, CMX_client_position
+from cmx_session import CMX_LocalTransport
+
+# -------------------------------------------------------------------
+# CMX_FailingCMX - Wraps a CMX_MockCMX.  Client list calls answer "503" once "failing" is set.  With "fromPage", only
+#   the pages from that one on fail, so a bulk walk stops part way.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+class CMX_FailingCMX:
+    def __init__ (self,cmx,fromPage=None):
+        self.cmx          = cmx
+        self.fromPage     = fromPage                    # First page that fails.  (None:  every client call fails)
+        self.failing      = False
+
+    def handle(self,path,headers=None):
+        if self.failing and "/clients" in path and "/count" not in path:
+            page = int(path.split("page=")[1].split("&")[0]) if "page=" in path else None
+            if self.fromPage is None or (page is not None and page >= self.fromPage):
+                return(503, "Service Unavailable", b"")
+        return(self.cmx.handle(path, headers))
+
+# -------------------------------------------------------------------
+# CMX_modules() - A fresh copy of CMX-Modules.py, talking to "cmx" and drawing no maps.
+# - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - - -
+#
+def CMX_modules(cmx):
+    spec = importlib.util.spec_from_file_location("CMX_Modules_test", os.path.join(Here, "CMX-Modules.py"))
+    m    = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(m)
+    m.CMX_Persist   = False
+    m.CMXclientMaps = False
+    m.CMXfloorMaps  = False
+    m.CMXtileMaps   = False
+    m.set_CMX_transport(CMX_LocalTransport(cmx.handle))
+    m.CMX_init()
+    m.CMXpoller.add_listener(m.apply_CMX_changes)
+    return(m)
+
+def Positions(m):
+    return({m.normalize_CMX_mac(m.get_CMXclient_mac(c)): CMX_client_position(c) for c in m.CMXregistry.clients()})
+
+
+class CMX_PollerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock    = CMX_MockCMX(120, seed=1)
+        self.cmx     = CMX_FailingCMX(self.mock)
+        self.m       = CMX_modules(self.cmx)
+        self.folder  = tempfile.TemporaryDirectory()
+        self.m.MacMaps = self.folder.name + "/"
+
+    def tearDown(self):
+        self.m.CMXsession.close()
+        self.folder.cleanup()
+
+    def track(self,n):
+        macs   = [r["macAddress"] for r in self.mock.records[:n]]
+        Looked = self.m.CMX_lookup_many(macs)
+        self.assertTrue(all(c is not None for c in Looked.values()))
+        return(macs)
+
+    def test_moves_are_reported(self):                  # The poller does see real moves.  (So the tests below mean something.)
+        self.track(5)
+        self.mock.move(1.0, step=50.0)
+        self.assertGreater(len(self.m.CMXpoller.poll()), 0)
+
+    def test_failing_cmx_keeps_positions(self):         # Each MAC asked on its own, and each call fails
+        self.track(5)
+        before = Positions(self.m)
+        self.mock.move(1.0, step=50.0)
+        self.cmx.failing = True
+        self.assertEqual(self.m.CMXpoller.poll(), [])
+        self.assertEqual(Positions(self.m), before)
+        self.assertEqual(self.m.CMXpoller.failed, 5)
+        self.assertEqual(self.m.CMXlocationCache.stats()["negativeHits"], 0)
+
+    def test_failing_bulk_walk_keeps_positions(self):   # One bulk walk of the client list, that fails after the first page
+        self.m.CMXbulkThreshold = 10
+        self.m.CMXpageSize      = 40
+        self.cmx.fromPage       = 2
+        self.track(len(self.mock.records))
+        before = Positions(self.m)
+        self.cmx.failing = True
+        self.assertEqual(self.m.CMXpoller.poll(), [])
+        self.assertEqual(Positions(self.m), before)
+        self.assertEqual(self.m.CMXpoller.failed, len(self.mock.records) - self.m.CMXpageSize)
+
+    def test_placeholder_keeps_position(self):          # CMX answers, but has no location for a client we hold one for
+        macs   = self.track(1)
+        before = Positions(self.m)
+        placeholder = self.m.Empty_v2_Client(macs[0])
+        poller = CMX_Poller(self.m.CMXregistry.clients, lambda macs: {mac: placeholder for mac in macs})
+        poller.add_listener(self.m.apply_CMX_changes)
+        self.assertEqual(poller.poll(), [])
+        self.assertEqual(Positions(self.m), before)
+        self.assertEqual(poller.unseen, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()